@@ -1,29 +1,50 @@
 import sys
 import os
 from pathlib import Path
-import re
 import json
 import csv
+import logging
+import multiprocessing
+import time
 from datetime import datetime
+from collections import deque
 
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QLabel, QLineEdit,
     QPushButton, QVBoxLayout, QHBoxLayout, QGridLayout, QGroupBox,
     QMessageBox, QFileDialog, QInputDialog, QTextEdit,
-    QTreeWidget, QTreeWidgetItem, QMenu, QAction, QHeaderView,
+    QTreeWidget, QTreeWidgetItem, QTreeView, QMenu, QAction, QHeaderView,
     QToolTip, QCheckBox, QScrollArea, QScrollBar, QMenuBar, QActionGroup,
-    QStyleFactory, QDialog, QSpacerItem, QSizePolicy
+    QStyleFactory, QDialog, QSpacerItem, QSizePolicy, QComboBox, QPlainTextEdit,
+    QProgressDialog, QFrame, QListWidget, QSpinBox
 )
-from PyQt5.QtGui import QIcon, QFont, QClipboard, QPixmap, QColor
+from PyQt5.QtGui import QIcon, QFont, QClipboard, QPixmap, QCloseEvent
 from PyQt5.QtCore import Qt, pyqtSignal, QObject, QTimer, QEvent
 
-import openpyxl
-from openpyxl.styles import Alignment
-
-import pyzbar.pyzbar as pyzbar
 import threading
 import pyperclip
 
+import barcode_rules
+import scan_session
+from scan_session import ScanSession, SessionError
+from search_index import SubstringIndex
+from sqlite_store import SqliteStore
+from session_archive import SessionArchive
+from session_model import SessionItemModel
+from history_writer import HistoryWriter, FSYNC_INTERVAL
+from history_index import HistoryIndex
+from history_model import HistoryModel
+from csv_import import import_csv, write_rejects, CsvFormatError, ImportCancelled, CSV_HEADER
+from csv_merge import merge_directory, write_merge_report, MergeResult
+from image_import import decode_directory, decoder_error, stage_image, apply_image, write_image_report, STATUS_OK
+from excel_export import export_workbook, ExportCancelled, LAYOUT_PER_BOX, LAYOUT_TITLES
+from log_buffer import RingBufferHandler, setup_logging, LOG_FORMAT, LEVELS
+from scan_queue import ScanQueue, BurstDetector, DoubleScanFilter
+from scan_metrics import ScanMetrics
+from keyboard_layout import normalize
+
+logger = logging.getLogger(__name__)
+
 
 class ToolTip(QObject):
     def __init__(self, widget):
@@ -84,10 +105,51 @@ class ToolTip(QObject):
         self._tooltip_text = text
 
 
+class ScanCapture(QObject):
+    """Application-wide key filter for scanner bursts that would otherwise be lost.
+
+    Text inputs (the scan entries, search, edit dialogs) are left alone, they take scans
+    on purpose. Anywhere else the focused widget still gets the characters, but the
+    Enter ending a burst is swallowed (it would press a dialog's default button) and
+    the scan is queued.
+    """
+
+    def __init__(self, accepts_text, on_scan):
+        super().__init__()
+        self.accepts_text = accepts_text
+        self.on_scan = on_scan
+        self.detector = BurstDetector()
+
+    def eventFilter(self, watched, event):
+        # Every widget on the propagation path sees the event, only the focused one counts
+        if event.type() != QEvent.KeyPress or watched is not (QApplication.focusWidget() or QApplication.activeWindow()):
+            return False
+        if self.accepts_text(watched):
+            return False
+        if event.key() in (Qt.Key_Return, Qt.Key_Enter):
+            text = self.detector.end()
+            if text is None:
+                return False
+            self.on_scan(text)
+            return True
+        if event.text() and event.text().isprintable():
+            self.detector.feed(event.text())
+        return False
+
+
 class QBarcodeApp(QMainWindow):
-    def __init__(self):
+    history_write_failed = pyqtSignal(str)
+    export_progress = pyqtSignal(int, int)
+    export_finished = pyqtSignal(str, str, bool)  # path, error message, cancelled
+    import_progress = pyqtSignal(int, int)
+    import_finished = pyqtSignal(object, bool)  # ImportResult or the exception, merge
+    image_decoded = pyqtSignal(str, object, str)  # path, [(barcode, symbology)], error
+    image_import_finished = pyqtSignal(object)    # exception or None
+
+    def __init__(self, log_handler=None, log_dir=None):
+        # log_dir: where scan history files go, next to the program by default
         super().__init__()
-        print("__init__ started")  # DEBUG
+        logger.debug("__init__ started")
         self.setWindowTitle("ScanBox")
 
         if getattr(sys, '_MEIPASS', None):
@@ -103,27 +165,64 @@ class QBarcodeApp(QMainWindow):
             try:
                 self.setWindowIcon(QIcon(icon_path))
             except Exception as e:
-                print(f"Не удалось установить иконку: {e}")
+                logger.warning("Не удалось установить иконку: %s", e)
 
-        self.log_dir = os.path.join(base_path, "logs")
+        self.log_dir = log_dir or os.path.join(base_path, "logs")
         os.makedirs(self.log_dir, exist_ok=True)
 
-        self.all_boxes = {}
-        self.current_box_barcode = ""
-        self.search_query = ""
         # --- JSON State File Location: Hidden directory in user's home ---
         self.state_file_dir = Path(os.path.expanduser("~")) / ".ScanBox"
         os.makedirs(self.state_file_dir, exist_ok=True)
         self.state_file = str(self.state_file_dir / "barcode_app_state.json")
-        print(f"State file path: {self.state_file}") # DEBUG
+        # SQLite storage is opt-in (SCANBOX_STORE=sqlite) and sticks once the database exists
+        self.state_db_file = str(self.state_file_dir / "barcode_app_state.db")
+        if os.environ.get("SCANBOX_STORE", "").lower() == "sqlite" or os.path.exists(self.state_db_file):
+            self.session = ScanSession(store=SqliteStore(self.state_db_file, legacy_state_file=self.state_file), compact=True)
+        else:
+            self.session = ScanSession(self.state_file, compact=True)
+        self.session.subscribe(self.on_session_event)
+        logger.debug("State file path: %s", self.state_file)
+        # Sessions are sealed here on reset and shift end, see session_archive.py for queries
+        self.archive = SessionArchive(str(self.state_file_dir / "archive"))
+        self.archive_keep_days = 365
+        try:
+            self.archive.prune(self.archive_keep_days)
+        except Exception as e:
+            logger.warning("Archive prune failed: %s", e)
 
 
         self.box_bg_color = "#f2f2f2"
         self.history_file = None
+        self.history_writer = None
+        self.history_flush_interval = 1.0
+        self.history_fsync_policy = FSYNC_INTERVAL
+        self.history_write_failed.connect(self.on_history_write_failed)
         self.history_window = None
+        self.lookup_window = None
+        self.lookup_item_barcode = ""
+        self.log_handler = log_handler
+        self.export_thread = None
+        self.export_cancel = None
+        self.export_dialog = None
+        self.excel_layout = LAYOUT_PER_BOX
+        self.export_progress.connect(self.on_export_progress)
+        self.export_finished.connect(self.on_export_finished)
+        self.import_thread = None
+        self.import_cancel = None
+        self.import_dialog = None
+        self.import_progress.connect(self.on_import_progress)
+        self.import_finished.connect(self.on_import_finished)
+        self.image_results = []
+        self.image_decoded.connect(self.on_image_decoded)
+        self.image_import_finished.connect(self.on_image_import_finished)
+        self.debug_window = None
+        self.debug_max_lines = 2000
         self.history_tree = None
-        self.comments = {}
+        self.history_index = None
+        self.history_model = None
         self.history_filter_query = ""
+        self.search_index = SubstringIndex()
+        self.applied_search_query = ""
 
         self.COLOR_BG = "#f8f9fa"
         self.COLOR_FRAME_BG = "#ffffff"
@@ -153,8 +252,25 @@ class QBarcodeApp(QMainWindow):
         self.main_layout.setContentsMargins(10, 10, 10, 10)
 
         self.strict_validation_enabled = True
+        self.barcode_profile = barcode_rules.DEFAULT_PROFILE
+        # Custom marketplace profiles can be added in ~/.ScanBox/barcode_rules.json
+        self.barcode_profiles = barcode_rules.load_profiles(str(self.state_file_dir / "barcode_rules.json"))
+        self.update_validator()
+
+        self.scan_queue = ScanQueue()
+        self.double_scan_filter = DoubleScanFilter()
+        self.scan_drain_scheduled = False
+        self.scan_metrics = ScanMetrics()
+        self.scan_timer = None
+        self.view_time = 0.0  # seconds spent updating the view for session events
+        self.scan_errors = deque(maxlen=500)
+        self.persist_error_reported = False  # one banner per run of journal write failures
+        self.scan_error_count = 0
+        self.scan_errors_window = None
+        self.scan_errors_list = None
 
         self.create_menu_bar()
+        self.create_error_banner()
         self.create_search_frame()
         self.create_box_frame()
         self.create_item_scan_frame()
@@ -162,6 +278,12 @@ class QBarcodeApp(QMainWindow):
         self.create_control_frame()
         self.create_status_bar()
 
+        # Scanner bursts typed while a message box, the tree or a button has focus still reach the queue
+        self.scan_capture = ScanCapture(
+            lambda widget: isinstance(widget, (QLineEdit, QTextEdit, QPlainTextEdit)) and not widget.isReadOnly(),
+            self.enqueue_scan)
+        QApplication.instance().installEventFilter(self.scan_capture)
+
         self.load_state()
 
         self.clipboard = QApplication.clipboard()
@@ -169,7 +291,7 @@ class QBarcodeApp(QMainWindow):
         self.setStyleSheet(self.get_stylesheet())
 
         self.setGeometry(100, 100, 1280, 720)
-        print("__init__ finished") # DEBUG
+        logger.debug("__init__ finished")
 
     def get_stylesheet(self):
         return f"""
@@ -237,7 +359,7 @@ class QBarcodeApp(QMainWindow):
             QMenu::item:selected {{
                 background-color: #bbdefb;
             }}
-            QTreeWidget {{
+            QTreeView {{
                 font: 9pt "Segoe UI";
                 background-color: white;
                 alternate-background-color: #f0f0f0;
@@ -251,7 +373,7 @@ class QBarcodeApp(QMainWindow):
                 padding: 4px;
                 qproperty-alignment: AlignCenter;
             }}
-            QTreeWidget::item:selected {{
+            QTreeView::item:selected {{
                 background-color: #bbdefb;
                 color: black;
             }}
@@ -322,7 +444,7 @@ class QBarcodeApp(QMainWindow):
         """
 
     def create_menu_bar(self):
-        print("create_menu_bar started") # DEBUG
+        logger.debug("create_menu_bar started")
         menubar = QMenuBar(self)
         self.setMenuBar(menubar)
 
@@ -333,6 +455,10 @@ class QBarcodeApp(QMainWindow):
         action_reset.triggered.connect(self.reset_application)
         menu_menu.addAction(action_reset)
 
+        action_end_shift = QAction("Завершить смену", self)
+        action_end_shift.triggered.connect(self.end_shift)
+        menu_menu.addAction(action_end_shift)
+
         menu_menu.addSeparator()
 
         action_save_excel = QAction("Сохранить в Excel...", self)
@@ -350,6 +476,33 @@ class QBarcodeApp(QMainWindow):
         action_load_csv.triggered.connect(self.load_from_csv)
         import_export_menu.addAction(action_load_csv)
 
+        action_merge_csv_dir = QAction("Объединить папку станций...", import_export_menu)
+        action_merge_csv_dir.triggered.connect(self.merge_csv_directory)
+        import_export_menu.addAction(action_merge_csv_dir)
+
+        action_import_images = QAction("Загрузить из изображений...", import_export_menu)
+        action_import_images.triggered.connect(self.import_images)
+        import_export_menu.addAction(action_import_images)
+
+        action_save_duplicates = QAction("Сохранить товары в нескольких коробах...", import_export_menu)
+        action_save_duplicates.triggered.connect(self.save_duplicates_report)
+        import_export_menu.addAction(action_save_duplicates)
+
+        action_save_stats = QAction("Сохранить статистику сканирования...", import_export_menu)
+        action_save_stats.triggered.connect(self.save_scan_stats)
+        import_export_menu.addAction(action_save_stats)
+
+        menu_menu.addSeparator()
+
+        action_lookup = QAction("Где товар?...", self)
+        action_lookup.setShortcut("Ctrl+F")
+        action_lookup.triggered.connect(lambda: self.show_item_lookup())
+        menu_menu.addAction(action_lookup)
+
+        action_duplicates = QAction("Товары в нескольких коробах...", self)
+        action_duplicates.triggered.connect(self.show_duplicates)
+        menu_menu.addAction(action_duplicates)
+
         menu_menu.addSeparator()
 
         action_settings = QAction("Настройки...", menu_menu)
@@ -371,10 +524,10 @@ class QBarcodeApp(QMainWindow):
         action_exit.setShortcut("Ctrl+Q")
         action_exit.triggered.connect(self.on_closing)
         menu_menu.addAction(action_exit)
-        print("create_menu_bar finished") # DEBUG
+        logger.debug("create_menu_bar finished")
 
     def show_settings_dialog(self):
-        print("show_settings_dialog started") # DEBUG
+        logger.debug("show_settings_dialog started")
         settings_dialog = QDialog(self)
         settings_dialog.setWindowTitle("Настройки")
         settings_layout = QVBoxLayout()
@@ -384,22 +537,54 @@ class QBarcodeApp(QMainWindow):
         self.strict_validation_checkbox.setChecked(self.strict_validation_enabled)
         settings_layout.addWidget(self.strict_validation_checkbox)
 
+        settings_layout.addWidget(QLabel("Профиль штрихкодов:"))
+        self.barcode_profile_combo = QComboBox()
+        for name, definition in self.barcode_profiles.items():
+            if name != barcode_rules.LENIENT_PROFILE:
+                self.barcode_profile_combo.addItem(definition.get("title", name), name)
+        self.barcode_profile_combo.setCurrentIndex(max(self.barcode_profile_combo.findData(self.barcode_profile), 0))
+        settings_layout.addWidget(self.barcode_profile_combo)
+
+        settings_layout.addWidget(QLabel("Формат Excel:"))
+        self.excel_layout_combo = QComboBox()
+        for layout, title in LAYOUT_TITLES.items():
+            self.excel_layout_combo.addItem(title, layout)
+        self.excel_layout_combo.setCurrentIndex(max(self.excel_layout_combo.findData(self.excel_layout), 0))
+        settings_layout.addWidget(self.excel_layout_combo)
+
+        settings_layout.addWidget(QLabel("Игнорировать повторное считывание того же штрихкода в течение:"))
+        self.double_scan_window_spin = QSpinBox()
+        self.double_scan_window_spin.setRange(0, 5000)
+        self.double_scan_window_spin.setSingleStep(50)
+        self.double_scan_window_spin.setSuffix(" мс")
+        self.double_scan_window_spin.setSpecialValueText("Выключено")
+        self.double_scan_window_spin.setValue(self.double_scan_filter.window_ms)
+        settings_layout.addWidget(self.double_scan_window_spin)
+
         save_button = QPushButton("Сохранить")
         save_button.clicked.connect(lambda: self.save_settings(settings_dialog))
         settings_layout.addWidget(save_button)
 
         settings_dialog.exec_()
-        print("show_settings_dialog finished") # DEBUG
+        logger.debug("show_settings_dialog finished")
 
     def save_settings(self, settings_dialog):
-        print("save_settings started") # DEBUG
+        logger.debug("save_settings started")
         self.strict_validation_enabled = self.strict_validation_checkbox.isChecked()
+        self.barcode_profile = self.barcode_profile_combo.currentData()
+        self.session.set_setting("strict_validation_enabled", self.strict_validation_enabled)
+        self.session.set_setting("barcode_profile", self.barcode_profile)
+        self.excel_layout = self.excel_layout_combo.currentData()
+        self.session.set_setting("excel_layout", self.excel_layout)
+        self.double_scan_filter.window_ms = self.double_scan_window_spin.value()
+        self.session.set_setting("double_scan_window_ms", self.double_scan_filter.window_ms)
+        self.update_validator()
         self.save_state()
         settings_dialog.close()
-        print("save_settings finished") # DEBUG
+        logger.debug("save_settings finished")
 
     def create_search_frame(self):
-        print("create_search_frame started") # DEBUG
+        logger.debug("create_search_frame started")
         self.search_frame = QWidget()
         self.main_layout.addWidget(self.search_frame)
         search_layout = QHBoxLayout()
@@ -411,7 +596,11 @@ class QBarcodeApp(QMainWindow):
 
         self.search_entry = QLineEdit()
         search_layout.addWidget(self.search_entry)
-        self.search_entry.textChanged.connect(self.filter_items)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(250)
+        self.search_timer.timeout.connect(self.filter_items)
+        self.search_entry.textChanged.connect(self.search_timer.start)
         self.search_entry.setContextMenuPolicy(Qt.CustomContextMenu)
         self.search_entry.customContextMenuRequested.connect(lambda event: self.show_paste_menu(event, self.search_entry))
         self.search_entry.setMaximumWidth(300)
@@ -421,10 +610,10 @@ class QBarcodeApp(QMainWindow):
 
         spacer = QSpacerItem(40, 20, QSizePolicy.Expanding, QSizePolicy.Minimum)
         search_layout.addItem(spacer)
-        print("create_search_frame finished") # DEBUG
+        logger.debug("create_search_frame finished")
 
     def create_box_frame(self):
-        print("create_box_frame started") # DEBUG
+        logger.debug("create_box_frame started")
         self.box_frame = QGroupBox("Короб")
         self.main_layout.addWidget(self.box_frame)
         box_layout = QGridLayout()
@@ -436,7 +625,7 @@ class QBarcodeApp(QMainWindow):
         self.box_entry = QLineEdit()
         box_layout.addWidget(self.box_entry, 0, 1, 1, 1)
         self.box_entry.setMinimumWidth(200)
-        self.box_entry.returnPressed.connect(self.process_box_barcode)
+        self.box_entry.returnPressed.connect(lambda: self.enqueue_scan(self.box_entry.text(), "box"))
         self.box_entry.setContextMenuPolicy(Qt.CustomContextMenu)
         self.box_entry.customContextMenuRequested.connect(lambda event: self.show_paste_menu(event, self.box_entry))
         self.box_entry.setFocus()
@@ -452,10 +641,10 @@ class QBarcodeApp(QMainWindow):
         tooltip_box_entry.setToolTip("Введите или отсканируйте штрихкод короба")
 
         box_layout.setColumnStretch(1, 1)
-        print("create_box_frame finished") # DEBUG
+        logger.debug("create_box_frame finished")
 
     def create_item_scan_frame(self):
-        print("create_item_scan_frame started") # DEBUG
+        logger.debug("create_item_scan_frame started")
         self.item_scan_frame = QGroupBox("Сканирование товаров")
         self.main_layout.addWidget(self.item_scan_frame)
         item_scan_layout = QGridLayout()
@@ -467,7 +656,7 @@ class QBarcodeApp(QMainWindow):
         self.item_scan_entry = QLineEdit()
         item_scan_layout.addWidget(self.item_scan_entry, 0, 1, 1, 1)
         self.item_scan_entry.setMinimumWidth(200)
-        self.item_scan_entry.returnPressed.connect(self.process_item_barcode)
+        self.item_scan_entry.returnPressed.connect(self.on_item_entry_return)
         self.item_scan_entry.setContextMenuPolicy(Qt.CustomContextMenu)
         self.item_scan_entry.customContextMenuRequested.connect(lambda event: self.show_paste_menu(event, self.item_scan_entry))
         self.item_scan_entry.setEnabled(False)
@@ -483,19 +672,21 @@ class QBarcodeApp(QMainWindow):
 
         tooltip_autoclear = ToolTip(self.autoclear_item_entry)
         tooltip_autoclear.setToolTip("Автоматически очищать поле ввода штрихкода товара после каждого сканирования")
-        print("create_item_scan_frame finished") # DEBUG
+        logger.debug("create_item_scan_frame finished")
 
     def create_items_frame(self):
-        print("create_items_frame started") # DEBUG
+        logger.debug("create_items_frame started")
         self.items_frame = QGroupBox("Товары")
         self.main_layout.addWidget(self.items_frame)
         items_layout = QVBoxLayout()
         self.items_frame.setLayout(items_layout)
 
-        self.items_tree = QTreeWidget()
+        self.items_model = SessionItemModel(self.session, self.box_bg_color, self)
+        self.items_model.rowsInserted.connect(self.on_items_rows_inserted)
+        self.items_tree = QTreeView()
         items_layout.addWidget(self.items_tree)
-        self.items_tree.setColumnCount(4)
-        self.items_tree.setHeaderLabels(["Штрихкод короба", "Штрихкод товара", "Количество", "Комментарий"])
+        self.items_tree.setModel(self.items_model)
+        self.items_tree.setUniformRowHeights(True)
         self.items_tree.header().setSectionResizeMode(QHeaderView.Stretch)
         self.items_tree.header().setSectionResizeMode(0, QHeaderView.Interactive)
         self.items_tree.header().setSectionResizeMode(1, QHeaderView.Interactive)
@@ -505,40 +696,65 @@ class QBarcodeApp(QMainWindow):
         self.items_tree.setColumnWidth(1, 150)
         self.items_tree.setColumnWidth(2, 80)
         self.items_tree.setAlternatingRowColors(False)
-        self.items_tree.itemClicked.connect(self.clear_selection)
+        self.items_tree.clicked.connect(self.clear_selection)
         self.items_tree.customContextMenuRequested.connect(self.show_context_menu)
         self.items_tree.setContextMenuPolicy(Qt.CustomContextMenu)
-        self.items_tree.itemDoubleClicked.connect(self.on_double_click)
-        for i in range(self.items_tree.columnCount()):
-            self.items_tree.headerItem().setTextAlignment(i, Qt.AlignCenter)
+        self.items_tree.doubleClicked.connect(self.on_double_click)
         self.items_tree.setStyleSheet("QTreeView::item { text-align: center; }")
-        print("create_items_frame finished") # DEBUG
+        logger.debug("create_items_frame finished")
 
     def create_debug_console(self):
-        print("create_debug_console started") # DEBUG
+        # Shows the in-memory log ring buffer; logging itself does not depend on the console
+        logger.debug("create_debug_console started")
+        if self.debug_window and self.debug_window.isVisible():
+            self.debug_window.raise_()
+            self.debug_window.activateWindow()
+            return
+        if self.log_handler is None:
+            self.log_handler = RingBufferHandler()
+            self.log_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            logging.getLogger().addHandler(self.log_handler)
+
         self.debug_window = QDialog(self)
         self.debug_window.setWindowTitle("Debug Console")
         self.debug_window.setGeometry(100, 100, 600, 300)
-
-        self.debug_text = QTextEdit(self.debug_window)
         layout = QVBoxLayout(self.debug_window)
+
+        level_frame = QWidget()
+        layout.addWidget(level_frame)
+        level_layout = QHBoxLayout(level_frame)
+        level_layout.setContentsMargins(0, 0, 0, 0)
+        level_layout.addWidget(QLabel("Уровень:"))
+        level_combo = QComboBox()
+        level_combo.addItems(LEVELS)
+        level_combo.setCurrentText(logging.getLevelName(logging.getLogger().level))
+        level_combo.currentTextChanged.connect(logging.getLogger().setLevel)
+        level_layout.addWidget(level_combo)
+        level_layout.addStretch()
+
+        self.debug_text = QPlainTextEdit(self.debug_window)
+        self.debug_text.setReadOnly(True)
+        self.debug_text.setMaximumBlockCount(self.debug_max_lines)
         layout.addWidget(self.debug_text)
         self.debug_window.setLayout(layout)
-        self.debug_window.show()
 
-        sys.stdout = self
-        sys.stderr = self
-        print("create_debug_console finished") # DEBUG
-
-    def write(self, message):
-        self.debug_text.moveCursor(self.debug_text.textCursor().End)
-        self.debug_text.insertPlainText(message)
+        self.debug_seq = 0
+        self.debug_timer = QTimer(self.debug_window)
+        self.debug_timer.setInterval(200)
+        self.debug_timer.timeout.connect(self.flush_debug_console)
+        self.debug_window.finished.connect(self.debug_timer.stop)
+        self.flush_debug_console()
+        self.debug_timer.start()
+        self.debug_window.show()
+        logger.debug("create_debug_console finished")
 
-    def flush(self):
-        pass
+    def flush_debug_console(self):
+        self.debug_seq, lines = self.log_handler.since(self.debug_seq, self.debug_max_lines)
+        if lines:
+            self.debug_text.appendPlainText("\n".join(lines))
 
     def create_control_frame(self):
-        print("create_control_frame started") # DEBUG
+        logger.debug("create_control_frame started")
         self.control_frame = QWidget()
         self.main_layout.addWidget(self.control_frame)
         control_layout = QHBoxLayout()
@@ -563,87 +779,153 @@ class QBarcodeApp(QMainWindow):
         tooltip_save_button.setToolTip("Сохранить данные в файл Excel (Ctrl+S)")
 
         control_layout.addStretch()
-        print("create_control_frame finished") # DEBUG
+        logger.debug("create_control_frame finished")
 
     def create_status_bar(self):
-        print("create_status_bar started") # DEBUG
+        logger.debug("create_status_bar started")
         self.status_bar = self.statusBar()
         self.status_bar.setStyleSheet(f"QStatusBar{{background-color: {self.COLOR_HEADER_BG}; border-top: 1px solid #ced4da;}}")
-        print("create_status_bar finished") # DEBUG
-
-    def convert_ru_to_en_layout_box(self, barcode):
-        print(f"convert_ru_to_en_layout_box started with barcode: {barcode}") # DEBUG
-        if barcode.lower().startswith('ца'):
-            barcode = 'wb' + barcode[2:]
-            print(f"Converted box barcode to: {barcode}") # DEBUG
-        elif barcode.lower().startswith('ци_'):  # Recognize and convert "ЦИ_" to "WB_"
-            barcode = 'WB_' + barcode[3:] # Keep "WB_" uppercase
-            print(f"Converted box barcode ЦИ_ to: {barcode}") # DEBUG
-        return barcode
-
-    def convert_ru_to_en_layout_item(self, barcode):
-        print(f"convert_ru_to_en_layout_item started with barcode: {barcode}") # DEBUG
-        if barcode.lower().startswith('щят'):
-            barcode = 'OZN' + barcode[3:]  # Use 'OZN' in uppercase
-            print(f"Converted item barcode to: {barcode}") # DEBUG
-        return barcode
-
-    def process_box_barcode(self):
-        print("process_box_barcode started") # DEBUG
-        barcode_input = self.box_entry.text().strip()
-        print(f"Input box barcode: {barcode_input}") # DEBUG
-
-        barcode = self.convert_ru_to_en_layout_box(barcode_input) # Auto-convert layout
+        self.queue_label = QLabel()
+        self.status_bar.addPermanentWidget(self.queue_label)
+        # Scans per minute decay while the station is idle, so the label has its own clock
+        self.metrics_timer = QTimer(self)
+        self.metrics_timer.timeout.connect(self.update_queue_label)
+        self.metrics_timer.start(1000)
+        logger.debug("create_status_bar finished")
+
+    def normalize_barcode(self, barcode):
+        # Every barcode typed, scanned, pasted or edited passes here before validation
+        normalized = normalize(barcode.strip())
+        if normalized != barcode.strip():
+            logger.debug("normalize_barcode - Converted keyboard layout: %s -> %s", barcode, normalized)
+        return normalized
+
+    def on_item_entry_return(self):
+        # Cleared right away, so a burst arriving before the queue is drained starts on an empty field
+        text = self.item_scan_entry.text()
+        if self.autoclear_item_entry.isChecked():
+            self.item_scan_entry.clear()
+        self.enqueue_scan(text, "item")
+
+    def enqueue_scan(self, text, kind=None):
+        self.scan_queue.push(text, kind)
+        if not self.scan_drain_scheduled:
+            self.scan_drain_scheduled = True
+            QTimer.singleShot(0, self.drain_scans)
+
+    def drain_scans(self):
+        # Strictly in arrival order. Nothing below opens a modal dialog, errors go to the banner.
+        self.scan_drain_scheduled = False
+        while self.scan_queue:
+            text, kind, enqueued_at = self.scan_queue.pop()
+            if kind is None:
+                kind = "box" if self.box_entry.isEnabled() else "item"
+            # Compared as normalized, a bounce may come once in each keyboard layout
+            barcode = self.normalize_barcode(text)
+            if barcode and self.double_scan_filter.is_repeat(barcode, enqueued_at, kind):
+                # Scanner bounce: recorded in the history, not counted
+                self.log_scan(barcode, "dup")
+                self.update_status(f"Повторное считывание пропущено: {barcode}")
+                logger.debug("drain_scans - Suppressed double scan %s", text)
+                continue
+            self.scan_timer = timer = self.scan_metrics.start(enqueued_at)
+            timer.lap("queue")
+            accepted = False
+            try:
+                if kind == "box":
+                    accepted = self.process_box_barcode(text)
+                else:
+                    accepted = self.process_item_barcode(text)
+            except Exception as e:
+                logger.exception("drain_scans - Error processing %s scan %s", kind, text)
+                self.report_scan_error(f"Ошибка обработки: {e}", text)
+            finally:
+                self.scan_timer = None
+            latency = timer.finish(bool(accepted))
+            logger.debug("drain_scans - %s %s processed in %.1f ms, queue depth %s",
+                         kind, text, latency * 1000, len(self.scan_queue))
+        self.update_queue_label()
+
+    def update_queue_label(self):
+        self.queue_label.setText(f"Скорость: {self.scan_metrics.scans_per_minute():.0f} скан/мин | "
+                                 f"p95: {self.scan_metrics.p95_ms():.1f} мс | "
+                                 f"Очередь: {len(self.scan_queue)} (макс. {self.scan_queue.max_depth})")
+
+    def timed_mutation(self, timer, mutate, *args):
+        # Journal writes and view updates run inside the session call, they get their own stages
+        persist_time, view_time = self.session.persist_time, self.view_time
+        result = mutate(*args)
+        timer.nest("state_save", self.session.persist_time - persist_time)
+        timer.nest("tree_update", self.view_time - view_time)
+        timer.lap("mutation")
+        return result
+
+    def process_box_barcode(self, barcode_input):
+        # True when the scan was accepted
+        logger.debug("process_box_barcode started")
+        timer = self.scan_timer or self.scan_metrics.start()
+        barcode_input = barcode_input.strip()
+        logger.debug("Input box barcode: %s", barcode_input)
+
+        barcode = self.normalize_barcode(barcode_input)
         if not barcode:
-            self.show_warning("Введите штрихкод короба!")
-            print("process_box_barcode - Warning: Empty barcode") # DEBUG
+            self.report_scan_error("Введите штрихкод короба!")
+            logger.warning("process_box_barcode - Warning: Empty barcode")
             return
 
         if not self.is_valid_barcode(barcode, barcode_type='box'):
-            self.show_error("Неверный штрихкод короба!")
+            self.report_scan_error("Неверный штрихкод короба!", barcode)
             self.box_entry.clear()
-            print("process_box_barcode - Error: Invalid barcode") # DEBUG
+            logger.warning("process_box_barcode - Error: Invalid barcode")
             return
+        timer.lap("validation")
 
-        if barcode not in self.all_boxes:
-            self.all_boxes[barcode] = {}
-            print(f"process_box_barcode - New box added: {barcode}") # DEBUG
+        if self.timed_mutation(timer, self.session.select_box, barcode):
+            logger.debug("process_box_barcode - New box added: %s", barcode)
         else:
-            print(f"process_box_barcode - Existing box: {barcode}") # DEBUG
+            logger.debug("process_box_barcode - Existing box: %s", barcode)
 
-        self.current_box_barcode = barcode
+        self.box_entry.setText(barcode)  # the scan may have come from outside the entry
         self.box_entry.setEnabled(False)
         self.item_scan_entry.setEnabled(True)
         self.item_scan_entry.setFocus()
         self.save_button.setEnabled(True)
-        self.update_status(f"Текущий короб: {self.current_box_barcode}")
-        self.refresh_treeview()
         self.log_scan(barcode, "box")
+        timer.lap("history")
         self.highlight_entry(self.box_entry)
-        print("process_box_barcode finished") # DEBUG
+        timer.lap("highlight")
+        logger.debug("process_box_barcode finished")
+        return True
 
     def log_scan(self, barcode, barcode_type):
-        print(f"log_scan started - type: {barcode_type}, barcode: {barcode}") # DEBUG
+        logger.debug("log_scan started - type: %s, barcode: %s", barcode_type, barcode)
         if self.history_file is None:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             self.history_file = os.path.join(self.log_dir, f"scan_history_{timestamp}.log")
-            print(f"log_scan - History file created: {self.history_file}") # DEBUG
-        try:
-            with open(self.history_file, "a") as f:
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                f.write(f"{timestamp} - {barcode_type.upper()}: {barcode}\n")
-            print(f"log_scan - Logged: {barcode_type}, {barcode}") # DEBUG
-        except Exception as e:
-            self.show_error(f"Ошибка при записи в историю: {e}")
-            print(f"log_scan - Error writing to history: {e}") # DEBUG
-        print("log_scan finished") # DEBUG
+            logger.debug("log_scan - History file created: %s", self.history_file)
+        if self.history_writer is None:
+            self.history_writer = HistoryWriter(
+                self.history_file,
+                flush_interval=self.history_flush_interval,
+                fsync_policy=self.history_fsync_policy,
+                on_error=lambda e: self.history_write_failed.emit(str(e)),
+            )
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.history_writer.write(f"{timestamp} - {barcode_type.upper()}: {barcode}\n")
+        logger.debug("log_scan - Queued: %s, %s", barcode_type, barcode)
+        logger.debug("log_scan finished")
+
+    def on_history_write_failed(self, message):
+        # Emitted from the writer thread, shown once per run of failures instead of a dialog per line
+        self.update_status(f"Ошибка при записи в историю: {message}")
+        logger.error("on_history_write_failed - Error writing to history: %s", message)
 
     def show_history(self):
-        print("show_history started") # DEBUG
+        logger.debug("show_history started")
         if self.history_window and self.history_window.isVisible():
             self.history_window.raise_()
             self.history_window.activateWindow()
-            print("show_history - History window already visible, raised") # DEBUG
+            logger.debug("show_history - History window already visible, raised")
             return
 
         self.history_window = QDialog(self)
@@ -660,14 +942,31 @@ class QBarcodeApp(QMainWindow):
 
         self.history_filter_entry = QLineEdit()
         filter_layout.addWidget(self.history_filter_entry)
-        self.history_filter_entry.textChanged.connect(self.filter_history)
+        self.history_filter_timer = QTimer(self.history_window)
+        self.history_filter_timer.setSingleShot(True)
+        self.history_filter_timer.setInterval(250)
+        self.history_filter_timer.timeout.connect(self.filter_history)
+        self.history_filter_entry.textChanged.connect(self.history_filter_timer.start)
         self.history_filter_entry.setContextMenuPolicy(Qt.CustomContextMenu)
         self.history_filter_entry.customContextMenuRequested.connect(lambda event: self.show_paste_menu(event, self.history_filter_entry))
 
-        self.history_tree = QTreeWidget()
+        self.history_tree = QTreeView()
         layout.addWidget(self.history_tree)
-        self.history_tree.setColumnCount(3)
-        self.history_tree.setHeaderLabels(["Время", "Тип", "Штрихкод"])
+        self.history_tree.setRootIsDecorated(False)
+        self.history_tree.setUniformRowHeights(True)
+
+        # Picks up lines appended by the history writer while the window is open
+        self.history_follow_timer = QTimer(self.history_window)
+        self.history_follow_timer.setInterval(500)
+        self.history_follow_timer.timeout.connect(self.follow_history)
+        self.history_window.finished.connect(self.close_history)
+
+        self.load_history()
+        self.history_follow_timer.start()
+        self.history_window.show()
+        logger.debug("show_history finished")
+
+    def setup_history_columns(self):
         self.history_tree.header().setSectionResizeMode(QHeaderView.Stretch)
         self.history_tree.header().setSectionResizeMode(0, QHeaderView.Interactive)
         self.history_tree.header().setSectionResizeMode(1, QHeaderView.Interactive)
@@ -676,57 +975,70 @@ class QBarcodeApp(QMainWindow):
         self.history_tree.setColumnWidth(1, 50)
         self.history_tree.setColumnWidth(2, 300)
 
-        self.load_history()
-        self.history_window.show()
-        print("show_history finished") # DEBUG
-
     def load_history(self):
-        print("load_history started") # DEBUG
-        self.history_tree.clear()
+        # Maps the log and indexes its line offsets, rows are parsed only when shown
+        logger.debug("load_history started")
+        self.close_history_index()
 
         if not self.history_file:
-            print("load_history - No history file") # DEBUG
+            logger.debug("load_history - No history file")
             return
 
+        if self.history_writer is not None:
+            self.history_writer.flush()
+
         try:
-            if os.path.exists(self.history_file):
-                print(f"load_history - Loading history from: {self.history_file}") # DEBUG
-                with open(self.history_file, "r") as f:
-                    for line in f:
-                        line = line.strip()
-                        if not line:
-                            continue
-
-                        try:
-                            timestamp_str, rest = line.split(" - ", 1)
-                            barcode_type, barcode = rest.split(": ", 1)
-                            barcode_type = barcode_type.strip().lower()
-                            barcode = barcode.strip()
-                            QTreeWidgetItem(self.history_tree, [timestamp_str, barcode_type, barcode])
-                        except ValueError:
-                            print(f"load_history - Error parsing history line: '{line}'") # DEBUG
-                            continue
-
-        except FileNotFoundError:
-            print("load_history - File history not found.") # DEBUG
+            self.history_index = HistoryIndex(self.history_file)
+            self.history_index.refresh()
+            logger.debug("load_history - Indexed %s lines from: %s", len(self.history_index), self.history_file)
+            self.history_model = HistoryModel(self.history_index, self.history_window)
+            self.history_model.set_filter(self.history_filter_entry.text())
+            self.history_tree.setModel(self.history_model)
+            self.setup_history_columns()
         except Exception as e:
+            self.close_history_index()
             self.show_error(f"Ошибка при загрузке истории: {e}")
-            print(f"load_history - Error loading history: {e}") # DEBUG
-        print("load_history finished") # DEBUG
+            logger.error("load_history - Error loading history: %s", e)
+        logger.debug("load_history finished")
+
+    def follow_history(self):
+        if self.history_file and (self.history_index is None or self.history_index.path != self.history_file):
+            # The first scan after opening the window creates the log
+            self.load_history()
+            return
+        if self.history_index is None:
+            return
+        first_row = len(self.history_index)
+        try:
+            added = self.history_index.refresh()
+        except Exception as e:
+            logger.error("follow_history - Error reading history: %s", e)
+            return
+        if len(self.history_index) < first_row:
+            self.history_model.set_filter(self.history_model.filter_text)
+        elif added:
+            scrollbar = self.history_tree.verticalScrollBar()
+            at_bottom = scrollbar.value() == scrollbar.maximum()
+            self.history_model.append(first_row)
+            if at_bottom:
+                self.history_tree.scrollToBottom()
 
     def filter_history(self):
-        print("filter_history started") # DEBUG
-        filter_text = self.history_filter_entry.text().lower()
-        root = self.history_tree.invisibleRootItem()
-        child_count = root.childCount()
-        for i in range(child_count):
-            item = root.child(i)
-            values = [item.text(col) for col in range(self.history_tree.columnCount())]
-            if any(filter_text in str(v).lower() for v in values):
-                item.setHidden(False)
-            else:
-                item.setHidden(True)
-        print("filter_history finished") # DEBUG
+        # Debounced by history_filter_timer
+        if self.history_model is not None:
+            self.history_model.set_filter(self.history_filter_entry.text())
+
+    def close_history(self):
+        self.history_follow_timer.stop()
+        self.close_history_index()
+
+    def close_history_index(self):
+        if self.history_tree is not None:
+            self.history_tree.setModel(None)
+        self.history_model = None
+        if self.history_index is not None:
+            self.history_index.close()
+            self.history_index = None
 
     def create_tooltip(self, widget, text, delay=500):
         tooltip = ToolTip(widget)
@@ -735,12 +1047,12 @@ class QBarcodeApp(QMainWindow):
         return tooltip
 
     def show_about_window(self):
-        print("show_about_window started") # DEBUG
+        logger.debug("show_about_window started")
         try:
             if hasattr(self, 'about_window') and self.about_window and self.about_window.isVisible():
                 self.about_window.raise_()
                 self.about_window.activateWindow()
-                print("show_about_window - About window already visible, raised") # DEBUG
+                logger.debug("show_about_window - About window already visible, raised")
                 return
 
             self.about_window = QDialog(self)
@@ -773,10 +1085,10 @@ class QBarcodeApp(QMainWindow):
                         image_label.setAlignment(Qt.AlignCenter)
                         about_layout.addWidget(image_label)
                 else:
-                    print(f"Не удалось загрузить изображение из пути: {image_path}")
+                    logger.warning("Не удалось загрузить изображение из пути: %s", image_path)
 
             except Exception as e:
-                print(f"Не удалось загрузить изображение 'about_image.png': {e}")
+                logger.warning("Не удалось загрузить изображение 'about_image.png': %s", e)
 
             description_text = "Полностью перенесён функционал с tkinter в  pyqt вариант, будет ли оно работать - хз, всё для Алексея и дальнейших доработок, сырости этой реализации позавидует даже СПб, так что надеемся не отвалится :>"
             description_label = QLabel(description_text)
@@ -803,42 +1115,46 @@ class QBarcodeApp(QMainWindow):
 
         except Exception as error:
             self.show_error(f"Ошибка в окне 'О программе': {error}")
-            print(f"show_about_window - Error showing about window: {error}") # DEBUG
-        print("show_about_window finished") # DEBUG
+            logger.error("show_about_window - Error showing about window: %s", error)
+        logger.debug("show_about_window finished")
 
-    def process_item_barcode(self):
-        print("process_item_barcode started") # DEBUG
-        barcode_input = self.item_scan_entry.text().strip()
-        print(f"Input item barcode: {barcode_input}") # DEBUG
+    def process_item_barcode(self, barcode_input):
+        # True when the scan was accepted
+        logger.debug("process_item_barcode started")
+        timer = self.scan_timer or self.scan_metrics.start()
+        barcode_input = barcode_input.strip()
+        logger.debug("Input item barcode: %s", barcode_input)
 
-        barcode = self.convert_ru_to_en_layout_item(barcode_input) # Auto-convert layout
+        barcode = self.normalize_barcode(barcode_input)
 
-        if not self.current_box_barcode:
-            self.show_warning("Сначала отсканируйте штрихкод короба!")
+        if not self.session.current_box_barcode:
+            self.report_scan_error("Сначала отсканируйте штрихкод короба!", barcode)
             self.item_scan_entry.clear()
             self.box_entry.setFocus()
-            print("process_item_barcode - Warning: No box barcode scanned first") # DEBUG
+            logger.warning("process_item_barcode - Warning: No box barcode scanned first")
             return
         if not barcode:
-            self.show_warning("Введите штрихкод товара!")
-            print("process_item_barcode - Warning: Empty item barcode") # DEBUG
+            self.report_scan_error("Введите штрихкод товара!")
+            logger.warning("process_item_barcode - Warning: Empty item barcode")
             return
         if not self.is_valid_barcode(barcode, barcode_type='item'):
-            self.show_error("Неверный штрихкод товара!")
+            self.report_scan_error("Неверный штрихкод товара!", barcode)
             self.item_scan_entry.clear()
-            print("process_item_barcode - Error: Invalid item barcode") # DEBUG
+            logger.warning("process_item_barcode - Error: Invalid item barcode")
             return
-        if self.current_box_barcode not in self.all_boxes:
-            QMessageBox.showerror(self, "Ошибка", "Текущий короб не найден!")
-            print("process_item_barcode - Error: Current box not found in all_boxes") # DEBUG
+        timer.lap("validation")
+        try:
+            self.timed_mutation(timer, self.add_item, barcode)
+        except SessionError as e:
+            self.report_scan_error(str(e), barcode)
+            logger.warning("process_item_barcode - Error: Current box not found in session")
             return
-        self.add_item(barcode)
         self.log_scan(barcode, "item")
-        if self.autoclear_item_entry.isChecked():
-            self.item_scan_entry.clear()
+        timer.lap("history")
         self.highlight_entry(self.item_scan_entry)
-        self.save_state()
-        print("process_item_barcode finished") # DEBUG
+        timer.lap("highlight")
+        logger.debug("process_item_barcode finished")
+        return True
 
     def highlight_entry(self, entry):
         original_bg = entry.styleSheet()
@@ -846,310 +1162,426 @@ class QBarcodeApp(QMainWindow):
         QTimer.singleShot(200, lambda: entry.setStyleSheet(""))
 
     def add_item(self, item_barcode):
-        print(f"add_item started with item_barcode: {item_barcode}") # DEBUG
-        if item_barcode in self.all_boxes[self.current_box_barcode]:
-            self.all_boxes[self.current_box_barcode][item_barcode] += 1
-            print(f"add_item - Item count incremented for {item_barcode} in box {self.current_box_barcode}") # DEBUG
-        else:
-            self.all_boxes[self.current_box_barcode][item_barcode] = 1
-            print(f"add_item - New item added {item_barcode} to box {self.current_box_barcode}") # DEBUG
-        self.refresh_treeview()
-        print("add_item finished") # DEBUG
+        logger.debug("add_item started with item_barcode: %s", item_barcode)
+        count = self.session.add_item(item_barcode)
+        logger.debug("add_item - %s in box %s: %s", item_barcode, self.session.current_box_barcode, count)
+        logger.debug("add_item finished")
+
+    def on_session_event(self, event, *args):
+        started = time.perf_counter()
+        self.forward_session_event(event, *args)
+        self.view_time += time.perf_counter() - started
+
+    def forward_session_event(self, event, *args):
+        # The session is the single source of truth, this only forwards its changes to the model
+        if event == scan_session.RESET:
+            self.refresh_treeview()
+            return
+        if event == scan_session.BOX_ADDED:
+            self.items_model.add_box(args[0])
+        elif event == scan_session.ITEM_CHANGED:
+            box_barcode, item_barcode = args
+            if (box_barcode, item_barcode) not in self.search_index.texts:
+                self.search_index.add(args, box_barcode, item_barcode)
+            self.items_model.item_changed(box_barcode, item_barcode)
+            if len(self.session.all_boxes[box_barcode]) == 1:
+                # First item of the box, show it expanded like the rest
+                self.items_tree.expand(self.items_model.index_for_key(box_barcode))
+        elif event == scan_session.ITEM_REMOVED:
+            self.search_index.remove(args)
+            self.items_model.remove_item(*args)
+        elif event == scan_session.BOX_REMOVED:
+            for item_barcode in args[1]:
+                self.search_index.remove((args[0], item_barcode))
+            self.items_model.remove_box(args[0])
+        elif event == scan_session.BOX_RENAMED:
+            old_barcode, new_barcode = args
+            for item_barcode in self.session.all_boxes[new_barcode]:
+                self.search_index.remove((old_barcode, item_barcode))
+                self.search_index.add((new_barcode, item_barcode), new_barcode, item_barcode)
+            self.items_model.rename_box(old_barcode, new_barcode)
+            self.items_model.refilter(new_barcode, list(self.session.all_boxes[new_barcode]))
+        elif event == scan_session.ITEM_RENAMED:
+            box_barcode, old_barcode, new_barcode = args
+            self.search_index.remove((box_barcode, old_barcode))
+            self.search_index.add((box_barcode, new_barcode), box_barcode, new_barcode)
+            self.items_model.rename_item(box_barcode, old_barcode, new_barcode)
+            self.items_model.refilter(box_barcode, [new_barcode])
+        elif event == scan_session.COMMENT_CHANGED:
+            self.items_model.comment_changed(*args)
+        elif event == scan_session.CURRENT_BOX_CHANGED:
+            self.update_status(f"Текущий короб: {args[0]}" if args[0] else "")
+        elif event == scan_session.PERSIST_ERROR:
+            # Raised from inside a scan, a dialog per scan would block the scanner input
+            if not self.persist_error_reported:
+                self.persist_error_reported = True
+                self.report_scan_error(f"Ошибка при сохранении состояния: {args[0]}")
+                self.update_status("Состояние не сохраняется! Проверьте место на диске и доступ к файлу.")
+            logger.error("on_session_event - Error writing journal: %s", args[0])
+        if event in (scan_session.BOX_ADDED, scan_session.ITEM_CHANGED, scan_session.ITEM_REMOVED, scan_session.BOX_REMOVED):
+            self.update_summary()
+        if self.lookup_window is not None and self.lookup_window.isVisible() and event in (
+                scan_session.RESET, scan_session.ITEM_CHANGED, scan_session.ITEM_REMOVED, scan_session.ITEM_RENAMED,
+                scan_session.BOX_REMOVED, scan_session.BOX_RENAMED):
+            self.update_item_lookup()
 
     def refresh_treeview(self):
-        print("refresh_treeview started") # DEBUG
-        self.items_tree.clear()
-        for box_barcode, items in self.all_boxes.items():
-            box_comment = self.comments.get((box_barcode, ""), "")
-            box_item = QTreeWidgetItem(self.items_tree, [box_barcode, "", "", box_comment])
-            box_item.setFlags(box_item.flags() | Qt.ItemIsTristate)
-            box_item.setBackground(0, QColor(self.box_bg_color))
-            box_item.setBackground(1, QColor(self.box_bg_color))
-            box_item.setBackground(2, QColor(self.box_bg_color))
-            box_item.setBackground(3, QColor(self.box_bg_color))
-            self.items_tree.expandItem(box_item)
-
-            for item_barcode, count in items.items():
-                item_comment = self.comments.get((box_barcode, item_barcode), "")
-                if not self.search_query or self.search_query.lower() in box_barcode.lower() or self.search_query.lower() in item_barcode.lower():
-                    item = QTreeWidgetItem(box_item, ["", item_barcode, str(count), item_comment])
-                    for i in range(1, 4):
-                        item.setTextAlignment(i, Qt.AlignCenter)
+        # Full rebuild, only needed on load/reset. Everything else goes through the model's row updates.
+        logger.debug("refresh_treeview started")
+        self.search_index.clear()
+        for box_barcode, items in self.session.all_boxes.items():
+            for item_barcode in items:
+                self.search_index.add((box_barcode, item_barcode), box_barcode, item_barcode)
+        self.apply_filter(self.session.search_query)
         self.update_summary()
-        print("refresh_treeview finished") # DEBUG
+        logger.debug("refresh_treeview finished")
+
+    def on_items_rows_inserted(self, parent, first, last):
+        # Boxes reach the view in batches (fetchMore), expand each batch as it arrives
+        if parent.isValid():
+            return
+        for row in range(first, last + 1):
+            self.items_tree.expand(self.items_model.index(row, 0))
+
+    def matches_search(self, box_barcode, item_barcode):
+        if not self.session.search_query:
+            return True
+        query = self.session.search_query.lower()
+        return query in box_barcode.lower() or query in item_barcode.lower()
+
+    def apply_filter(self, query):
+        # The model only lists matching item rows, the view asks it for the ones on screen
+        self.applied_search_query = query
+        if query:
+            self.items_model.set_filter(self.matches_search, set(self.search_index.search(query)))
+        else:
+            self.items_model.set_filter(None, None)
 
     def filter_items(self):
-        self.search_query = self.search_entry.text()
-        self.refresh_treeview()
+        # Debounced by search_timer
+        query = self.search_entry.text()
+        if query == self.applied_search_query:
+            return
+        previous = self.applied_search_query
+        self.session.search_query = query
+        if previous and query and previous.lower() in query.lower():
+            # A longer query only hides rows, no rebuild of the tree
+            self.applied_search_query = query
+            self.items_model.narrow(self.matches_search, self.search_index.search(query))
+        else:
+            self.apply_filter(query)
 
     def show_context_menu(self, point):
-        item = self.items_tree.itemAt(point)
-        if item is None:
+        index = self.items_tree.indexAt(point)
+        if not index.isValid():
             return
 
-        self.items_tree.setCurrentItem(item)
-        column_index = -1
-
-        header = self.items_tree.header()
-        x_click = point.x()
-
-        for i in range(self.items_tree.columnCount()):
-            section_pos = header.sectionViewportPosition(i)
-            section_width = header.sectionSize(i)
-            if x_click >= section_pos and x_click < section_pos + section_width:
-                column_index = i
-                break
-
-        if column_index == -1:
-            pass
-        else:
-            pass
-
-        values = [item.text(i) for i in range(self.items_tree.columnCount())]
+        self.items_tree.setCurrentIndex(index)
+        column_index = index.column()
+        box_barcode, item_barcode = self.items_model.key(index)
 
         context_menu = QMenu(self)
 
-        if len(values) == 4 and values[1] == "" and values[2] == "":
+        if not item_barcode:
             if column_index == 0:
                 action_copy_box_barcode = QAction("Копировать штрихкод короба", self)
-                action_copy_box_barcode.triggered.connect(lambda: self.clipboard.setText(values[0]))
+                action_copy_box_barcode.triggered.connect(lambda: self.clipboard.setText(box_barcode))
                 context_menu.addAction(action_copy_box_barcode)
             elif column_index == 3:
                 action_edit_comment = QAction("Изменить комментарий к коробу", self)
-                action_edit_comment.triggered.connect(lambda: self.edit_comment(item))
+                action_edit_comment.triggered.connect(lambda: self.edit_comment(box_barcode, ""))
                 context_menu.addAction(action_edit_comment)
-            else:
-                pass
 
             action_edit_box_barcode = QAction("Изменить штрихкод короба", self)
-            action_edit_box_barcode.triggered.connect(lambda: self.edit_box_barcode(item))
+            action_edit_box_barcode.triggered.connect(lambda: self.edit_box_barcode(box_barcode))
             context_menu.addAction(action_edit_box_barcode)
 
             action_delete_box = QAction("Удалить короб", self)
-            action_delete_box.triggered.connect(lambda: self.delete_box(item))
+            action_delete_box.triggered.connect(lambda: self.delete_box(box_barcode))
             context_menu.addAction(action_delete_box)
 
         else:
-            parent_item = item.parent()
-            box_barcode = parent_item.text(0) if parent_item else ""
-
             if column_index == 0:
                 action_copy_box_barcode = QAction("Копировать штрихкод короба", self)
                 action_copy_box_barcode.triggered.connect(lambda: self.clipboard.setText(box_barcode))
                 context_menu.addAction(action_copy_box_barcode)
             elif column_index == 1:
                 action_copy_item_barcode = QAction("Копировать штрихкод товара", self)
-                action_copy_item_barcode.triggered.connect(lambda: self.clipboard.setText(values[1]))
+                action_copy_item_barcode.triggered.connect(lambda: self.clipboard.setText(item_barcode))
                 context_menu.addAction(action_copy_item_barcode)
             elif column_index == 2:
                 action_copy_count = QAction("Копировать количество", self)
-                action_copy_count.triggered.connect(lambda: self.clipboard.setText(values[2]))
+                action_copy_count.triggered.connect(lambda: self.clipboard.setText(str(self.session.get_count(box_barcode, item_barcode))))
                 context_menu.addAction(action_copy_count)
             elif column_index == 3:
                 action_edit_comment = QAction("Изменить комментарий к товару", self)
-                action_edit_comment.triggered.connect(lambda: self.edit_comment(item))
+                action_edit_comment.triggered.connect(lambda: self.edit_comment(box_barcode, item_barcode))
                 context_menu.addAction(action_edit_comment)
-            else:
-                pass
 
             if column_index in (1, 2):
                 action_edit_count = QAction("Изменить количество", self)
-                action_edit_count.triggered.connect(lambda: self.edit_item_count(item))
+                action_edit_count.triggered.connect(lambda: self.edit_item_count(box_barcode, item_barcode))
                 context_menu.addAction(action_edit_count)
             if column_index == 1:
                 action_edit_item_barcode = QAction('Изменить штрихкод товара', self)
-                action_edit_item_barcode.triggered.connect(lambda: self.edit_item_barcode(item))
+                action_edit_item_barcode.triggered.connect(lambda: self.edit_item_barcode(box_barcode, item_barcode))
                 context_menu.addAction(action_edit_item_barcode)
 
+            action_lookup_item = QAction("Где ещё этот товар?", self)
+            action_lookup_item.triggered.connect(lambda: self.show_item_lookup(item_barcode))
+            context_menu.addAction(action_lookup_item)
+
             action_delete_item = QAction("Удалить товар", self)
-            action_delete_item.triggered.connect(lambda: self.delete_item(item))
+            action_delete_item.triggered.connect(lambda: self.delete_item(box_barcode, item_barcode))
             context_menu.addAction(action_delete_item)
 
         context_menu.popup(self.items_tree.viewport().mapToGlobal(point))
 
-    def clear_selection(self, item, column):
-        if not item.isSelected():
+    def show_item_lookup(self, item_barcode=None):
+        # Non-modal, scans typed into its entry look the item up instead of adding it
+        if self.lookup_window is None:
+            self.lookup_window = QDialog(self)
+            self.lookup_window.setWindowTitle("Где товар?")
+            self.lookup_window.setGeometry(150, 150, 450, 350)
+            layout = QVBoxLayout(self.lookup_window)
+
+            entry_layout = QHBoxLayout()
+            layout.addLayout(entry_layout)
+            entry_layout.addWidget(QLabel("Штрихкод товара:"))
+            self.lookup_entry = QLineEdit()
+            self.lookup_entry.returnPressed.connect(lambda: self.lookup_item(self.lookup_entry.text()))
+            self.lookup_entry.setContextMenuPolicy(Qt.CustomContextMenu)
+            self.lookup_entry.customContextMenuRequested.connect(lambda event: self.show_paste_menu(event, self.lookup_entry))
+            entry_layout.addWidget(self.lookup_entry)
+
+            self.lookup_summary_label = QLabel()
+            layout.addWidget(self.lookup_summary_label)
+
+            self.lookup_tree = QTreeWidget()
+            self.lookup_tree.setHeaderLabels(["Штрихкод короба", "Количество"])
+            self.lookup_tree.setRootIsDecorated(False)
+            self.lookup_tree.header().setSectionResizeMode(0, QHeaderView.Stretch)
+            self.lookup_tree.itemActivated.connect(
+                lambda tree_item: self.jump_to_item(tree_item.text(0), self.lookup_item_barcode))
+            layout.addWidget(self.lookup_tree)
+        if item_barcode is not None:
+            self.lookup_item(item_barcode)
+        self.lookup_window.show()
+        self.lookup_window.raise_()
+        self.lookup_window.activateWindow()
+        self.lookup_entry.setFocus()
+        self.lookup_entry.selectAll()
+
+    def lookup_item(self, text):
+        self.lookup_item_barcode = self.normalize_barcode(text)
+        self.lookup_entry.setText(self.lookup_item_barcode)
+        self.lookup_entry.selectAll()  # the next scan replaces it
+        self.update_item_lookup()
+        boxes = self.session.boxes_with_item(self.lookup_item_barcode)
+        if len(boxes) == 1:
+            self.jump_to_item(next(iter(boxes)), self.lookup_item_barcode)
+
+    def update_item_lookup(self):
+        boxes = self.session.boxes_with_item(self.lookup_item_barcode)
+        self.lookup_tree.clear()
+        self.lookup_tree.addTopLevelItems(
+            [QTreeWidgetItem([box_barcode, str(count)]) for box_barcode, count in boxes.items()])
+        if not self.lookup_item_barcode:
+            self.lookup_summary_label.setText("Отсканируйте или вставьте штрихкод товара")
+        elif not boxes:
+            self.lookup_summary_label.setText(f"Товар {self.lookup_item_barcode} не найден ни в одном коробе")
+        else:
+            self.lookup_summary_label.setText(f"Коробов: {len(boxes)}, единиц: {sum(boxes.values())}")
+
+    def jump_to_item(self, box_barcode, item_barcode=""):
+        # Selects the row in the main tree, the box row when the search filter hides the item
+        index = self.items_model.reveal(box_barcode, item_barcode)
+        if not index.isValid():
+            return
+        if index.parent().isValid():
+            self.items_tree.expand(index.parent())
+        self.items_tree.setCurrentIndex(index)
+        self.items_tree.scrollTo(index, QTreeView.PositionAtCenter)
+
+    def show_duplicates(self):
+        duplicates = self.session.duplicates()
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Товары в нескольких коробах")
+        dialog.setGeometry(150, 150, 600, 400)
+        layout = QVBoxLayout(dialog)
+        layout.addWidget(QLabel(f"Товаров в нескольких коробах: {len(duplicates)}"))
+
+        tree = QTreeWidget()
+        tree.setHeaderLabels(["Штрихкод товара", "Коробов", "Единиц"])
+        for item_barcode, boxes in duplicates:
+            parent = QTreeWidgetItem([item_barcode, str(len(boxes)), str(sum(boxes.values()))])
+            parent.addChildren([QTreeWidgetItem([box_barcode, "", str(count)]) for box_barcode, count in boxes.items()])
+            tree.addTopLevelItem(parent)
+        tree.header().setSectionResizeMode(0, QHeaderView.Stretch)
+        # A box row jumps to the item in that box, an item row opens the lookup
+        tree.itemActivated.connect(lambda tree_item: self.jump_to_item(tree_item.text(0), tree_item.parent().text(0))
+                                   if tree_item.parent() else self.show_item_lookup(tree_item.text(0)))
+        layout.addWidget(tree)
+
+        save_button = QPushButton("Сохранить в CSV...")
+        save_button.clicked.connect(self.save_duplicates_report)
+        layout.addWidget(save_button)
+        dialog.show()
+
+    def save_duplicates_report(self):
+        duplicates = self.session.duplicates()
+        if not duplicates:
+            self.show_info("Нет товаров, лежащих в нескольких коробах.")
+            return
+        file_path, _ = QFileDialog.getSaveFileName(self, "Сохранить товары в нескольких коробах", "duplicates.csv",
+                                                   "CSV Files (*.csv);;All Files (*)")
+        if not file_path:
+            return
+        try:
+            with open(file_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(["Штрихкод товара", "Коробов", "Штрихкод короба", "Количество"])
+                for item_barcode, boxes in duplicates:
+                    writer.writerows([item_barcode, len(boxes), box_barcode, count] for box_barcode, count in boxes.items())
+            self.show_info(f"Отчёт сохранён в {file_path}")
+        except Exception as e:
+            self.show_error(f"Ошибка при сохранении отчёта: {e}")
+
+    def clear_selection(self, index):
+        if not self.items_tree.selectionModel().isSelected(index):
             self.items_tree.clearSelection()
 
-    def edit_item_count(self, selected_item):
-        parent_item = selected_item.parent()
-        box_barcode = parent_item.text(0) if parent_item else ""
-        current_count = selected_item.text(2)
-        barcode = selected_item.text(1)
+    def edit_item_count(self, box_barcode, item_barcode):
+        current_count = self.session.get_count(box_barcode, item_barcode)
 
         new_count, ok = QInputDialog.getInt(self, "Изменить количество",
-                                             f"Введите новое количество для {barcode}:",
-                                             int(current_count), 0)
+                                             f"Введите новое количество для {item_barcode}:",
+                                             current_count, 0)
         if ok:
-            if str(box_barcode) in self.all_boxes:
-                if new_count == 0:
-                    if barcode in self.all_boxes[box_barcode]:
-                        del self.all_boxes[box_barcode][barcode]
-                        if not self.all_boxes[box_barcode]:
-                            del self.all_boxes[box_barcode]
-                else:
-                    self.all_boxes[str(box_barcode)][barcode] = new_count
-            selected_item.setText(2, str(new_count))
-            self.refresh_treeview()
-            self.update_summary()
-            self.save_state()
-
-    def edit_box_barcode(self, item):
-        old_barcode = item.text(0)
+            self.session.set_item_count(box_barcode, item_barcode, new_count)
 
+    def edit_box_barcode(self, old_barcode):
         new_barcode, ok = QInputDialog.getText(self, "Изменить штрихкод короба",
                                             "Введите новый штрихкод короба:",
                                             QLineEdit.Normal, old_barcode)
+        new_barcode = self.normalize_barcode(new_barcode)
         if ok and new_barcode and new_barcode != old_barcode:
             if self.is_valid_barcode(new_barcode, barcode_type='box'):
-                if new_barcode not in self.all_boxes:
-                    self.all_boxes[new_barcode] = self.all_boxes.pop(old_barcode)
-                    for key in list(self.comments.keys()):
-                        if key[0] == old_barcode:
-                            new_key = (new_barcode, key[1])
-                            self.comments[new_key] = self.comments.pop(key)
-
-                    if self.current_box_barcode == old_barcode:
-                        self.current_box_barcode = new_barcode
-                        self.update_status(f"Текущий короб: {self.current_box_barcode}")
-                    self.refresh_treeview()
-                else:
-                    self.show_error("Короб с таким штрихкодом уже существует!")
+                try:
+                    self.session.rename_box(old_barcode, new_barcode)
+                except SessionError as e:
+                    self.show_error(str(e))
             else:
                 self.show_error("Неверный штрихкод короба!")
 
-    def edit_item_barcode(self, item):
-        parent_item = item.parent()
-        box_barcode = parent_item.text(0) if parent_item else ""
-        old_barcode = item.text(1)
-
+    def edit_item_barcode(self, box_barcode, old_barcode):
         new_barcode, ok = QInputDialog.getText(self, "Изменить штрихкод товара",
                                             "Введите новый штрихкод товара:",
                                             QLineEdit.Normal, old_barcode)
+        new_barcode = self.normalize_barcode(new_barcode)
         if ok and new_barcode and new_barcode != old_barcode:
             if self.is_valid_barcode(new_barcode, barcode_type='item'):
-                if new_barcode not in self.all_boxes[box_barcode]:
-                    self.all_boxes[box_barcode][new_barcode] = self.all_boxes[box_barcode].pop(old_barcode)
-                    if (box_barcode, old_barcode) in self.comments:
-                        self.comments[(box_barcode, new_barcode)] = self.comments.pop((box_barcode, old_barcode))
-                    self.refresh_treeview()
-                else:
-                    self.show_error("Товар с таким штрихкодом уже есть в этом коробе!")
+                try:
+                    self.session.rename_item(box_barcode, old_barcode, new_barcode)
+                except SessionError as e:
+                    self.show_error(str(e))
             else:
                 self.show_error("Неверный штрихкод товара!")
 
-    def delete_box(self, item):
-        box_barcode = item.text(0)
+    def delete_box(self, box_barcode):
         if QMessageBox.question(self, "Удалить короб", f"Вы уверены, что хотите удалить короб '{box_barcode}'?",
                                 QMessageBox.Yes | QMessageBox.No) == QMessageBox.Yes:
-            del self.all_boxes[box_barcode]
-            keys_to_delete = []
-            for key in self.comments:
-                if key[0] == box_barcode:
-                    keys_to_delete.append(key)
-            for key in keys_to_delete:
-                del self.comments[key]
-            if self.current_box_barcode == box_barcode:
-                self.current_box_barcode = ""
-                self.update_status("")
-            self.refresh_treeview()
-
-    def delete_item(self, item):
-        parent_item = item.parent()
-        box_barcode = parent_item.text(0) if parent_item else ""
-        item_barcode = item.text(1)
+            self.session.delete_box(box_barcode)
 
+    def delete_item(self, box_barcode, item_barcode):
         if QMessageBox.question(self, "Удалить товар", f"Вы уверены, что хотите удалить товар '{item_barcode}' из короба '{box_barcode}'?",
                                 QMessageBox.Yes | QMessageBox.No) == QMessageBox.Yes:
-            del self.all_boxes[box_barcode][item_barcode]
-            if (box_barcode, item_barcode) in self.comments:
-                del self.comments[(box_barcode, item_barcode)]
-            if not self.all_boxes[box_barcode]:
-                del self.all_boxes[box_barcode]
-            if (box_barcode, "") in self.comments:
-                del self.comments[(box_barcode, "")]
-            if self.current_box_barcode == box_barcode:
-                self.current_box_barcode = ""
-                self.update_status("")
-            self.refresh_treeview()
+            self.session.delete_item(box_barcode, item_barcode)
 
-    def edit_comment(self, item):
-        values = [item.text(i) for i in range(self.items_tree.columnCount())]
-        if len(values) == 4 and values[1] == "" and values[2] == "":
-            box_barcode = values[0]
-            current_comment = self.comments.get((box_barcode, ""), "")
+    def edit_comment(self, box_barcode, item_barcode):
+        current_comment = self.session.get_comment(box_barcode, item_barcode)
+        if not item_barcode:
             new_comment, ok = QInputDialog.getText(self, "Изменить комментарий",
                                                 f"Введите комментарий для короба {box_barcode}:",
                                                 QLineEdit.Normal, current_comment)
-            if ok:
-                self.comments[(box_barcode, "")] = new_comment
-                self.refresh_treeview()
         else:
-            parent_item = item.parent()
-            box_barcode = parent_item.text(0) if parent_item else ""
-            item_barcode = values[1]
-            current_comment = self.comments.get((box_barcode, item_barcode), "")
             new_comment, ok = QInputDialog.getText(self, "Изменить комментарий",
                                                 f"Введите комментарий для товара {item_barcode}:",
                                                 QLineEdit.Normal, current_comment)
-            if ok:
-                self.comments[(box_barcode, item_barcode)] = new_comment
-                self.refresh_treeview()
+        if ok:
+            self.session.set_comment(box_barcode, item_barcode, new_comment)
 
-    def on_double_click(self, item, column_index):
-        if column_index in [2]:
-            self.edit_item_count(item)
+    def on_double_click(self, index):
+        # Box rows show the box total in this column, it is not editable
+        box_barcode, item_barcode = self.items_model.key(index)
+        if index.column() == 2 and item_barcode:
+            self.edit_item_count(box_barcode, item_barcode)
 
     def save_to_excel(self):
-        if not self.all_boxes:
+        if not self.session.all_boxes:
             self.show_warning("Нет данных для сохранения!")
             return
+        if self.export_thread is not None and self.export_thread.is_alive():
+            self.show_warning("Экспорт уже выполняется!")
+            return
         file_path, _ = QFileDialog.getSaveFileName(self, "Сохранить в Excel", "", "Excel Files (*.xlsx);;All Files (*)")
         if not file_path:
             return
         if not file_path.lower().endswith(('.xlsx')):
             file_path += '.xlsx'
+        self.start_export(file_path, self.excel_layout)
+
+    def start_export(self, file_path, layout):
+        # The worker writes a snapshot, scanning can go on while it runs
+        all_boxes, comments = self.session.snapshot()
+        self.export_cancel = threading.Event()
+        self.export_dialog = self.create_progress_dialog("Экспорт", "Сохранение в Excel...", self.export_cancel)
+        self.export_thread = threading.Thread(target=self.run_export, args=(file_path, all_boxes, comments, layout),
+                                              name="ExcelExport", daemon=True)
+        self.export_thread.start()
+        logger.debug("start_export - Exporting %s boxes to %s", len(all_boxes), file_path)
+
+    def create_progress_dialog(self, title, text, cancel_event):
+        # Non-modal, so the session stays usable while a worker runs
+        dialog = QProgressDialog(text, "Отмена", 0, 0, self)
+        dialog.setWindowTitle(title)
+        dialog.setWindowModality(Qt.NonModal)
+        dialog.setAutoClose(False)
+        dialog.setAutoReset(False)
+        dialog.setMinimumDuration(500)
+        dialog.canceled.connect(cancel_event.set)
+        return dialog
+
+    def run_export(self, file_path, all_boxes, comments, layout):
+        # Worker thread: talks to the UI only through signals
         try:
-            wb = openpyxl.Workbook()
-            wb.remove(wb.active)
-            for box_barcode, items in self.all_boxes.items():
-                sheet = wb.create_sheet(title=f"Короб {box_barcode}")
-                sheet['A1'] = "Штрихкод короба"
-                sheet['B1'] = box_barcode
-                sheet['C1'] = "Комментарий"
-                sheet['A2'] = "Штрихкод товара"
-                sheet['B2'] = "Количество"
-                sheet['C2'] = "Комментарий"
-                for cell in ['A1', 'B1', 'C1', 'A2', 'B2', 'C2']:
-                    sheet[cell].alignment = Alignment(horizontal='center')
-                row = 3
-                sheet.cell(row=row, column=1, value="Комментарий к коробу:")
-                sheet.cell(row=row, column=3, value=self.comments.get((box_barcode, ""), ""))
-                row += 1
-                for item_barcode, count in items.items():
-                    sheet.cell(row=row, column=1, value=item_barcode)
-                    sheet.cell(row=row, column=2, value=count).alignment = Alignment(horizontal='center')
-                    sheet.cell(row=row, column=3,
-                                  value=self.comments.get((box_barcode, item_barcode), ""))
-                    row += 1
-
-                for column in sheet.columns:
-                    max_length = 0
-                    col_letter = openpyxl.utils.get_column_letter(column[0].column)
-                    for cell in column:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except Exception:
-                            pass
-                    sheet.column_dimensions[col_letter].width = max_length + 2
-            wb.save(file_path)
-            self.show_info(f"Данные сохранены в {file_path}")
+            export_workbook(file_path, all_boxes, comments, layout=layout,
+                            progress=self.export_progress.emit, cancel=self.export_cancel)
+            self.export_finished.emit(file_path, "", False)
+        except ExportCancelled:
+            self.export_finished.emit(file_path, "", True)
         except Exception as e:
-            self.show_error(f"Ошибка при сохранении: {e}")
+            self.export_finished.emit(file_path, str(e), False)
+
+    def on_export_progress(self, done, total):
+        if self.export_dialog is not None:
+            self.export_dialog.setMaximum(total)
+            self.export_dialog.setValue(done)
+
+    def on_export_finished(self, file_path, error, cancelled):
+        if self.export_dialog is not None:
+            self.export_dialog.close()
+            self.export_dialog = None
+        if cancelled:
+            self.update_status("Экспорт отменён")
+        elif error:
+            self.show_error(f"Ошибка при сохранении: {error}")
+            logger.error("on_export_finished - Error exporting %s: %s", file_path, error)
+        else:
+            self.show_info(f"Данные сохранены в {file_path}")
 
     def save_to_csv(self):
-        if not self.all_boxes:
+        if not self.session.all_boxes:
            self.show_warning("Нет данных для сохранения!")
            return
         file_path, _ = QFileDialog.getSaveFileName(self, "Сохранить в CSV", "", "CSV Files (*.csv);;All Files (*)")
@@ -1161,253 +1593,450 @@ class QBarcodeApp(QMainWindow):
         try:
             with open(file_path, "w", newline="", encoding="utf-8") as f:
                 writer = csv.writer(f)
-                writer.writerow(["Штрихкод короба", "Комментарий короба", "Штрихкод товара", "Количество", "Комментарий товара"])
+                writer.writerow(CSV_HEADER)
 
-                for box_barcode, items in self.all_boxes.items():
-                    box_comment = self.comments.get((box_barcode, ""), "")
-                    for item_barcode, count in items.items():
-                        item_comment = self.comments.get((box_barcode, item_barcode),"")
-                        writer.writerow([box_barcode, box_comment, item_barcode, count, item_comment])
+                writer.writerows(self.session.iter_rows())
 
             self.show_info(f"Данные сохранены в {file_path}")
         except Exception as e:
             self.show_error(f"Ошибка при сохранении: {e}")
 
+    def save_scan_stats(self):
+        file_path, _ = QFileDialog.getSaveFileName(self, "Сохранить статистику сканирования", "scan_stats.json",
+                                                   "JSON Files (*.json);;All Files (*)")
+        if not file_path:
+            return
+        try:
+            self.scan_metrics.write_json(file_path)
+            self.show_info(f"Статистика сохранена в {file_path}")
+        except Exception as e:
+            self.show_error(f"Ошибка при сохранении статистики: {e}")
+
     def load_from_csv(self):
+        if self.import_thread is not None and self.import_thread.is_alive():
+            self.show_warning("Загрузка уже выполняется!")
+            return
         file_path, _ = QFileDialog.getOpenFileName(self, "Загрузить из CSV", "", "CSV Files (*.csv);;All Files (*)")
         if not file_path:
             return
 
+        merge = self.ask_import_mode("Добавить данные из файла к текущей сессии или заменить их?")
+        if merge is None:
+            return
+
+        self.import_cancel = threading.Event()
+        self.import_dialog = self.create_progress_dialog("Импорт", "Загрузка из CSV...", self.import_cancel)
+        self.import_thread = threading.Thread(target=self.run_import, args=(file_path, self.validator, merge),
+                                              name="CsvImport", daemon=True)
+        self.import_thread.start()
+        logger.debug("load_from_csv - Importing %s, merge: %s", file_path, merge)
+
+    def ask_import_mode(self, text):
+        # True to merge, False to replace, None when cancelled; an empty session is simply replaced
+        if not self.session.all_boxes:
+            return False
+        question = QMessageBox(self)
+        question.setWindowTitle("Загрузить из CSV")
+        question.setText(text)
+        merge_button = question.addButton("Объединить", QMessageBox.AcceptRole)
+        replace_button = question.addButton("Заменить", QMessageBox.DestructiveRole)
+        question.addButton("Отмена", QMessageBox.RejectRole)
+        question.exec_()
+        if question.clickedButton() is merge_button:
+            return True
+        if question.clickedButton() is replace_button:
+            return False
+        return None
+
+    def merge_csv_directory(self):
+        # End of shift: every station's save_to_csv file from one folder, parsed in parallel
+        if self.import_thread is not None and self.import_thread.is_alive():
+            self.show_warning("Загрузка уже выполняется!")
+            return
+        directory = QFileDialog.getExistingDirectory(self, "Папка с CSV станций")
+        if not directory:
+            return
+        merge = self.ask_import_mode("Добавить данные станций к текущей сессии или заменить их?")
+        if merge is None:
+            return
+
+        definition = barcode_rules.profile_definition(self.barcode_profiles, self.barcode_profile,
+                                                      self.strict_validation_enabled)
+        self.import_cancel = threading.Event()
+        self.import_dialog = self.create_progress_dialog("Импорт", "Объединение файлов станций...", self.import_cancel)
+        self.import_thread = threading.Thread(target=self.run_merge_directory, args=(directory, definition, merge),
+                                              name="CsvMerge", daemon=True)
+        self.import_thread.start()
+        logger.debug("merge_csv_directory - Merging %s, merge: %s", directory, merge)
+
+    def run_merge_directory(self, directory, definition, merge):
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                reader = csv.reader(f)
-                header = next(reader, None)
-                if header is None:
-                    self.show_warning("Файл пуст.")
-                    return
-
-                if not (len(header) >= 3 and header[0] == "Штрихкод короба" and header[2] == "Штрихкод товара" and header[3] == "Количество"):
-                    self.show_warning("Некорректный формат файла CSV. Ожидаются колонки: Штрихкод короба, Штрихкод товара, Количество")
-                    return
-
-                self.all_boxes = {}
-                self.current_box_barcode = ""
-                self.comments = {}
-                for row in reader:
-                    if len(row) < 3:
-                        self.show_warning(f"Некорректное количество столбцов в строке: {row}")
-                        continue
-
-                    box_barcode = row[0].strip()
-                    item_barcode = row[2].strip()
-                    count_str = row[3].strip()
-
-                    box_comment = row[1].strip() if len(row) > 1 else ""
-                    item_comment = row[4].strip() if len(row) > 4 else ""
-
-                    if not self.is_valid_barcode(box_barcode, barcode_type='box'):
-                        self.show_warning(f'Недопустимый штрихкод короба: {box_barcode}')
-                        continue
-                    if not self.is_valid_barcode(item_barcode, barcode_type='item'):
-                        self.show_warning(f'Недопустимый штрихкод товара: {item_barcode}')
-                        continue
-                    try:
-                        count = int(count_str)
-                        if count <= 0:
-                            raise ValueError("Количество должно быть положительным")
-                    except ValueError:
-                        self.show_warning(f"Некорректное количество '{count_str}' для товара '{item_barcode}' в коробе '{box_barcode}'.")
-                        continue
-
-                    if box_barcode not in self.all_boxes:
-                        self.all_boxes[box_barcode] = {}
-                    self.all_boxes[box_barcode][item_barcode] = self.all_boxes[box_barcode].setdefault(item_barcode, 0) + count
-
-                    box_comment = row[1].strip() if len(row) > 1 else ""
-                    item_comment = row[4].strip() if len(row) > 4 else ""
-
-                    self.comments[(box_barcode, "")] = box_comment
-                    if item_barcode:
-                        self.comments[(box_barcode, item_barcode)] = item_comment
-
-                self.refresh_treeview()
-                if self.all_boxes:
-                    self.update_status("Данные загружены из CSV")
-                    self.save_button.setEnabled(True)
-        except FileNotFoundError:
+            result = merge_directory(directory, definition, cancel=self.import_cancel,
+                                     progress=self.import_progress.emit)
+            self.import_finished.emit(result, merge)
+        except Exception as e:
+            self.import_finished.emit(e, merge)
+
+    def run_import(self, file_path, validator, merge):
+        # Worker thread: parses into a staging ImportResult, the session is only touched in on_import_finished
+        try:
+            result = import_csv(file_path, validator, cancel=self.import_cancel,
+                                progress=lambda done, total: self.import_progress.emit(done * 100 // max(total, 1), 100))
+            self.import_finished.emit(result, merge)
+        except Exception as e:
+            self.import_finished.emit(e, merge)
+
+    def on_import_progress(self, done, total):
+        if self.import_dialog is not None:
+            self.import_dialog.setMaximum(total)
+            self.import_dialog.setValue(done)
+
+    def on_import_finished(self, outcome, merge):
+        if self.import_dialog is not None:
+            self.import_dialog.close()
+            self.import_dialog = None
+        if isinstance(outcome, ImportCancelled):
+            self.update_status("Загрузка отменена")
+            return
+        if isinstance(outcome, CsvFormatError):
+            self.show_warning(str(outcome))
+            return
+        if isinstance(outcome, FileNotFoundError):
             self.show_error("Файл не найден.")
+            return
+        if isinstance(outcome, Exception):
+            self.show_error(f"Ошибка при загрузке данных из CSV: {outcome}")
+            logger.error("on_import_finished - Error importing CSV: %s", outcome)
+            return
+
+        # One swap and one RESET refresh for the whole file
+        if merge:
+            self.session.merge(outcome.all_boxes, outcome.comments)
+        else:
+            self.session.replace(outcome.all_boxes, outcome.comments)
+        self.update_scan_entries()
+        logger.info("on_import_finished - %s: %s rows read, %s accepted, %s rejected", outcome.source,
+                    outcome.rows_read, outcome.rows_accepted, len(outcome.rejects))
+        if self.session.all_boxes:
+            self.update_status(f"Данные загружены из CSV: {outcome.rows_accepted} строк, отклонено {len(outcome.rejects)}")
+            self.save_button.setEnabled(True)
+        if isinstance(outcome, MergeResult):
+            if outcome.conflicts:
+                self.offer_merge_report(outcome)
+        elif outcome.rejects:
+            self.offer_rejects_report(outcome)
+
+    def offer_merge_report(self, result):
+        if QMessageBox.question(self, "Конфликты объединения",
+                                f"Файлов: {len(result.files)}, замечаний: {len(result.conflicts)}. Сохранить отчёт?",
+                                QMessageBox.Yes | QMessageBox.No) != QMessageBox.Yes:
+            return
+        # Next to the folder, not in it, so the next merge does not pick the report up
+        default_path = os.path.normpath(result.source) + "_merge_report.csv"
+        report_path, _ = QFileDialog.getSaveFileName(self, "Сохранить отчёт", default_path,
+                                                     "CSV Files (*.csv);;All Files (*)")
+        if not report_path:
+            return
+        try:
+            write_merge_report(report_path, result)
+            self.show_info(f"Отчёт сохранён в {report_path}")
         except Exception as e:
-            self.show_error(f"Ошибка при загрузке данных из CSV: {e}")
+            self.show_error(f"Ошибка при сохранении отчёта: {e}")
+
+    def offer_rejects_report(self, result):
+        if QMessageBox.question(self, "Отклонённые строки",
+                                f"Не загружено строк: {len(result.rejects)}. Сохранить отчёт об ошибках?",
+                                QMessageBox.Yes | QMessageBox.No) != QMessageBox.Yes:
+            return
+        default_path = os.path.splitext(result.source)[0] + "_errors.csv"
+        report_path, _ = QFileDialog.getSaveFileName(self, "Сохранить отчёт об ошибках", default_path,
+                                                     "CSV Files (*.csv);;All Files (*)")
+        if not report_path:
+            return
+        try:
+            write_rejects(report_path, result.rejects)
+            self.show_info(f"Отчёт сохранён в {report_path}")
+        except Exception as e:
+            self.show_error(f"Ошибка при сохранении отчёта: {e}")
+
+    def import_images(self):
+        # Photos and scans of labels: decoded on a process pool, added to the session file by file
+        if self.import_thread is not None and self.import_thread.is_alive():
+            self.show_warning("Загрузка уже выполняется!")
+            return
+        error = decoder_error()
+        if error is not None:
+            self.show_error("Для загрузки из изображений нужны пакеты Pillow и pyzbar (с библиотекой zbar).\n"
+                            f"Ошибка импорта: {error}")
+            logger.error("import_images - Image decoding unavailable: %s", error)
+            return
+        directory = QFileDialog.getExistingDirectory(self, "Папка с изображениями")
+        if not directory:
+            return
+        self.image_results = []
+        self.import_cancel = threading.Event()
+        self.import_dialog = self.create_progress_dialog("Импорт", "Распознавание штрихкодов...", self.import_cancel)
+        self.import_thread = threading.Thread(target=self.run_image_import, args=(directory,),
+                                              name="ImageImport", daemon=True)
+        self.import_thread.start()
+        logger.debug("import_images - Decoding %s", directory)
+
+    def run_image_import(self, directory):
+        try:
+            for path, barcodes, error in decode_directory(directory, cancel=self.import_cancel,
+                                                          progress=self.import_progress.emit):
+                self.image_decoded.emit(path, barcodes, error)
+            self.image_import_finished.emit(None)
+        except Exception as e:
+            self.image_import_finished.emit(e)
+
+    def on_image_decoded(self, path, barcodes, error):
+        result = apply_image(self.session, stage_image(path, barcodes, self.validator, error))
+        self.image_results.append(result)
+        if result.error:
+            logger.warning("on_image_decoded - %s: %s", path, result.error)
+        if self.session.all_boxes:
+            self.save_button.setEnabled(True)
+        self.update_scan_entries()
+
+    def on_image_import_finished(self, error):
+        if self.import_dialog is not None:
+            self.import_dialog.close()
+            self.import_dialog = None
+        results = self.image_results
+        if isinstance(error, ImportCancelled):
+            self.update_status(f"Загрузка отменена, обработано изображений: {len(results)}")
+        elif error is not None:
+            self.show_error(f"Ошибка при загрузке изображений: {error}")
+            logger.error("on_image_import_finished - Error decoding images: %s", error)
+        else:
+            units = sum(len(result.items) for result in results)
+            self.update_status(f"Загружено из изображений: {len(results)} файлов, {units} товаров")
+        logger.info("on_image_import_finished - %s images, %s with problems", len(results),
+                    sum(1 for result in results if result.status() != STATUS_OK))
+        if any(result.status() != STATUS_OK for result in results):
+            self.offer_image_report(results)
+
+    def offer_image_report(self, results):
+        problems = sum(1 for result in results if result.status() != STATUS_OK)
+        if QMessageBox.question(self, "Загрузка из изображений",
+                                f"Изображений: {len(results)}, с замечаниями: {problems}. Сохранить отчёт по файлам?",
+                                QMessageBox.Yes | QMessageBox.No) != QMessageBox.Yes:
+            return
+        default_path = os.path.normpath(os.path.dirname(results[0].path)) + "_images_report.csv"
+        report_path, _ = QFileDialog.getSaveFileName(self, "Сохранить отчёт", default_path,
+                                                     "CSV Files (*.csv);;All Files (*)")
+        if not report_path:
+            return
+        try:
+            write_image_report(report_path, results)
+            self.show_info(f"Отчёт сохранён в {report_path}")
+        except Exception as e:
+            self.show_error(f"Ошибка при сохранении отчёта: {e}")
 
     def new_box(self):
-        print("new_box started") # DEBUG
-        self.current_box_barcode = ""
+        logger.debug("new_box started")
+        self.session.set_current_box("")
         self.update_status("Введите штрихкод нового короба")
         self.box_entry.setEnabled(True)
         self.box_entry.clear()
         self.box_entry.setFocus()
         self.item_scan_entry.clear()
         self.item_scan_entry.setEnabled(False)
-        print("new_box finished") # DEBUG
+        logger.debug("new_box finished")
+
+    def update_scan_entries(self):
+        # Follows the current box after changes that did not come from the scan entries (imports)
+        has_box = bool(self.session.current_box_barcode)
+        if has_box:
+            self.box_entry.setText(self.session.current_box_barcode)
+        elif not self.box_entry.isEnabled():
+            self.box_entry.clear()  # still shows the box that is no longer current
+        self.box_entry.setEnabled(not has_box)
+        self.item_scan_entry.setEnabled(has_box)
 
     def reset_application(self):
-        print("reset_application started") # DEBUG
-        if QMessageBox.question(self, "Подтверждение", "Вы уверены, что хотите начать заново? Все несохранённые данные будут потеряны.",
+        logger.debug("reset_application started")
+        if QMessageBox.question(self, "Подтверждение", "Вы уверены, что хотите начать заново? Текущая сессия будет перенесена в архив.",
                                 QMessageBox.Yes | QMessageBox.No) == QMessageBox.Yes:
-            self.all_boxes = {}
-            self.current_box_barcode = ""
-            self.search_query = ""
-            self.comments = {}
-            self.box_entry.setEnabled(True)
-            self.box_entry.clear()
-            self.item_scan_entry.setEnabled(False)
-            self.item_scan_entry.clear()
-            self.search_entry.clear()
-            self.refresh_treeview()
-            self.update_status("")
-            self.box_entry.setFocus()
-            self.save_button.setEnabled(False)
-            self.save_state()
-            print("reset_application - Application reset") # DEBUG
+            self.seal_and_reset("reset")
+            logger.debug("reset_application - Application reset")
         else:
-            print("reset_application - Reset cancelled by user") # DEBUG
-        print("reset_application finished") # DEBUG
+            logger.debug("reset_application - Reset cancelled by user")
+        logger.debug("reset_application finished")
+
+    def end_shift(self):
+        if QMessageBox.question(self, "Завершение смены", "Завершить смену? Текущая сессия будет перенесена в архив и очищена.",
+                                QMessageBox.Yes | QMessageBox.No) == QMessageBox.Yes:
+            self.seal_and_reset("shift_end")
+
+    def seal_and_reset(self, reason):
+        # The session is only cleared once it is safely in the archive
+        if self.session.all_boxes:
+            try:
+                path = self.archive.seal(*self.session.snapshot(), reason=reason,
+                                         meta={"scan_stats": self.scan_metrics.snapshot()})
+                logger.info("Session sealed into %s (%s)", path, reason)
+            except Exception as e:
+                logger.exception("seal_and_reset - Archive failed")
+                self.show_error(f"Не удалось сохранить сессию в архив: {e}")
+                return
+        self.session.reset()
+        self.scan_metrics = ScanMetrics()
+        self.box_entry.setEnabled(True)
+        self.box_entry.clear()
+        self.item_scan_entry.setEnabled(False)
+        self.item_scan_entry.clear()
+        self.search_entry.clear()
+        self.update_status("")
+        self.box_entry.setFocus()
+        self.save_button.setEnabled(False)
 
     def is_valid_barcode(self, barcode, barcode_type):
-        print(f"is_valid_barcode started - barcode: {barcode}, type: {barcode_type}")  # DEBUG
-        if not self.strict_validation_enabled:
-            pattern = r"^[\w\-\./]+$"
-            valid = bool(re.match(pattern, barcode)) and 8 <= len(barcode) <= 40
-            print(f"is_valid_barcode - Validation (old): {valid}")  # DEBUG
-            return valid
-        else:
-            if barcode_type == 'box':
-                if barcode.upper().startswith('WB_'):  # Exception for WB_ boxes
-                    pattern = r"^WB_[\w\-]+$"  # Stricter pattern for WB_ boxes: WB_ followed by alphanum and hyphen
-                    valid = bool(re.match(pattern, barcode.upper())) and 8 <= len(barcode) <= 40  # Keep length check
-                    print(f"is_valid_barcode - Validation (strict WB_ exception): {valid}")  # DEBUG
-                    return valid
-                else:
-                    pattern = r"^[0-9]+$"  # Strict pattern for other box codes: only digits
-                    valid = bool(re.match(pattern, barcode)) and 8 <= len(barcode) <= 40
-                    print(f"is_valid_barcode - Validation (strict box, digits only): {valid}")  # DEBUG
-                    return valid
-            elif barcode_type == 'item':
-                ean13_pattern = r"^[0-9]{13}$" # EAN-13 pattern: 13 digits
-                ozn_pattern = r"^ozn[0-9]+$"  # Strict pattern for item codes: ozn followed by digits
-                valid_ean13 = bool(re.match(ean13_pattern, barcode))
-                valid_ozn = bool(re.match(ozn_pattern, barcode.lower()))
-
-                valid = (valid_ean13 or valid_ozn) and 8 <= len(barcode) <= 40 # Check length only once
-                print(f"is_valid_barcode - Validation (strict item, EAN13 or ozn digits): {valid}, EAN13: {valid_ean13}, ozn: {valid_ozn}")  # DEBUG
-                return valid
-            else:
-                print(f"is_valid_barcode - Warning: Unknown barcode type: {barcode_type}. Using default strict (digits only).") #DEBUG
-                pattern = r"^[0-9]+$" # Default strict pattern if type is unknown
-                valid = bool(re.match(pattern, barcode)) and 8 <= len(barcode) <= 40
-                print(f"is_valid_barcode - Validation (strict default, digits only): {valid}")  # DEBUG
-                return valid
+        return self.validator.is_valid(barcode, barcode_type)
+
+    def update_validator(self):
+        # Rules are compiled once here, not on every is_valid_barcode call
+        self.validator = barcode_rules.validator_for(self.barcode_profiles, self.barcode_profile, self.strict_validation_enabled)
+        logger.debug("update_validator - Profile: %s, strict: %s", self.barcode_profile, self.strict_validation_enabled)
+
+    def create_error_banner(self):
+        # Scan errors show up here instead of a modal box, so the scanner keeps working
+        self.error_banner = QFrame()
+        self.error_banner.setStyleSheet("QFrame { background-color: #f8d7da; border: 1px solid #f5c2c7; }"
+                                        "QLabel { color: #842029; border: none; }")
+        banner_layout = QHBoxLayout(self.error_banner)
+        banner_layout.setContentsMargins(8, 4, 8, 4)
+        self.error_banner_label = QLabel()
+        banner_layout.addWidget(self.error_banner_label, 1)
+        # No focus for the buttons, a click must not take the scanner's keystrokes away
+        errors_button = QPushButton("Все ошибки")
+        errors_button.setFocusPolicy(Qt.NoFocus)
+        errors_button.clicked.connect(self.show_scan_errors)
+        banner_layout.addWidget(errors_button)
+        hide_button = QPushButton("Скрыть")
+        hide_button.setFocusPolicy(Qt.NoFocus)
+        hide_button.clicked.connect(self.error_banner.hide)
+        banner_layout.addWidget(hide_button)
+        self.error_banner.hide()
+        self.main_layout.addWidget(self.error_banner)
+
+    def report_scan_error(self, message, barcode=""):
+        self.scan_error_count += 1
+        entry = f"{datetime.now().strftime('%H:%M:%S')}  {message} {barcode}".rstrip()
+        self.scan_errors.append(entry)
+        self.error_banner_label.setText(f"{entry}    (ошибок: {self.scan_error_count})")
+        self.error_banner.show()
+        if self.scan_errors_list is not None:
+            self.scan_errors_list.addItem(entry)
+            self.scan_errors_list.scrollToBottom()
+        QApplication.beep()
+        logger.debug("report_scan_error - Message: %s %s", message, barcode)
+
+    def show_scan_errors(self):
+        if self.scan_errors_window is not None and self.scan_errors_window.isVisible():
+            self.scan_errors_window.raise_()
+            return
+        self.scan_errors_window = QDialog(self)
+        self.scan_errors_window.setWindowTitle("Ошибки сканирования")
+        self.scan_errors_window.setWindowModality(Qt.NonModal)
+        self.scan_errors_window.resize(600, 400)
+        layout = QVBoxLayout(self.scan_errors_window)
+        self.scan_errors_list = QListWidget()
+        self.scan_errors_list.addItems(list(self.scan_errors))
+        self.scan_errors_list.scrollToBottom()
+        layout.addWidget(self.scan_errors_list)
+        clear_button = QPushButton("Очистить")
+        clear_button.clicked.connect(self.clear_scan_errors)
+        layout.addWidget(clear_button)
+        self.scan_errors_window.finished.connect(self.close_scan_errors)
+        self.scan_errors_window.show()
+
+    def clear_scan_errors(self):
+        self.scan_errors.clear()
+        self.scan_error_count = 0
+        if self.scan_errors_list is not None:
+            self.scan_errors_list.clear()
+        self.error_banner.hide()
+
+    def close_scan_errors(self):
+        self.scan_errors_window = None
+        self.scan_errors_list = None
 
     def show_error(self, message):
         QMessageBox.critical(self, "Ошибка", message)
-        print(f"show_error - Message: {message}") # DEBUG
+        logger.debug("show_error - Message: %s", message)
 
     def show_warning(self, message):
         QMessageBox.warning(self, "Предупреждение", message)
-        print(f"show_warning - Message: {message}") # DEBUG
+        logger.debug("show_warning - Message: %s", message)
 
     def show_info(self, message):
         QMessageBox.information(self, "Информация", message)
-        print(f"show_info - Message: {message}") # DEBUG
+        logger.debug("show_info - Message: %s", message)
 
     def update_status(self, message):
         self.status_bar.showMessage(message)
-        print(f"update_status - Message: {message}") # DEBUG
+        logger.debug("update_status - Message: %s", message)
 
     def update_summary(self):
-        num_boxes = len(self.all_boxes)
-        total_items = 0
-        for box, items in self.all_boxes.items():
-            total_items += sum(items.values())
-
-        summary_text = f"Коробов: {num_boxes} | Товаров: {total_items}"
+        num_boxes, total_items, num_skus = self.session.summary()
+        summary_text = f"Коробов: {num_boxes} | Товаров: {total_items} | Артикулов: {num_skus}"
         self.summary_label.setText(summary_text)
-        print(f"update_summary - Summary: {summary_text}") # DEBUG
+        logger.debug("update_summary - Summary: %s", summary_text)
 
     def load_state(self):
-        print("load_state started") # DEBUG
+        logger.debug("load_state started")
         try:
-            if os.path.exists(self.state_file):
-                print(f"load_state - Loading state from: {self.state_file}") # DEBUG
-                with open(self.state_file, "r") as f:
-                    data = json.load(f)
-                    if 'all_boxes' in data:
-                        self.all_boxes = {str(k): v for k, v in data['all_boxes'].items()}
-                    if 'current_box_barcode' in data:
-                        self.current_box_barcode = data['current_box_barcode']
-                    if 'search_query' in data:
-                        self.search_query = data['search_query']
-                    serializable_comments = data.get('comments', {})
-                    self.comments = {}
-                    for key_str, comment in serializable_comments.items():
-                        try:
-                            box_barcode, item_barcode_str = key_str.split(",", 1) if "," in key_str else (key_str, "")
-                            item_barcode = item_barcode_str if item_barcode_str else ""
-                            self.comments[(box_barcode, item_barcode)] = comment
-                        except ValueError:
-                            print(f"load_state - Warning: could not parse comment key string: {key_str}")
-                    if 'strict_validation_enabled' in data:
-                        self.strict_validation_enabled = data['strict_validation_enabled']
-                        if hasattr(self, 'strict_validation_checkbox'):
-                            self.strict_validation_checkbox.setChecked(self.strict_validation_enabled)
-                print("load_state - State loaded successfully") # DEBUG
-                self.refresh_treeview()
-                if self.current_box_barcode:
-                    self.box_entry.setEnabled(False)
-                    self.item_scan_entry.setEnabled(True)
-                    self.save_button.setEnabled(True)
-        except FileNotFoundError:
-            print("load_state - State file not found. Starting fresh.") # DEBUG
+            self.session.load()
+            logger.debug("load_state - Loaded snapshot %s and %s journal records", self.state_file, self.session.journal.records_since_snapshot)
+            self.strict_validation_enabled = self.session.settings.get("strict_validation_enabled", self.strict_validation_enabled)
+            self.barcode_profile = self.session.settings.get("barcode_profile", self.barcode_profile)
+            self.excel_layout = self.session.settings.get("excel_layout", self.excel_layout)
+            self.double_scan_filter.window_ms = self.session.settings.get("double_scan_window_ms", self.double_scan_filter.window_ms)
+            self.update_validator()
+            self.search_entry.setText(self.session.search_query)
+            if hasattr(self, 'strict_validation_checkbox'):
+                self.strict_validation_checkbox.setChecked(self.strict_validation_enabled)
+            logger.debug("load_state - State loaded successfully")
+            if self.session.current_box_barcode:
+                self.box_entry.setEnabled(False)
+                self.item_scan_entry.setEnabled(True)
+                self.save_button.setEnabled(True)
         except json.JSONDecodeError as e:
             self.show_error("Ошибка при загрузке состояния: Некорректный формат файла.")
-            print(f"load_state - JSONDecodeError: {e}") # DEBUG
+            logger.error("load_state - JSONDecodeError: %s", e)
         except Exception as e:
             self.show_error(f"Ошибка при загрузке состояния: {e}")
-            print(f"load_state - Error loading state: {e}") # DEBUG
-        print("load_state finished") # DEBUG
+            logger.error("load_state - Error loading state: %s", e)
+        logger.debug("load_state finished")
 
     def save_state(self):
-        print("save_state started") # DEBUG
-        serializable_comments = {}
-        for key, comment in self.comments.items():
-            if not isinstance(key, tuple) or len(key) != 2:
-                print(f"save_state - WARNING: Invalid key format in self.comments: {key}")
-                continue
-
-            box_barcode, item_barcode = key
-            key_str = f"{box_barcode},{item_barcode}"
-            serializable_comments[key_str] = comment
-        data = {
-            "all_boxes": self.all_boxes,
-            "current_box_barcode": self.current_box_barcode,
-            "search_query": self.search_query,
-            "comments": serializable_comments,
-            "strict_validation_enabled": self.strict_validation_enabled,
-        }
+        # Compacts the journal into a fresh snapshot (atomic rename)
+        logger.debug("save_state started")
         try:
-            with open(self.state_file, "w") as f:
-                json.dump(data, f)
-            print("save_state - State saved successfully") # DEBUG
+            self.session.save()
+            self.persist_error_reported = False
+            logger.debug("save_state - State saved successfully")
         except Exception as e:
             self.show_error(f"Ошибка при сохранении состояния: {e}")
-            print(f"save_state - Error saving state: {e}") # DEBUG
-        print("save_state finished") # DEBUG
+            logger.error("save_state - Error saving state: %s", e)
+        logger.debug("save_state finished")
 
     def on_closing(self):
-        print("on_closing started") # DEBUG
+        logger.debug("on_closing started")
+        QApplication.instance().removeEventFilter(self.scan_capture)
         self.save_state()
+        self.session.journal.close()
+        if self.export_thread is not None and self.export_thread.is_alive():
+            self.export_cancel.set()
+            self.export_thread.join(5)
+        if self.import_thread is not None and self.import_thread.is_alive():
+            self.import_cancel.set()
+        if self.history_writer is not None:
+            self.history_writer.close()
         self.close()
-        print("on_closing finished") # DEBUG
+        logger.debug("on_closing finished")
         super().closeEvent(QCloseEvent())
 
     def show_paste_menu(self, event, entry_widget):
@@ -1419,13 +2048,19 @@ class QBarcodeApp(QMainWindow):
 
     def paste_from_clipboard(self, entry_widget):
         text = self.clipboard.text()
+        if entry_widget in (self.box_entry, self.item_scan_entry):
+            text = normalize(text)  # search and filter fields may look for Russian comments
         entry_widget.insert(text)
 
 
 from PyQt5.QtCore import QTimer, QEvent
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # CSV merge workers in the frozen (PyInstaller) build
+    log_handler = setup_logging()
+    # Unhandled exceptions in slots go to the log (and the Debug Console) instead of aborting
+    sys.excepthook = lambda *exc_info: logger.critical("Unhandled exception", exc_info=exc_info)
     app = QApplication(sys.argv)
-    barcode_app = QBarcodeApp()
+    barcode_app = QBarcodeApp(log_handler)
     barcode_app.show()
     sys.exit(app.exec_())
@@ -1,17 +1,23 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, simpledialog
-import openpyxl
-from openpyxl.styles import Alignment
-import pyzbar.pyzbar as pyzbar
 import threading
 import os, sys
 import pyperclip
-import re
 import json
 from pathlib import Path
 import csv
+import time
 from datetime import datetime
 
+import barcode_rules
+import scan_session
+from scan_session import ScanSession, SessionError
+from csv_import import import_csv, write_rejects, CsvFormatError, CSV_HEADER
+from excel_export import export_workbook, LAYOUT_PER_BOX
+from session_archive import SessionArchive
+from keyboard_layout import normalize
+from scan_queue import DoubleScanFilter
+
 
 class BarcodeApp:
     def __init__(self, master):
@@ -30,16 +36,20 @@ class BarcodeApp:
             except tk.TclError:
                 print("Не удалось установить иконку")
 
-        self.all_boxes = {}
-        self.current_box_barcode = ""
-        self.search_query = ""
         self.state_file = "barcode_app_state.json"
+        self.session = ScanSession(self.state_file)
+        self.double_scan_filter = DoubleScanFilter()
+        self.archive = SessionArchive("archive")
+        self.session.subscribe(self.on_session_event)
+        # (box, item) -> Treeview item id and back, box rows use item ""
+        self.tree_index = {}
+        self.tree_keys = {}
         self.box_bg_color = "#f2f2f2"
         self.history_file = None
         self.history_window = None
         self.history_tree = None
-        self.comments = {}
         self.history_filter_query = tk.StringVar()
+        self.validator = barcode_rules.validator_for(barcode_rules.BUILTIN_PROFILES, barcode_rules.LENIENT_PROFILE)
 
         self.style = ttk.Style()
         self.style.theme_use("default")
@@ -245,7 +255,7 @@ class BarcodeApp:
         self.status_bar.pack(side="bottom", fill="x")
 
     def process_box_barcode(self, event=None):
-        barcode = self.box_entry.get().strip()
+        barcode = normalize(self.box_entry.get().strip())
         if not barcode:
             self.show_warning("Введите штрихкод короба!")
             return
@@ -253,21 +263,17 @@ class BarcodeApp:
             self.show_error("Неверный штрихкод короба!")
             self.box_entry.delete(0, tk.END)
             return
-        if barcode not in self.all_boxes:
-            self.all_boxes[barcode] = {}
-        self.current_box_barcode = barcode
+        self.session.select_box(barcode)
         self.box_entry.config(state="disabled")
         self.item_scan_entry.config(state="normal")
         self.item_scan_entry.focus_set()
         self.save_button.config(state="normal")
-        self.update_status(f"Текущий короб: {self.current_box_barcode}")
-        self.refresh_treeview()
         self.log_scan(barcode, "box")
         self.highlight_entry(self.box_entry)
 
     def process_item_barcode(self, event=None):
-        barcode = self.item_scan_entry.get().strip()
-        if not self.current_box_barcode:
+        barcode = normalize(self.item_scan_entry.get().strip())
+        if not self.session.current_box_barcode:
             self.show_warning("Сначала отсканируйте штрихкод короба!")
             self.item_scan_entry.delete(0, tk.END)
             self.box_entry.focus_set()
@@ -275,14 +281,19 @@ class BarcodeApp:
         if not barcode:
             self.show_warning("Введите штрихкод товара!")
             return
+        if self.double_scan_filter.is_repeat(barcode, time.perf_counter()):
+            self.log_scan(barcode, "dup")  # scanner bounce, not counted
+            self.item_scan_entry.delete(0, tk.END)
+            return
         if not self.is_valid_barcode(barcode):
             self.show_error("Неверный штрихкод товара!")
             self.item_scan_entry.delete(0, tk.END)
             return
-        if self.current_box_barcode not in self.all_boxes:
-            messagebox.showerror("Ошибка", "Текущий короб не найден!")
+        try:
+            self.add_item(barcode)
+        except SessionError as e:
+            messagebox.showerror("Ошибка", str(e))
             return
-        self.add_item(barcode)
         self.log_scan(barcode, "item")
         if self.autoclear_item_entry.get():
             self.item_scan_entry.delete(0, tk.END)
@@ -294,27 +305,87 @@ class BarcodeApp:
         self.master.after(200, lambda: entry.config(background=original_bg))
 
     def add_item(self, item_barcode):
-        if item_barcode in self.all_boxes[self.current_box_barcode]:
-            self.all_boxes[self.current_box_barcode][item_barcode] += 1
-        else:
-            self.all_boxes[self.current_box_barcode][item_barcode] = 1
-        self.refresh_treeview()
+        self.session.add_item(item_barcode)
+
+    def on_session_event(self, event, *args):
+        if event == scan_session.RESET:
+            self.refresh_treeview()
+            return
+        if event == scan_session.BOX_ADDED:
+            self.box_row(args[0])
+        elif event == scan_session.ITEM_CHANGED:
+            self.item_row(*args)
+        elif event == scan_session.ITEM_REMOVED:
+            self.remove_row(args)
+        elif event == scan_session.BOX_REMOVED:
+            self.remove_row((args[0], ""))
+        elif event in (scan_session.BOX_RENAMED, scan_session.ITEM_RENAMED):
+            # Renames are rare and may change what the search filter shows
+            self.refresh_treeview()
+        elif event == scan_session.COMMENT_CHANGED:
+            item_id = self.tree_index.get(args)
+            if item_id is not None:
+                self.items_tree.set(item_id, "comment", self.session.get_comment(*args))
+        elif event == scan_session.CURRENT_BOX_CHANGED:
+            self.update_status(f"Текущий короб: {args[0]}" if args[0] else "")
+        elif event == scan_session.PERSIST_ERROR:
+            self.show_error(f"Ошибка при сохранении состояния: {args[0]}")
+        if event in (scan_session.ITEM_CHANGED, scan_session.ITEM_REMOVED):
+            box_item_id = self.tree_index.get((args[0], ""))
+            if box_item_id is not None:
+                self.items_tree.set(box_item_id, "count", self.session.box_total(args[0]))
+        if event in (scan_session.BOX_ADDED, scan_session.ITEM_CHANGED, scan_session.ITEM_REMOVED, scan_session.BOX_REMOVED):
+            self.update_summary()
 
     def refresh_treeview(self):
         for item in self.items_tree.get_children():
             self.items_tree.delete(item)
-        for box_barcode, items in self.all_boxes.items():
-            box_comment = self.comments.get((box_barcode, ""), "")
-            box_item_id = self.items_tree.insert("", "end", values=(box_barcode, "", "", box_comment), open=True, tags=('box_row',))
-            for item_barcode, count in items.items():
-                item_comment = self.comments.get((box_barcode, item_barcode), "")
-                if not self.search_query or self.search_query.lower() in box_barcode.lower() or self.search_query.lower() in item_barcode.lower():
-                    self.items_tree.insert(box_item_id, "end", values=("", item_barcode, count, item_comment))
+        self.tree_index = {}
+        self.tree_keys = {}
+        for box_barcode, items in self.session.all_boxes.items():
+            self.box_row(box_barcode)
+            for item_barcode in items:
+                self.item_row(box_barcode, item_barcode)
         self.update_summary()
         self.style.map("Treeview", foreground=[('disabled', 'gray30')])
 
+    def matches_search(self, box_barcode, item_barcode):
+        query = self.session.search_query.lower()
+        return not query or query in box_barcode.lower() or query in item_barcode.lower()
+
+    def box_row(self, box_barcode):
+        box_item_id = self.tree_index.get((box_barcode, ""))
+        if box_item_id is None:
+            box_comment = self.session.get_comment(box_barcode)
+            box_total = self.session.box_total(box_barcode)
+            box_item_id = self.items_tree.insert("", "end", values=(box_barcode, "", box_total, box_comment), open=True, tags=('box_row',))
+            self.tree_index[(box_barcode, "")] = box_item_id
+            self.tree_keys[box_item_id] = (box_barcode, "")
+        return box_item_id
+
+    def item_row(self, box_barcode, item_barcode):
+        count = self.session.get_count(box_barcode, item_barcode)
+        item_id = self.tree_index.get((box_barcode, item_barcode))
+        if item_id is not None:
+            self.items_tree.set(item_id, "count", count)
+        elif self.matches_search(box_barcode, item_barcode):
+            item_comment = self.session.get_comment(box_barcode, item_barcode)
+            item_id = self.items_tree.insert(self.box_row(box_barcode), "end", values=("", item_barcode, count, item_comment))
+            self.tree_index[(box_barcode, item_barcode)] = item_id
+            self.tree_keys[item_id] = (box_barcode, item_barcode)
+        return item_id
+
+    def remove_row(self, key):
+        item_id = self.tree_index.pop(key, None)
+        if item_id is None:
+            return
+        for child_id in self.items_tree.get_children(item_id):
+            self.tree_index.pop(self.tree_keys.pop(child_id), None)
+        del self.tree_keys[item_id]
+        self.items_tree.delete(item_id)
+
     def filter_items(self, event=None):
-        self.search_query = self.search_entry.get()
+        self.session.search_query = self.search_entry.get()
         self.refresh_treeview()
 
     def show_context_menu(self, event):
@@ -325,29 +396,26 @@ class BarcodeApp:
       self.items_tree.selection_set(item_id)
       column_id = self.items_tree.identify_column(event.x)
       values = self.items_tree.item(item_id, "values")
+      box_barcode, item_barcode = self.tree_keys[item_id]
 
       context_menu = tk.Menu(self.master, tearoff=0, font=self.font_menu)
 
-      if len(values) == 4 and values[1] == "" and values[2] == "":
+      if not item_barcode:
           if column_id == "#1":
-              context_menu.add_command(label="Копировать штрихкод короба", command=lambda: pyperclip.copy(values[0]))
+              context_menu.add_command(label="Копировать штрихкод короба", command=lambda: pyperclip.copy(box_barcode))
           elif column_id == '#4':
               context_menu.add_command(label="Изменить комментарий", command=lambda: self.edit_comment(item_id))
           context_menu.add_command(label="Изменить штрихкод короба", command=lambda: self.edit_box_barcode(item_id))
           context_menu.add_command(label="Удалить короб", command=lambda: self.delete_box(item_id))
       else: 
           selected_item_id = self.items_tree.selection()[0]
-          item_values = self.items_tree.item(selected_item_id, "values")
-
-          parent_item_id = self.items_tree.parent(item_id)
-          box_barcode = self.items_tree.item(parent_item_id, "values")[0]
           if column_id == "#1":
               context_menu.add_command(label="Копировать штрихкод короба",
                                        command=lambda: pyperclip.copy(box_barcode))
           elif column_id == "#2":
-              context_menu.add_command(label="Копировать штрихкод товара", command=lambda: pyperclip.copy(values[1]))
+              context_menu.add_command(label="Копировать штрихкод товара", command=lambda: pyperclip.copy(item_barcode))
           elif column_id == "#3":
-              context_menu.add_command(label="Копировать количество", command=lambda: pyperclip.copy(values[2]))
+              context_menu.add_command(label="Копировать количество", command=lambda: pyperclip.copy(str(values[2])))
           elif column_id == "#4":
               context_menu.add_command(label="Изменить комментарий", command=lambda: self.edit_comment(item_id))
 
@@ -364,10 +432,8 @@ class BarcodeApp:
           self.items_tree.selection_remove(self.items_tree.selection())
 
     def edit_item_count(self, selected_item_id):
-        parent_id = self.items_tree.parent(selected_item_id)
-        box_barcode = self.items_tree.item(parent_id)['values'][0]
-        current_count = self.items_tree.item(selected_item_id, 'values')[2]
-        barcode = self.items_tree.item(selected_item_id, 'values')[1]
+        box_barcode, barcode = self.tree_keys[selected_item_id]
+        current_count = self.session.get_count(box_barcode, barcode)
 
         new_count = simpledialog.askinteger(
             "Изменить количество",
@@ -377,137 +443,72 @@ class BarcodeApp:
             minvalue=0
         )
         if new_count is not None:
-            print(f"Тип box_barcode: {type(box_barcode)}, Значение: {box_barcode}")
-            print(f"Ключи all_boxes: {list(self.all_boxes.keys())}")
-            print(f"Типы ключей в all_boxes: {[type(k) for k in self.all_boxes.keys()]}")
-            if str(box_barcode) in self.all_boxes:
-                if new_count == 0:
-                    if barcode in self.all_boxes[box_barcode]:
-                        del self.all_boxes[box_barcode][barcode]
-                        if not self.all_boxes[box_barcode]:
-                            del self.all_boxes[box_barcode]
-                else:
-                    self.all_boxes[str(box_barcode)][barcode] = new_count
-
-            item_values = self.items_tree.item(selected_item_id, 'values')
-            if len(item_values) == 4:
-                new_values = ('', barcode, new_count, item_values[3])
-                self.items_tree.item(selected_item_id, values=new_values)
-            print(f"Изменение количества: Короб: {box_barcode}, Товар: {barcode}, Новое количество: {new_count}")
-            print(f"all_boxes до изменения: {self.all_boxes}")
-            self.refresh_treeview()
-            print(f"all_boxes после изменения: {self.all_boxes}")
-            self.update_summary()
+            self.session.set_item_count(box_barcode, barcode, new_count)
             self.save_state()
 
     def edit_box_barcode(self, item_id):
-      old_barcode = self.items_tree.item(item_id, "values")[0]
+      old_barcode = self.tree_keys[item_id][0]
 
       new_barcode = simpledialog.askstring("Изменить штрихкод короба",
                                           "Введите новый штрихкод короба:",
                                           parent=self.master,
                                           initialvalue=old_barcode)
+      if new_barcode is not None:
+          new_barcode = normalize(new_barcode.strip())
 
-      if new_barcode is not None and new_barcode != old_barcode:
+      if new_barcode and new_barcode != old_barcode:
           if self.is_valid_barcode(new_barcode):
-              if new_barcode not in self.all_boxes:
-                  self.all_boxes[new_barcode] = self.all_boxes.pop(old_barcode)
-                  for key in list(self.comments.keys()):
-                      if key[0] == old_barcode:
-                          new_key = (new_barcode, key[1])
-                          self.comments[new_key] = self.comments.pop(key)
-
-                  if self.current_box_barcode == old_barcode:
-                      self.current_box_barcode = new_barcode
-                      self.update_status(f"Текущий короб: {self.current_box_barcode}")
-                  self.refresh_treeview()
-              else:
-                  self.show_error("Короб с таким штрихкодом уже существует!")
+              try:
+                  self.session.rename_box(old_barcode, new_barcode)
+              except SessionError as e:
+                  self.show_error(str(e))
 
           else:
               self.show_error("Неверный штрихкод короба!")
 
     def edit_item_barcode(self, item_id):
-      parent_item_id = self.items_tree.parent(item_id)
-      box_barcode = self.items_tree.item(parent_item_id, "values")[0]
-      old_barcode = self.items_tree.item(item_id, "values")[1]
+      box_barcode, old_barcode = self.tree_keys[item_id]
 
       new_barcode = simpledialog.askstring("Изменить штрихкод товара",
                                           "Введите новый штрихкод товара:",
                                           parent=self.master,
                                           initialvalue=old_barcode)
-      if new_barcode is not None and new_barcode != old_barcode:
+      if new_barcode is not None:
+          new_barcode = normalize(new_barcode.strip())
+      if new_barcode and new_barcode != old_barcode:
           if self.is_valid_barcode(new_barcode):
-              if new_barcode not in self.all_boxes[box_barcode]:
-                  self.all_boxes[box_barcode][new_barcode] = self.all_boxes[box_barcode].pop(old_barcode)
-                  if (box_barcode, old_barcode) in self.comments:
-                    self.comments[(box_barcode, new_barcode)] = self.comments.pop((box_barcode, old_barcode))
-                  self.refresh_treeview()
-              else:
-                self.show_error("Товар с таким штрихкодом уже есть в этом коробе!")
+              try:
+                  self.session.rename_item(box_barcode, old_barcode, new_barcode)
+              except SessionError as e:
+                  self.show_error(str(e))
           else:
             self.show_error("Неверный штрихкод товара!")
 
     def delete_box(self, item_id):
-      box_barcode = self.items_tree.item(item_id, "values")[0]
+      box_barcode = self.tree_keys[item_id][0]
       if messagebox.askyesno("Удалить короб", f"Вы уверены, что хотите удалить короб '{box_barcode}'?"):
-          del self.all_boxes[box_barcode]
-          keys_to_delete = []
-          for key in self.comments:
-            if key[0] == box_barcode:
-                keys_to_delete.append(key)
-          for key in keys_to_delete:
-            del self.comments[key]
-          if self.current_box_barcode == box_barcode:
-            self.current_box_barcode = ""
-            self.update_status("")
-          self.refresh_treeview()
+          self.session.delete_box(box_barcode)
 
     def delete_item(self, item_id):
-      parent_item_id = self.items_tree.parent(item_id)
-      box_barcode = self.items_tree.item(parent_item_id, "values")[0]
-      item_barcode = self.items_tree.item(item_id, "values")[1]
+      box_barcode, item_barcode = self.tree_keys[item_id]
 
       if messagebox.askyesno("Удалить товар", f"Вы уверены, что хотите удалить товар '{item_barcode}' из короба '{box_barcode}'?"):
-          del self.all_boxes[box_barcode][item_barcode]
-          if (box_barcode, item_barcode) in self.comments:
-            del self.comments[(box_barcode, item_barcode)]
-          if not self.all_boxes[box_barcode]:
-            del self.all_boxes[box_barcode]
-          if (box_barcode, "") in self.comments:
-            del self.comments[(box_barcode, "")]
-          if self.current_box_barcode == box_barcode:
-            self.current_box_barcode = ""
-            self.update_status("")
-
-          self.refresh_treeview()
+          self.session.delete_item(box_barcode, item_barcode)
 
     def edit_comment(self, item_id):
-      values = self.items_tree.item(item_id, "values")
-      if len(values) == 4 and values[1] == "" and values[2] == "":  
-          box_barcode = values[0]
-          current_comment = self.comments.get((box_barcode, ""), "")  
-          new_comment = simpledialog.askstring("Изменить комментарий",
-                                              f"Введите комментарий для короба {box_barcode}:",
-                                              parent=self.master,
-                                              initialvalue=current_comment)
-          if new_comment is not None:
-              self.comments[(box_barcode, "")] = new_comment
-              self.refresh_treeview()
+      box_barcode, item_barcode = self.tree_keys[item_id]
+      current_comment = self.session.get_comment(box_barcode, item_barcode)
+      if not item_barcode:
+          prompt = f"Введите комментарий для короба {box_barcode}:"
       else:
           # Это товар
-          parent_item_id = self.items_tree.parent(item_id)
-          box_barcode = self.items_tree.item(parent_item_id, "values")[0]
-          item_barcode = values[1]
-          current_comment = self.comments.get((box_barcode, item_barcode), "")
-          new_comment = simpledialog.askstring("Изменить комментарий",
-                                              f"Введите комментарий для товара {item_barcode}:",
-                                              parent=self.master,
-                                              initialvalue=current_comment)
-          if new_comment is not None:
-              self.comments[(box_barcode, item_barcode)] = new_comment
-              self.refresh_treeview()
-              
+          prompt = f"Введите комментарий для товара {item_barcode}:"
+      new_comment = simpledialog.askstring("Изменить комментарий", prompt,
+                                          parent=self.master,
+                                          initialvalue=current_comment)
+      if new_comment is not None:
+          self.session.set_comment(box_barcode, item_barcode, new_comment)
+
     def on_double_click(self, event):
         item_id = self.items_tree.identify_row(event.y) 
         column_id = self.items_tree.identify_column(event.x)
@@ -518,6 +519,8 @@ class BarcodeApp:
         column_index = int(column_id[1:]) - 1
         if column_index < 0:
             return
+        if column_index == 2 and not self.tree_keys[item_id][1]:
+            return  # box total, not editable
 
         values = self.items_tree.item(item_id, "values")
         if len(values) <= column_index:
@@ -536,7 +539,7 @@ class BarcodeApp:
         self.edit_entry.bind("<FocusOut>", lambda e: self.save_edit(item_id, column_index))
 
     def save_to_excel(self):
-      if not self.all_boxes:
+      if not self.session.all_boxes:
           self.show_warning("Нет данных для сохранения!")
           return
       file_path = filedialog.asksaveasfilename(
@@ -546,46 +549,13 @@ class BarcodeApp:
       if not file_path:
           return
       try:
-          wb = openpyxl.Workbook()
-          wb.remove(wb.active)
-          for box_barcode, items in self.all_boxes.items():
-              sheet = wb.create_sheet(title=f"Короб {box_barcode}")
-              sheet['A1'] = "Штрихкод короба"
-              sheet['B1'] = box_barcode
-              sheet['C1'] = "Комментарий"
-              sheet['A2'] = "Штрихкод товара"
-              sheet['B2'] = "Количество"
-              sheet['C2'] = "Комментарий"
-              for cell in ['A1', 'B1', 'C1', 'A2', 'B2', 'C2']:
-                  sheet[cell].alignment = Alignment(horizontal='center')
-              row = 3
-              sheet.cell(row=row, column=1, value="Комментарий к коробу:")
-              sheet.cell(row=row, column=3, value=self.comments.get((box_barcode, ""), ""))
-              row += 1
-              for item_barcode, count in items.items():
-                sheet.cell(row=row, column=1, value=item_barcode)
-                sheet.cell(row=row, column=2, value=count).alignment = Alignment(horizontal='center')
-                sheet.cell(row=row, column=3,
-                              value=self.comments.get((box_barcode, item_barcode), ""))
-                row += 1
-
-              for column in sheet.columns:
-                max_length = 0
-                col_letter = openpyxl.utils.get_column_letter(column[0].column)
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except Exception:
-                        pass
-                sheet.column_dimensions[col_letter].width = max_length + 2
-          wb.save(file_path)
+          export_workbook(file_path, self.session.all_boxes, self.session.comments, layout=LAYOUT_PER_BOX)
           self.show_info(f"Данные сохранены в {file_path}")
       except Exception as e:
           self.show_error(f"Ошибка при сохранении: {e}")
 
     def save_to_csv(self):
-        if not self.all_boxes:
+        if not self.session.all_boxes:
            self.show_warning("Нет данных для сохранения!")
            return
         file_path = filedialog.asksaveasfilename(
@@ -598,13 +568,9 @@ class BarcodeApp:
         try:
             with open(file_path, "w", newline="", encoding="utf-8") as f:
                 writer = csv.writer(f)
-                writer.writerow(["Штрихкод короба", "Комментарий короба", "Штрихкод товара", "Количество", "Комментарий товара"])
+                writer.writerow(CSV_HEADER)
 
-                for box_barcode, items in self.all_boxes.items():
-                    box_comment = self.comments.get((box_barcode, ""), "")
-                    for item_barcode, count in items.items():
-                        item_comment = self.comments.get((box_barcode, item_barcode),"")
-                        writer.writerow([box_barcode, box_comment, item_barcode, count, item_comment])
+                writer.writerows(self.session.iter_rows())
 
             self.show_info(f"Данные сохранены в {file_path}")
         except Exception as e:
@@ -618,71 +584,36 @@ class BarcodeApp:
           return
 
       try:
-          with open(file_path, "r", encoding="utf-8") as f:
-              reader = csv.reader(f)
-              header = next(reader, None)
-              if header is None:
-                  self.show_warning("Файл пуст.")
-                  return
-
-              if not (len(header) >= 3 and header[0] == "Штрихкод короба" and header[2] == "Штрихкод товара" and header[3] == "Количество"):
-                  self.show_warning("Некорректный формат файла CSV. Ожидаются колонки: Штрихкод короба, Штрихкод товара, Количество")
-                  return
-
-
-              self.all_boxes = {}
-              self.current_box_barcode = ""
-              self.comments = {}
-              for row in reader:
-                  if len(row) < 3:
-                      self.show_warning(f"Некорректное количество столбцов в строке: {row}")
-                      continue
-
-                  box_barcode = row[0].strip()
-                  item_barcode = row[2].strip()
-                  count_str = row[3].strip()
-
-                  box_comment = row[1].strip() if len(row) > 1 else ""
-                  item_comment = row[4].strip() if len(row) > 4 else ""
-
-                  if not self.is_valid_barcode(box_barcode):
-                      self.show_warning(f'Недопустимый штрихкод короба: {box_barcode}')
-                      continue
-                  if not self.is_valid_barcode(item_barcode):
-                      self.show_warning(f'Недопустимый штрихкод товара: {item_barcode}')
-                      continue
-                  try:
-                      count = int(count_str)
-                      if count <= 0:
-                          raise ValueError("Количество должно быть положительным")
-                  except ValueError:
-                      self.show_warning(f"Некорректное количество '{count_str}' для товара '{item_barcode}' в коробе '{box_barcode}'.")
-                      continue
-
-                  if box_barcode not in self.all_boxes:
-                      self.all_boxes[box_barcode] = {}
-                  self.all_boxes[box_barcode][item_barcode] = self.all_boxes[box_barcode].setdefault(item_barcode, 0) + count
-
-                  box_comment = row[1].strip() if len(row) > 1 else "" 
-                  item_comment = row[4].strip() if len(row) > 4 else "" 
-
-
-                  self.comments[(box_barcode, "")] = box_comment 
-                  if item_barcode: 
-                      self.comments[(box_barcode, item_barcode)] = item_comment
-
-
-              self.refresh_treeview()
-              if self.all_boxes:
-                  self.update_status("Данные загружены из CSV")
-                  self.save_button.config(state='normal')
+          result = import_csv(file_path, self.validator, box_type="any", item_type="any")
+      except CsvFormatError as e:
+          self.show_warning(str(e))
+          return
       except FileNotFoundError:
           self.show_error("Файл не найден.")
+          return
       except Exception as e:
           self.show_error(f"Ошибка при загрузке данных из CSV: {e}")
+          return
+
+      self.session.replace(result.all_boxes, result.comments)
+      if self.session.all_boxes:
+          self.update_status("Данные загружены из CSV")
+          self.save_button.config(state='normal')
+      if result.rejects and messagebox.askyesno("Отклонённые строки",
+                                                f"Не загружено строк: {len(result.rejects)}. Сохранить отчёт об ошибках?"):
+          report_path = filedialog.asksaveasfilename(
+              defaultextension=".csv",
+              initialfile=os.path.basename(os.path.splitext(file_path)[0]) + "_errors.csv",
+              filetypes=[("CSV Files", "*.csv"), ("All Files", "*.*")],
+          )
+          if report_path:
+              try:
+                  write_rejects(report_path, result.rejects)
+              except Exception as e:
+                  self.show_error(f"Ошибка при сохранении отчёта: {e}")
 
     def new_box(self):
-        self.current_box_barcode = ""
+        self.session.set_current_box("")
         self.update_status("Введите штрихкод нового короба")
         self.box_entry.config(state="normal")
         self.box_entry.delete(0, tk.END)
@@ -691,25 +622,25 @@ class BarcodeApp:
         self.item_scan_entry.config(state="disabled")
 
     def reset_application(self):
-        if messagebox.askyesno("Подтверждение", "Вы уверены, что хотите начать заново? Все несохранённые данные будут потеряны."):
-            self.all_boxes = {}
-            self.current_box_barcode = ""
-            self.search_query = ""
-            self.comments = {}
+        if messagebox.askyesno("Подтверждение", "Вы уверены, что хотите начать заново? Текущая сессия будет перенесена в архив."):
+            if self.session.all_boxes:
+                try:
+                    self.archive.seal(*self.session.snapshot(), reason="reset")
+                except Exception as e:
+                    self.show_error(f"Не удалось сохранить сессию в архив: {e}")
+                    return
+            self.session.reset()
             self.box_entry.config(state="normal")
             self.box_entry.delete(0, tk.END)
             self.item_scan_entry.config(state="disabled")
             self.item_scan_entry.delete(0, tk.END)
             self.search_entry.delete(0, tk.END)
-            self.refresh_treeview()
             self.update_status("")
             self.box_entry.focus_set()
             self.save_button.config(state='disabled')
-            self.save_state()
 
     def is_valid_barcode(self, barcode):
-        pattern = r"^[\w\-\./]+$"
-        return bool(re.match(pattern, barcode)) and 8 <= len(barcode) <= 40
+        return self.validator.is_valid(barcode, "any")
 
     def show_error(self, message):
         messagebox.showerror("Ошибка", message)
@@ -724,43 +655,18 @@ class BarcodeApp:
         self.status_bar.config(text=message)
 
     def update_summary(self):
-        num_boxes = len(self.all_boxes)
-        total_items = 0
-        for box, items in self.all_boxes.items():
-            total_items += sum(items.values())
-
-        summary_text = f"Коробов: {num_boxes} | Товаров: {total_items}"
+        num_boxes, total_items, num_skus = self.session.summary()
+        summary_text = f"Коробов: {num_boxes} | Товаров: {total_items} | Артикулов: {num_skus}"
         self.summary_label.config(text=summary_text)
 
     def load_state(self):
         try:
-            with open(self.state_file, "r") as f:
-                data = json.load(f)
-                if 'all_boxes' in data:
-                    self.all_boxes = {str(k): v for k, v in data['all_boxes'].items()}
-                    self.all_boxes = data['all_boxes']
-                if 'current_box_barcode' in data:
-                    self.current_box_barcode = data['current_box_barcode']
-                if 'search_query' in data:
-                    self.search_query = data['search_query']
-                serializable_comments = data.get('comments', {})
-                self.comments = {}
-                for key_str, comment in serializable_comments.items():
-                    try:
-                        box_barcode, item_barcode_str = key_str.split(",", 1) if "," in key_str else (key_str, "")
-                        item_barcode = item_barcode_str if item_barcode_str else ""
-                        self.comments[(box_barcode, item_barcode)] = comment
-                    except ValueError:
-                        print(f"Warning: could not parse comment key string: {key_str}")
-
-            self.refresh_treeview()
-            if self.current_box_barcode:
+            self.session.load()
+            if self.session.current_box_barcode:
                 self.box_entry.config(state='disabled')
                 self.item_scan_entry.config(state='normal')
                 self.save_button.config(state='normal')
             print("State loaded successfully.")
-        except FileNotFoundError:
-            print("State file not found. Starting fresh.")
         except json.JSONDecodeError as e:
             self.show_error("Ошибка при загрузке состояния: Некорректный формат файла.")
             print(f"JSONDecodeError details: {e}")
@@ -769,24 +675,8 @@ class BarcodeApp:
             print(f"General load_state error details: {e}")
 
     def save_state(self):
-        serializable_comments = {}
-        for key, comment in self.comments.items():
-            if not isinstance(key, tuple) or len(key) != 2:
-                print(f"WARNING: Invalid key format in self.comments: {key}")
-                continue
-
-            box_barcode, item_barcode = key
-            key_str = f"{box_barcode},{item_barcode}"
-            serializable_comments[key_str] = comment
-        data = {
-            "all_boxes": self.all_boxes,
-            "current_box_barcode": self.current_box_barcode,
-            "search_query": self.search_query,
-            "comments": serializable_comments,
-        }
         try:
-            with open(self.state_file, "w") as f:
-                json.dump(data, f)
+            self.session.save()
         except Exception as e:
             self.show_error(f"Ошибка при сохранении состояния: {e}")
             print(f"Error details: {e}")
@@ -798,57 +688,41 @@ class BarcodeApp:
         if not new_value:
             return
 
-        values = list(self.items_tree.item(item_id, "values"))
-        old_value = values[column_index]
+        box_barcode, item_barcode = self.tree_keys[item_id]
+        old_value = str(self.items_tree.set(item_id, self.items_tree["columns"][column_index]))
 
         if new_value == old_value:
             return
 
-        values[column_index] = new_value
-        self.items_tree.item(item_id, values=values)
-
-        parent_id = self.items_tree.parent(item_id)
-        if parent_id:
-            box_barcode = self.items_tree.item(parent_id, "values")[0]
-            item_barcode = values[1]  # Штрихкод товара
-
-            if column_index == 2:
-                try:
-                    new_count = int(new_value)
-                    if new_count <= 0:
-                        del self.all_boxes[box_barcode][item_barcode]
-                    else:
-                        self.all_boxes[box_barcode][item_barcode] = new_count
-                except ValueError:
-                    self.show_error("Количество должно быть числом!")
-                    return
-        elif column_index == 1:
-            if new_value in self.all_boxes[box_barcode]:
-                self.show_error("Товар с таким штрихкодом уже есть!")
-                return
-                self.all_boxes[box_barcode][new_value] = self.all_boxes[box_barcode].pop(old_value)
-            elif column_index == 3:
-                self.comments[(box_barcode, item_barcode)] = new_value
-
-        else:
-            box_barcode = values[0]
-            if column_index == 0:
-                if new_value in self.all_boxes:
-                    self.show_error("Короб с таким штрихкодом уже существует!")
-                    return
-                self.all_boxes[new_value] = self.all_boxes.pop(old_value)
-                self.comments[(new_value, "")] = self.comments.pop((old_value, ""), "")
-
-            elif column_index == 3:
-                self.comments[(box_barcode, "")] = new_value
+        try:
+            if item_barcode:
+                if column_index == 2:
+                    try:
+                        new_count = int(new_value)
+                    except ValueError:
+                        self.show_error("Количество должно быть числом!")
+                        return
+                    self.session.set_item_count(box_barcode, item_barcode, max(new_count, 0))
+                elif column_index == 1:
+                    self.session.rename_item(box_barcode, item_barcode, normalize(new_value))
+                elif column_index == 3:
+                    self.session.set_comment(box_barcode, item_barcode, new_value)
+            else:
+                if column_index == 0:
+                    self.session.rename_box(box_barcode, normalize(new_value))
+                elif column_index == 3:
+                    self.session.set_comment(box_barcode, "", new_value)
+        except SessionError as e:
+            self.show_error(str(e))
+            return
 
         self.save_state()
-        self.refresh_treeview()
         
 
 
     def on_closing(self):
         self.save_state()
+        self.session.journal.close()
         self.master.destroy()
 
     def show_paste_menu(self, event, entry_widget):
@@ -1044,6 +918,7 @@ class ToolTip:
 
 
 
-root = tk.Tk()
-app = BarcodeApp(root)
-root.mainloop()
+if __name__ == "__main__":
+    root = tk.Tk()
+    app = BarcodeApp(root)
+    root.mainloop()
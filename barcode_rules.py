@@ -0,0 +1,167 @@
+import copy
+import json
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILE = "generic"
+LENIENT_PROFILE = "lenient"
+
+# A profile maps a barcode type ("box", "item") to a list of rules, a barcode is valid when any
+# rule of its type matches. Types without rules fall back to "default".
+# Rule keys: name, pattern, ignore_case (False), checksum (None or a CHECKSUMS key),
+# min_length (8), max_length (40)
+BUILTIN_PROFILES = {
+    "generic": {
+        "title": "Общий",
+        "box": [
+            {"name": "WB_", "pattern": r"^WB_[\w\-]+$", "ignore_case": True},
+            {"name": "digits", "pattern": r"^[0-9]+$"},
+        ],
+        "item": [
+            {"name": "EAN-13", "pattern": r"^[0-9]{13}$", "checksum": "gtin"},
+            {"name": "EAN-8", "pattern": r"^[0-9]{8}$", "checksum": "gtin"},
+            {"name": "UPC-A", "pattern": r"^[0-9]{12}$", "checksum": "gtin"},
+            {"name": "OZN", "pattern": r"^ozn[0-9]+$", "ignore_case": True},
+        ],
+        "default": [
+            {"name": "digits", "pattern": r"^[0-9]+$"},
+        ],
+    },
+    "wildberries": {
+        "title": "Wildberries",
+        "box": [
+            {"name": "WB_", "pattern": r"^WB_[\w\-]+$", "ignore_case": True},
+            {"name": "digits", "pattern": r"^[0-9]+$"},
+        ],
+        "item": [
+            {"name": "EAN-13", "pattern": r"^[0-9]{13}$", "checksum": "gtin"},
+            {"name": "EAN-8", "pattern": r"^[0-9]{8}$", "checksum": "gtin"},
+            {"name": "UPC-A", "pattern": r"^[0-9]{12}$", "checksum": "gtin"},
+        ],
+        "default": [
+            {"name": "digits", "pattern": r"^[0-9]+$"},
+        ],
+    },
+    "ozon": {
+        "title": "Ozon",
+        "box": [
+            {"name": "digits", "pattern": r"^[0-9]+$"},
+        ],
+        "item": [
+            {"name": "OZN", "pattern": r"^ozn[0-9]+$", "ignore_case": True},
+            {"name": "EAN-13", "pattern": r"^[0-9]{13}$", "checksum": "gtin"},
+        ],
+        "default": [
+            {"name": "digits", "pattern": r"^[0-9]+$"},
+        ],
+    },
+    # Used when strict validation is switched off
+    "lenient": {
+        "title": "Без строгой проверки",
+        "default": [
+            {"name": "any", "pattern": r"^[\w\-\./]+$"},
+        ],
+    },
+}
+
+
+def gtin_check_digit_ok(barcode):
+    # GS1 mod-10 check digit, shared by EAN-8, UPC-A, EAN-13 and GTIN-14
+    total = 0
+    for i, ch in enumerate(reversed(barcode[:-1])):
+        total += int(ch) * (3 if i % 2 == 0 else 1)
+    return (10 - total % 10) % 10 == int(barcode[-1])
+
+
+CHECKSUMS = {
+    "gtin": gtin_check_digit_ok,
+    "ean13": gtin_check_digit_ok,
+    "ean8": gtin_check_digit_ok,
+    "upca": gtin_check_digit_ok,
+}
+
+
+def load_profiles(config_path=None):
+    # Built-in profiles, overridden/extended by the "profiles" section of a JSON config file
+    profiles = copy.deepcopy(BUILTIN_PROFILES)
+    if config_path and os.path.exists(config_path):
+        try:
+            with open(config_path, "r", encoding="utf-8") as f:
+                custom = json.load(f).get("profiles", {})
+            for name, definition in custom.items():
+                compile_profile(definition)  # reject broken profiles before they replace anything
+                profiles[name] = definition
+        except Exception as e:
+            logger.warning("load_profiles - Warning: could not load barcode rules from %s: %s", config_path, e)
+    return profiles
+
+
+def compile_profile(definition):
+    compiled = {}
+    for barcode_type, rules in definition.items():
+        if not isinstance(rules, list):
+            continue
+        compiled[barcode_type] = [
+            (
+                rule.get("name", rule["pattern"]),
+                re.compile(rule["pattern"], re.IGNORECASE if rule.get("ignore_case") else 0).match,
+                CHECKSUMS[rule["checksum"]] if rule.get("checksum") else None,
+                rule.get("min_length", 8),
+                rule.get("max_length", 40),
+            )
+            for rule in rules
+        ]
+    return compiled
+
+
+class BarcodeValidator:
+    """Validates barcodes against one precompiled profile.
+
+    Results are memoized per (type, barcode): a session repeats the same item
+    barcodes thousands of times, so after the first scan a check is one dict lookup.
+    """
+
+    def __init__(self, definition, max_cache=200000):
+        self.rules = compile_profile(definition)
+        self.max_cache = max_cache
+        self._cache = {}
+
+    def rules_for(self, barcode_type):
+        if barcode_type in self.rules:
+            return self.rules[barcode_type]
+        return self.rules.get("default", [])
+
+    def match(self, barcode, barcode_type):
+        # Name of the first matching rule or None
+        for name, match, checksum, min_length, max_length in self.rules_for(barcode_type):
+            if min_length <= len(barcode) <= max_length and match(barcode) and (checksum is None or checksum(barcode)):
+                return name
+        return None
+
+    def is_valid(self, barcode, barcode_type):
+        key = (barcode_type, barcode)
+        valid = self._cache.get(key)
+        if valid is None:
+            valid = self.match(barcode, barcode_type) is not None
+            if len(self._cache) >= self.max_cache:
+                self._cache.clear()
+            self._cache[key] = valid
+        return valid
+
+    def validate_many(self, barcodes, barcode_type):
+        # Batch form for import paths, returns a list of bools in input order
+        is_valid = self.is_valid
+        return [is_valid(barcode, barcode_type) for barcode in barcodes]
+
+
+def profile_definition(profiles, profile_name, strict=True):
+    if not strict:
+        profile_name = LENIENT_PROFILE
+    return profiles.get(profile_name) or profiles[DEFAULT_PROFILE]
+
+
+def validator_for(profiles, profile_name, strict=True):
+    return BarcodeValidator(profile_definition(profiles, profile_name, strict))
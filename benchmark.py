@@ -0,0 +1,328 @@
+"""Headless benchmarks of the scan hot path.
+
+    python benchmark.py run --out results.json [--sizes 1000 10000] [--boxes 10 1000] [--frontends qt core]
+    python benchmark.py compare old.json new.json
+
+Every (front-end, items, boxes) case runs in its own process so the peak memory of
+one case does not leak into the next. The Qt app runs on the offscreen platform; the
+Tk app needs a display and is reported as skipped without one. State, journal and
+history files go to a temporary directory, never to the real ~/.ScanBox.
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+FRONTENDS = ("core", "qt", "tk")
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_BOXES = (10, 100, 1000)
+SKU_COUNT = 2000
+# Metrics where lower is better; compare reports new/old for each of them
+METRICS = ("box_p50_ms", "scan_p50_ms", "scan_p99_ms", "scan_mean_ms", "update_summary_ms", "refresh_treeview_ms",
+           "save_state_ms", "log_scan_ms", "csv_export_s", "csv_import_s", "excel_export_s", "peak_rss_mb")
+
+
+def ean13(body):
+    digits = [int(c) for c in body]
+    check = (10 - sum(d * (3 if i % 2 else 1) for i, d in enumerate(digits)) % 10) % 10
+    return body + str(check)
+
+
+def scan_stream(items, boxes, seed=1):
+    # [(box barcode, [item barcodes])], items spread evenly over the boxes
+    rng = random.Random(seed)
+    catalog = [ean13(f"460{rng.randrange(10 ** 9):09d}") for _ in range(SKU_COUNT)]
+    per_box, extra = divmod(items, boxes)
+    return [(f"WB_{b:08d}", [rng.choice(catalog) for _ in range(per_box + (b < extra))]) for b in range(boxes)]
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def timed(func, repeat=1):
+    # Median wall time of func() in ms
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+
+
+class Driver:
+    """Uniform handle on one front-end: scan a box, scan an item, and the timed operations."""
+
+    def __init__(self, frontend, workdir):
+        self.frontend = frontend
+        self.workdir = workdir
+        self.pump = lambda: None
+        getattr(self, f"start_{frontend}")()
+
+    def start_core(self):
+        from scan_session import ScanSession
+        import barcode_rules
+        self.session = ScanSession(os.path.join(self.workdir, "state.json"))
+        self.validator = barcode_rules.validator_for(barcode_rules.BUILTIN_PROFILES, barcode_rules.DEFAULT_PROFILE)
+        self.scan_box = self.session.select_box
+        self.scan_item = self.session.add_item
+        self.new_box = lambda: self.session.set_current_box("")
+        self.refresh_treeview = None
+        self.update_summary = self.session.summary
+        self.save_state = self.session.save
+        self.log_scan = None
+        self.close = self.session.close
+
+    def start_qt(self):
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        from PyQt5.QtWidgets import QApplication
+        self.qt_app = QApplication.instance() or QApplication([sys.argv[0]])
+        import BoxScan_newAlpha
+        app = BoxScan_newAlpha.QBarcodeApp(log_dir=self.workdir)
+        self.app = app
+        self.session = app.session
+        self.validator = app.validator
+        self.scan_box = app.process_box_barcode
+        self.scan_item = app.process_item_barcode
+        self.new_box = app.new_box
+        self.refresh_treeview = app.refresh_treeview
+        self.update_summary = app.update_summary
+        self.save_state = app.save_state
+        self.log_scan = lambda: app.log_scan("4600000000000", "item")
+        self.pump = self.qt_app.processEvents
+        self.close = app.on_closing
+
+    def start_tk(self):
+        import tkinter as tk
+        import ScanBox
+        self.root = tk.Tk()
+        self.root.withdraw()
+        app = ScanBox.BarcodeApp(self.root)
+        # The stream repeats an item back to back now and then, that is not scanner bounce
+        app.double_scan_filter.window_ms = 0
+        self.app = app
+        self.session = app.session
+        self.validator = app.validator
+
+        def enter(entry, handler, barcode):
+            entry.delete(0, tk.END)
+            entry.insert(0, barcode)
+            handler()
+
+        self.scan_box = lambda barcode: enter(app.box_entry, app.process_box_barcode, barcode)
+        self.scan_item = lambda barcode: enter(app.item_scan_entry, app.process_item_barcode, barcode)
+        self.new_box = app.new_box
+        self.refresh_treeview = app.refresh_treeview
+        self.update_summary = app.update_summary
+        self.save_state = app.save_state
+        self.log_scan = lambda: app.log_scan("4600000000000", "item")
+        self.pump = self.root.update
+        self.close = app.on_closing
+
+
+def run_case(frontend, items, boxes):
+    workdir = tempfile.mkdtemp(prefix="scanbox_bench_")
+    # Every front-end keeps its state under the home directory or the working directory
+    os.environ["HOME"] = os.environ["USERPROFILE"] = workdir
+    os.chdir(workdir)
+    result = {"frontend": frontend, "items": items, "boxes": boxes}
+    try:
+        try:
+            driver = Driver(frontend, workdir)
+        except Exception as e:
+            result["skipped"] = f"{type(e).__name__}: {e}"
+        else:
+            measure(driver, items, boxes, workdir, result)
+    finally:
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def measure(driver, items, boxes, workdir, result):
+
+    box_latencies = []
+    latencies = []
+    for box_barcode, item_barcodes in scan_stream(items, boxes):
+        driver.new_box()
+        start = time.perf_counter()
+        driver.scan_box(box_barcode)
+        box_latencies.append(time.perf_counter() - start)
+        for item_barcode in item_barcodes:
+            start = time.perf_counter()
+            driver.scan_item(item_barcode)
+            latencies.append(time.perf_counter() - start)
+            if len(latencies) % 1000 == 0:
+                driver.pump()  # paint and timers, outside the measured time
+    driver.pump()
+    error = unit_error(driver.session, items)
+    if error:
+        result["error"] = error
+
+    latencies.sort()
+    box_latencies.sort()
+    result.update({
+        "box_p50_ms": percentile(box_latencies, 0.5) * 1000,
+        "scan_p50_ms": percentile(latencies, 0.5) * 1000,
+        "scan_p99_ms": percentile(latencies, 0.99) * 1000,
+        "scan_mean_ms": sum(latencies) / len(latencies) * 1000,
+        "update_summary_ms": timed(driver.update_summary, 100),
+        "refresh_treeview_ms": timed(driver.refresh_treeview, 3) if driver.refresh_treeview else None,
+        "save_state_ms": timed(driver.save_state, 3),
+        "log_scan_ms": timed(driver.log_scan, 1000) if driver.log_scan else None,
+    })
+    result.update(io_timings(driver, workdir))
+    result["peak_rss_mb"] = peak_rss_mb()
+    try:
+        driver.close()
+    except Exception as e:
+        # The measurements above stand, a broken shutdown is reported next to them
+        result["teardown_error"] = f"{type(e).__name__}: {e}"
+
+
+def unit_error(session, items):
+    # Every scan of the stream must be counted, a front-end dropping some would look faster than it is
+    if session.total_units != items:
+        return f"session holds {session.total_units} units, expected {items}"
+    return None
+
+
+def io_timings(driver, workdir):
+    # The same calls the menu actions make, without the file dialogs
+    from csv_import import import_csv, CSV_HEADER
+    timings = {}
+    csv_path = os.path.join(workdir, "export.csv")
+    start = time.perf_counter()
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        writer.writerows(driver.session.iter_rows())
+    timings["csv_export_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    imported = import_csv(csv_path, driver.validator)
+    driver.session.replace(imported.all_boxes, imported.comments)
+    driver.pump()
+    timings["csv_import_s"] = time.perf_counter() - start
+
+    try:
+        from excel_export import export_workbook
+    except ImportError as e:
+        timings["excel_export_s"] = None
+        timings["excel_skipped"] = str(e)
+        return timings
+    start = time.perf_counter()
+    export_workbook(os.path.join(workdir, "export.xlsx"), *driver.session.snapshot())
+    timings["excel_export_s"] = time.perf_counter() - start
+    return timings
+
+
+def run_all(frontends, sizes, box_counts):
+    results = []
+    for frontend in frontends:
+        for items in sizes:
+            for boxes in box_counts:
+                if boxes > items:
+                    continue
+                print(f"{frontend}: {items} items in {boxes} boxes...", file=sys.stderr)
+                completed = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "case", frontend, str(items), str(boxes)],
+                    capture_output=True, text=True,
+                )
+                if completed.returncode != 0:
+                    lines = completed.stderr.strip().splitlines() or [f"exit code {completed.returncode}"]
+                    results.append({"frontend": frontend, "items": items, "boxes": boxes, "error": lines[-1]})
+                    continue
+                results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(old, new):
+    # new/old per case and metric, > 1 is slower or bigger
+    old_cases = {(r["frontend"], r["items"], r["boxes"]): r for r in old["results"]}
+    for r in new["results"]:
+        key = (r["frontend"], r["items"], r["boxes"])
+        before = old_cases.get(key)
+        if before is None:
+            continue
+        ratios = []
+        for metric in METRICS:
+            if r.get(metric) and before.get(metric):
+                ratios.append(f"{metric} x{r[metric] / before[metric]:.2f}")
+        print(f"{key[0]} {key[1]}/{key[2]}: " + (", ".join(ratios) or "no common metrics"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки ScanBox")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run = subparsers.add_parser("run")
+    run.add_argument("--frontends", nargs="+", choices=FRONTENDS, default=list(FRONTENDS))
+    run.add_argument("--sizes", nargs="+", type=int, default=list(DEFAULT_SIZES))
+    run.add_argument("--boxes", nargs="+", type=int, default=list(DEFAULT_BOXES))
+    run.add_argument("--out")
+    case = subparsers.add_parser("case")
+    case.add_argument("frontend", choices=FRONTENDS)
+    case.add_argument("items", type=int)
+    case.add_argument("boxes", type=int)
+    diff = subparsers.add_parser("compare")
+    diff.add_argument("old")
+    diff.add_argument("new")
+    args = parser.parse_args(argv)
+
+    if args.command == "case":
+        print(json.dumps(run_case(args.frontend, args.items, args.boxes)))
+    elif args.command == "compare":
+        with open(args.old, encoding="utf-8") as f:
+            old = json.load(f)
+        with open(args.new, encoding="utf-8") as f:
+            new = json.load(f)
+        compare(old, new)
+    else:
+        report = {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "results": run_all(args.frontends, args.sizes, args.boxes),
+        }
+        text = json.dumps(report, indent=2, ensure_ascii=False)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                f.write(text)
+        else:
+            print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
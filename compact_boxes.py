@@ -0,0 +1,190 @@
+from array import array
+from collections.abc import MutableMapping
+
+# A packed numeric code is value << 5 | length, 17 digits still fit in a signed 64-bit int
+NUMERIC_MAX_DIGITS = 17
+
+
+class BarcodeTable:
+    """Maps item barcodes to 64-bit codes and back, shared by all boxes of a session.
+
+    Digit-only barcodes (EAN/UPC) are packed into the code itself together with their
+    length, so leading zeros survive and no string object is kept for them. Any other
+    barcode is stored once and coded as a negative index into the string list.
+    """
+
+    def __init__(self):
+        self.strings = []
+        self.string_codes = {}
+
+    def encode(self, barcode, add=True):
+        # None for a non-numeric barcode that was never stored (only when add is False)
+        if len(barcode) <= NUMERIC_MAX_DIGITS and barcode.isascii() and barcode.isdigit():
+            return int(barcode) << 5 | len(barcode)
+        code = self.string_codes.get(barcode)
+        if code is None and add:
+            self.strings.append(barcode)
+            code = self.string_codes[barcode] = -len(self.strings)
+        return code
+
+    def decode(self, code):
+        if code >= 0:
+            return str(code >> 5).zfill(code & 31)
+        return self.strings[-code - 1]
+
+
+class CompactItems(MutableMapping):
+    """item barcode -> count of one box, kept in two parallel arrays in insertion order.
+
+    Boxes hold tens of items, so lookups scan the code array (in C) instead of keeping
+    a hash table per box.
+    """
+
+    __slots__ = ("table", "codes", "counts")
+
+    def __init__(self, table):
+        self.table = table
+        self.codes = array("q")
+        self.counts = array("l")
+
+    def find(self, item_barcode):
+        code = self.table.encode(item_barcode, add=False)
+        if code is None:
+            return -1
+        try:
+            return self.codes.index(code)
+        except ValueError:
+            return -1
+
+    def __getitem__(self, item_barcode):
+        i = self.find(item_barcode)
+        if i < 0:
+            raise KeyError(item_barcode)
+        return self.counts[i]
+
+    def __setitem__(self, item_barcode, count):
+        i = self.find(item_barcode)
+        if i < 0:
+            self.codes.append(self.table.encode(item_barcode))
+            self.counts.append(count)
+        else:
+            self.counts[i] = count
+
+    def __delitem__(self, item_barcode):
+        i = self.find(item_barcode)
+        if i < 0:
+            raise KeyError(item_barcode)
+        del self.codes[i]
+        del self.counts[i]
+
+    def __iter__(self):
+        decode = self.table.decode
+        return iter([decode(code) for code in self.codes])
+
+    def __len__(self):
+        return len(self.codes)
+
+    def items(self):
+        # Pairs in one pass over the arrays, the generic view would look every key up again
+        decode = self.table.decode
+        return [(decode(code), count) for code, count in zip(self.codes, self.counts)]
+
+    def values(self):
+        return list(self.counts)
+
+    def __repr__(self):
+        return f"CompactItems({dict(self.items())!r})"
+
+
+class CompactBoxes(MutableMapping):
+    """Drop-in for the all_boxes dict of dicts: box barcode -> CompactItems.
+
+    Plain dicts assigned to it are converted, so session code can keep writing
+    all_boxes[box] = {} and then filling the box through all_boxes[box].
+    """
+
+    def __init__(self, all_boxes=None):
+        self.table = BarcodeTable()
+        self.boxes = {}
+        if all_boxes:
+            for box_barcode, items in all_boxes.items():
+                self[box_barcode] = items
+
+    def __getitem__(self, box_barcode):
+        return self.boxes[box_barcode]
+
+    def __setitem__(self, box_barcode, items):
+        if not isinstance(items, CompactItems) or items.table is not self.table:
+            compact = CompactItems(self.table)
+            for item_barcode, count in items.items():
+                compact[item_barcode] = count
+            items = compact
+        self.boxes[box_barcode] = items
+
+    def __delitem__(self, box_barcode):
+        del self.boxes[box_barcode]
+
+    def __iter__(self):
+        return iter(self.boxes)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __contains__(self, box_barcode):
+        return box_barcode in self.boxes
+
+    def items(self):
+        return self.boxes.items()
+
+    def setdefault(self, box_barcode, default=None):
+        # The stored CompactItems, not the (converted) default, so callers can fill it
+        if box_barcode not in self.boxes:
+            self[box_barcode] = default if default is not None else {}
+        return self.boxes[box_barcode]
+
+
+def plain_boxes(all_boxes):
+    # all_boxes as dict of dicts, for JSON snapshots and copies handed to other threads
+    if isinstance(all_boxes, dict):
+        return all_boxes
+    return {box_barcode: dict(items.items()) for box_barcode, items in all_boxes.items()}
+
+
+def synthetic_session(units=1_000_000, boxes=10_000, skus=5_000, seed=1):
+    # Dict of dicts with every barcode a separate string, as after loading a JSON snapshot
+    import random
+    rng = random.Random(seed)
+    catalog = [f"46{rng.randrange(10 ** 10):010d}{rng.randrange(10)}" for _ in range(skus)]
+    all_boxes = {}
+    per_box = units // boxes
+    for b in range(boxes):
+        items = {}
+        remaining = per_box
+        while remaining:
+            count = min(remaining, rng.randint(1, 8))
+            item_barcode = "".join(rng.choice(catalog))  # a copy, not the catalog string
+            items[item_barcode] = items.get(item_barcode, 0) + count
+            remaining -= count
+        all_boxes[f"BOX{b:07d}"] = items
+    return all_boxes
+
+
+def measure(units=1_000_000):
+    # (dict bytes, compact bytes) allocated for the same synthetic session
+    import tracemalloc
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    all_boxes = synthetic_session(units)
+    dict_bytes = tracemalloc.get_traced_memory()[0] - start
+    compact = CompactBoxes(all_boxes)
+    all_boxes = None
+    compact_bytes = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del compact
+    return dict_bytes, compact_bytes
+
+
+if __name__ == "__main__":
+    dict_bytes, compact_bytes = measure()
+    print(f"dict of dicts: {dict_bytes / 2 ** 20:.1f} MiB")
+    print(f"CompactBoxes:  {compact_bytes / 2 ** 20:.1f} MiB ({compact_bytes / dict_bytes:.0%})")
@@ -0,0 +1,125 @@
+import csv
+import os
+from itertools import islice
+
+from keyboard_layout import normalize_many
+
+CSV_HEADER = ["Штрихкод короба", "Комментарий короба", "Штрихкод товара", "Количество", "Комментарий товара"]
+REJECTS_HEADER = ["Строка", "Причина"] + CSV_HEADER
+
+
+class CsvFormatError(Exception):
+    pass
+
+
+class ImportCancelled(Exception):
+    pass
+
+
+class ImportResult:
+    """Staging area of an import: aggregated boxes/comments plus every rejected row."""
+
+    def __init__(self, source=""):
+        self.source = source
+        self.all_boxes = {}
+        self.comments = {}  # box -> {item: text}, as in ScanSession
+        self.rejects = []  # (line number, reason, row)
+        self.rows_read = 0
+        self.rows_accepted = 0
+
+    def add(self, box_barcode, item_barcode, count, box_comment="", item_comment=""):
+        items = self.all_boxes.get(box_barcode)
+        if items is None:
+            self.all_boxes[box_barcode] = items = {}
+        items[item_barcode] = items.get(item_barcode, 0) + count
+        if box_comment:
+            self.comments.setdefault(box_barcode, {})[""] = box_comment
+        if item_comment:
+            self.comments.setdefault(box_barcode, {})[item_barcode] = item_comment
+        self.rows_accepted += 1
+
+    def reject(self, line_number, reason, row):
+        self.rejects.append((line_number, reason, row))
+
+
+def read_lines(binary_file, counter):
+    # Decoded lines for csv.reader; counter[0] tracks the bytes consumed for progress
+    for raw in binary_file:
+        counter[0] += len(raw)
+        yield raw.decode("utf-8")
+
+
+def import_csv(path, validator, box_type="box", item_type="item", progress=None, cancel=None, chunk_size=5000):
+    """Parses a save_to_csv file into an ImportResult without touching any session.
+
+    Rows are read and validated in chunks (one validate_many call per column and chunk).
+    Invalid rows are collected in result.rejects instead of being reported one by one.
+    progress(bytes_read, file_size) is called once per chunk; setting the cancel event
+    raises ImportCancelled. A missing or wrong header raises CsvFormatError.
+    """
+    result = ImportResult(path)
+    file_size = os.path.getsize(path)
+    counter = [0]
+    with open(path, "rb") as f:
+        reader = csv.reader(read_lines(f, counter))
+        header = next(reader, None)
+        if header is None:
+            raise CsvFormatError("Файл пуст.")
+        if header:
+            header[0] = header[0].lstrip("\ufeff")
+        if not (len(header) >= 4 and header[0] == CSV_HEADER[0] and header[2] == CSV_HEADER[2] and header[3] == CSV_HEADER[3]):
+            raise CsvFormatError("Некорректный формат файла CSV. Ожидаются колонки: Штрихкод короба, Штрихкод товара, Количество")
+
+        while True:
+            if cancel is not None and cancel.is_set():
+                raise ImportCancelled()
+            chunk = []
+            for row in islice(reader, chunk_size):
+                chunk.append((reader.line_num, row))
+            if not chunk:
+                break
+            stage_chunk(result, chunk, validator, box_type, item_type)
+            if progress is not None:
+                progress(counter[0], file_size)
+    return result
+
+
+def stage_chunk(result, chunk, validator, box_type, item_type):
+    result.rows_read += len(chunk)
+    rows = []
+    for line_number, row in chunk:
+        if len(row) < 4:
+            result.reject(line_number, "Некорректное количество столбцов", row)
+        else:
+            rows.append((line_number, row))
+    # Files saved from a station with the Russian layout hold ЙЦУКЕН letters, fixed per column
+    box_barcodes = normalize_many([row[0].strip() for _, row in rows])
+    item_barcodes = normalize_many([row[2].strip() for _, row in rows])
+    boxes_valid = validator.validate_many(box_barcodes, box_type)
+    items_valid = validator.validate_many(item_barcodes, item_type)
+
+    for (line_number, row), box_barcode, item_barcode, box_valid, item_valid in zip(
+            rows, box_barcodes, item_barcodes, boxes_valid, items_valid):
+        count_str = row[3].strip()
+        if not box_valid:
+            result.reject(line_number, f"Недопустимый штрихкод короба: {box_barcode}", row)
+            continue
+        if not item_valid:
+            result.reject(line_number, f"Недопустимый штрихкод товара: {item_barcode}", row)
+            continue
+        try:
+            count = int(count_str)
+        except ValueError:
+            count = 0
+        if count <= 0:
+            result.reject(line_number, f"Некорректное количество '{count_str}'", row)
+            continue
+        result.add(box_barcode, item_barcode, count, row[1].strip(), row[4].strip() if len(row) > 4 else "")
+
+
+def write_rejects(path, rejects):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(REJECTS_HEADER)
+        for line_number, reason, row in sorted(rejects, key=lambda reject: reject[0]):
+            writer.writerow([line_number, reason] + list(row))
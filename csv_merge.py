@@ -0,0 +1,111 @@
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from barcode_rules import BarcodeValidator
+from csv_import import ImportResult, ImportCancelled, import_csv
+
+CONFLICT_BOX = "Короб в нескольких файлах"
+CONFLICT_COMMENT = "Разные комментарии"
+CONFLICT_REJECT = "Отклонённая строка"
+CONFLICT_FAILED = "Файл не прочитан"
+REPORT_HEADER = ["Тип", "Короб", "Товар", "Файлы", "Подробности"]
+
+
+class MergeResult(ImportResult):
+    """ImportResult of several station files plus what did not add up between them."""
+
+    def __init__(self, source=""):
+        super().__init__(source)
+        self.files = []
+        self.conflicts = []  # (type, box, item, files, details)
+
+
+def parse_station_file(path, profile_definition):
+    # Runs in a worker process, so it gets the plain profile dict and builds its own validator
+    validator = BarcodeValidator(profile_definition)
+    return import_csv(path, validator)
+
+
+def station_files(directory):
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(".csv") and os.path.isfile(os.path.join(directory, name))
+    )
+
+
+def reduce_results(results, merged):
+    # results: [(path, ImportResult)] in file order. Counts are summed, the first non-empty
+    # comment of a key is kept and every differing one is reported.
+    box_files = {}
+    comment_files = {}
+    for path, result in results:
+        name = os.path.basename(path)
+        merged.files.append(path)
+        merged.rows_read += result.rows_read
+        merged.rows_accepted += result.rows_accepted
+        for line_number, reason, row in result.rejects:
+            merged.rejects.append((line_number, f"{name}: {reason}", row))
+            merged.conflicts.append((CONFLICT_REJECT, row[0] if row else "", row[2] if len(row) > 2 else "",
+                                     name, f"строка {line_number}: {reason}"))
+        for box_barcode, items in result.all_boxes.items():
+            box_files.setdefault(box_barcode, []).append(name)
+            target = merged.all_boxes.setdefault(box_barcode, {})
+            for item_barcode, count in items.items():
+                target[item_barcode] = target.get(item_barcode, 0) + count
+        for box_barcode, box_comments in result.comments.items():
+            target = merged.comments.setdefault(box_barcode, {})
+            for item_barcode, comment in box_comments.items():
+                current = target.get(item_barcode)
+                if current is None:
+                    target[item_barcode] = comment
+                    comment_files[(box_barcode, item_barcode)] = name
+                elif current != comment:
+                    merged.conflicts.append((CONFLICT_COMMENT, box_barcode, item_barcode,
+                                             f"{comment_files[(box_barcode, item_barcode)]}, {name}",
+                                             f"оставлен '{current}', отброшен '{comment}'"))
+
+    for box_barcode, names in box_files.items():
+        if len(names) > 1:
+            merged.conflicts.append((CONFLICT_BOX, box_barcode, "", ", ".join(names),
+                                     f"товаров: {len(merged.all_boxes[box_barcode])}"))
+    return merged
+
+
+def merge_directory(directory, profile_definition, max_workers=None, progress=None, cancel=None):
+    """Parses every *.csv in directory in parallel and reduces them into one MergeResult.
+
+    Each file is parsed by import_csv in its own process (max_workers defaults to the CPU
+    count). progress(files_done, files_total) is called as files complete. Setting the
+    cancel event drops the files not started yet and raises ImportCancelled.
+    """
+    paths = station_files(directory)
+    merged = MergeResult(directory)
+    parsed = {}
+    if not paths:
+        return merged
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(parse_station_file, path, profile_definition): path for path in paths}
+        pending = set(futures)
+        while pending:
+            if cancel is not None and cancel.is_set():
+                for future in pending:
+                    future.cancel()
+                raise ImportCancelled()
+            done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = futures[future]
+                try:
+                    parsed[path] = future.result()
+                except Exception as e:
+                    merged.conflicts.append((CONFLICT_FAILED, "", "", os.path.basename(path), str(e)))
+            if done and progress is not None:
+                progress(len(futures) - len(pending), len(futures))
+    return reduce_results([(path, parsed[path]) for path in paths if path in parsed], merged)
+
+
+def write_merge_report(path, merged):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_HEADER)
+        writer.writerows(merged.conflicts)
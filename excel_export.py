@@ -0,0 +1,175 @@
+import os
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment
+from openpyxl.utils import get_column_letter
+
+LAYOUT_PER_BOX = "per_box"  # one sheet per box, the original layout
+LAYOUT_FLAT = "flat"        # one table of all rows plus per-SKU and per-box summary sheets
+
+LAYOUT_TITLES = {
+    LAYOUT_PER_BOX: "Лист на каждый короб",
+    LAYOUT_FLAT: "Одна таблица и сводка",
+}
+
+FLAT_HEADER = ["Штрихкод короба", "Комментарий короба", "Штрихкод товара", "Количество", "Комментарий товара"]
+SKU_HEADER = ["Штрихкод товара", "Количество", "Коробов"]
+BOX_HEADER = ["Штрихкод короба", "Комментарий короба", "Товаров", "Количество"]
+PROGRESS_EVERY = 1000
+
+CENTER = Alignment(horizontal='center')  # shared by every centered cell
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class ColumnWidths:
+    """Tracks the widest value per column while rows are produced."""
+
+    def __init__(self):
+        self.widths = {}
+
+    def track(self, row):
+        for column, value in enumerate(row, 1):
+            if value is None:
+                continue
+            length = len(str(value))
+            if length > self.widths.get(column, 0):
+                self.widths[column] = length
+
+    def apply(self, sheet, padding=2):
+        # Write-only sheets emit <cols> before the first row, so call this before appending
+        for column, width in self.widths.items():
+            sheet.column_dimensions[get_column_letter(column)].width = width + padding
+
+
+def styled_row(sheet, values, centered=()):
+    # Plain values stay plain, only the centered columns become styled cells
+    row = list(values)
+    for column in centered:
+        cell = WriteOnlyCell(sheet, value=row[column])
+        cell.alignment = CENTER
+        row[column] = cell
+    return row
+
+
+def box_sheet_rows(box_barcode, items, box_comments):
+    # (values, centered column indexes) of one per-box sheet
+    yield ["Штрихкод короба", box_barcode, "Комментарий"], (0, 1, 2)
+    yield ["Штрихкод товара", "Количество", "Комментарий"], (0, 1, 2)
+    yield ["Комментарий к коробу:", None, box_comments.get("", "")], ()
+    for item_barcode, count in items.items():
+        yield [item_barcode, count, box_comments.get(item_barcode, "")], (1,)
+
+
+def write_per_box(workbook, all_boxes, comments, progress, cancel):
+    total = sum(len(items) for items in all_boxes.values())
+    done = 0
+    for box_barcode, items in all_boxes.items():
+        if cancel is not None and cancel.is_set():
+            raise ExportCancelled()
+        # One box is buffered to know its column widths before the sheet header is written
+        rows = list(box_sheet_rows(box_barcode, items, comments.get(box_barcode, {})))
+        widths = ColumnWidths()
+        for values, _ in rows:
+            widths.track(values)
+        sheet = workbook.create_sheet(title=f"Короб {box_barcode}")
+        widths.apply(sheet)
+        for values, centered in rows:
+            sheet.append(styled_row(sheet, values, centered))
+        done += len(items)
+        if progress is not None:
+            progress(done, total)
+
+
+def write_table(workbook, title, header, rows, widths):
+    sheet = workbook.create_sheet(title=title)
+    widths.apply(sheet)
+    sheet.append(styled_row(sheet, header, range(len(header))))
+    for values in rows:
+        sheet.append(values)
+    return sheet
+
+
+def write_flat(workbook, all_boxes, comments, progress, cancel):
+    # Pass 1: column widths of the data sheet and the aggregates for the summary sheets.
+    # Nothing is kept per row, so memory grows with SKUs and boxes, not with rows.
+    total = 0
+    flat_widths = ColumnWidths()
+    flat_widths.track(FLAT_HEADER)
+    sku_units = {}
+    sku_boxes = {}
+    box_rows = []
+    for box_barcode, items in all_boxes.items():
+        box_comments = comments.get(box_barcode, {})
+        box_comment = box_comments.get("", "")
+        box_units = 0
+        for item_barcode, count in items.items():
+            flat_widths.track((box_barcode, box_comment, item_barcode, count, box_comments.get(item_barcode, "")))
+            sku_units[item_barcode] = sku_units.get(item_barcode, 0) + count
+            sku_boxes[item_barcode] = sku_boxes.get(item_barcode, 0) + 1
+            box_units += count
+        box_rows.append([box_barcode, box_comment, len(items), box_units])
+        total += len(items)
+
+    # Pass 2: stream the data sheet
+    sheet = workbook.create_sheet(title="Данные")
+    flat_widths.apply(sheet)
+    sheet.append(styled_row(sheet, FLAT_HEADER, range(len(FLAT_HEADER))))
+    done = 0
+    for box_barcode, items in all_boxes.items():
+        box_comments = comments.get(box_barcode, {})
+        box_comment = box_comments.get("", "")
+        for item_barcode, count in items.items():
+            sheet.append(styled_row(sheet, (box_barcode, box_comment, item_barcode, count,
+                                            box_comments.get(item_barcode, "")), (3,)))
+            done += 1
+            if done % PROGRESS_EVERY == 0:
+                if cancel is not None and cancel.is_set():
+                    raise ExportCancelled()
+                if progress is not None:
+                    progress(done, total)
+
+    sku_rows = [[item_barcode, units, sku_boxes[item_barcode]] for item_barcode, units in sku_units.items()]
+    widths = ColumnWidths()
+    widths.track(SKU_HEADER)
+    for values in sku_rows:
+        widths.track(values)
+    write_table(workbook, "Сводка по товарам", SKU_HEADER, sku_rows, widths)
+
+    widths = ColumnWidths()
+    widths.track(BOX_HEADER)
+    for values in box_rows:
+        widths.track(values)
+    write_table(workbook, "Итоги по коробам", BOX_HEADER, box_rows, widths)
+    if progress is not None:
+        progress(total, total)
+
+
+LAYOUTS = {
+    LAYOUT_PER_BOX: write_per_box,
+    LAYOUT_FLAT: write_flat,
+}
+
+
+def export_workbook(path, all_boxes, comments, layout=LAYOUT_PER_BOX, progress=None, cancel=None):
+    """Writes a session to an .xlsx file with a write-only (streaming) workbook.
+
+    all_boxes/comments must not change while this runs, pass a ScanSession.snapshot().
+    progress(done, total) is called as item rows are written; setting the cancel
+    event stops the export with ExportCancelled. The file is written to a temporary name
+    and renamed at the end, so a cancelled or failed export leaves no partial workbook.
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    tmp_path = path + ".tmp"
+    try:
+        LAYOUTS[layout](workbook, all_boxes, comments, progress, cancel)
+        if cancel is not None and cancel.is_set():
+            raise ExportCancelled()
+        workbook.save(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
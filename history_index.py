@@ -0,0 +1,99 @@
+import mmap
+import os
+from array import array
+
+
+def parse_history_line(line):
+    # "2025-01-31 12:00:00 - ITEM: 4600000000000" -> (timestamp, type, barcode), None if malformed
+    try:
+        timestamp_str, rest = line.split(" - ", 1)
+        barcode_type, barcode = rest.split(": ", 1)
+    except ValueError:
+        return None
+    return timestamp_str, barcode_type.strip().lower(), barcode.strip()
+
+
+class HistoryIndex:
+    """Line-offset index over a scan history log that is still being appended to.
+
+    The file is memory-mapped and only the start offset of each well-formed line is kept,
+    so opening a full-day log costs one pass over its bytes and 8 bytes per line. refresh()
+    indexes whatever complete lines were appended since the previous call; a trailing line
+    without its newline is left for the next refresh.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = array("Q")
+        self.indexed_end = 0
+        self._file = None
+        self._map = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def refresh(self):
+        # Returns the number of lines added to the index
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return 0
+        if size < self.indexed_end:
+            # Truncated or replaced, start over
+            self.close()
+            self.offsets = array("Q")
+            self.indexed_end = 0
+        if size == self.indexed_end:
+            return 0
+        if self._map is None or len(self._map) < size:
+            self._remap()
+
+        mm = self._map
+        size = len(mm)
+        find = mm.find
+        offsets = self.offsets
+        before = len(offsets)
+        pos = self.indexed_end
+        while pos < size:
+            end = find(b"\n", pos, size)
+            if end == -1:
+                break
+            separator = find(b" - ", pos, end)
+            if separator != -1 and find(b": ", separator, end) != -1:
+                offsets.append(pos)
+            pos = end + 1
+        self.indexed_end = pos
+        return len(offsets) - before
+
+    def line(self, row):
+        start = self.offsets[row]
+        end = self._map.find(b"\n", start)
+        return self._map[start:end].decode("utf-8", "replace").rstrip("\r")
+
+    def entry(self, row):
+        return parse_history_line(self.line(row))
+
+    def search(self, text, start=0):
+        # Rows from start on whose time, type or barcode contains text (case-insensitive)
+        text = text.lower()
+        matches = []
+        for row in range(start, len(self.offsets)):
+            entry = self.entry(row)
+            if entry is not None and any(text in value.lower() for value in entry):
+                matches.append(row)
+        return matches
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _remap(self):
+        if self._map is not None:
+            self._map.close()
+        if self._file is None:
+            self._file = open(self.path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
@@ -0,0 +1,70 @@
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
+
+COLUMNS = ["Время", "Тип", "Штрихкод"]
+
+
+class HistoryModel(QAbstractTableModel):
+    """Table over a HistoryIndex that parses a line only when the view asks for it.
+
+    Rows are handed to the view in batches through canFetchMore/fetchMore. With a filter
+    set, rows maps model rows to index rows; append() extends it with new matches only.
+    """
+
+    FETCH_BATCH = 1000
+
+    def __init__(self, history_index, parent=None):
+        super().__init__(parent)
+        self.history_index = history_index
+        self.filter_text = ""
+        self.rows = None
+        self.fetched = 0
+
+    def total(self):
+        return len(self.history_index) if self.rows is None else len(self.rows)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.fetched
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(COLUMNS)
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self.fetched < self.total()
+
+    def fetchMore(self, parent):
+        count = min(self.FETCH_BATCH, self.total() - self.fetched)
+        if parent.isValid() or count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self.fetched, self.fetched + count - 1)
+        self.fetched += count
+        self.endInsertRows()
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        row = index.row() if self.rows is None else self.rows[index.row()]
+        entry = self.history_index.entry(row)
+        return entry[index.column()] if entry is not None else ""
+
+    def set_filter(self, text):
+        self.beginResetModel()
+        self.filter_text = text
+        self.rows = self.history_index.search(text) if text else None
+        self.fetched = min(self.FETCH_BATCH, self.total())
+        self.endResetModel()
+
+    def append(self, first_row):
+        # Index rows from first_row on were just added by HistoryIndex.refresh()
+        was_complete = self.fetched == self.total()
+        if self.rows is not None:
+            self.rows.extend(self.history_index.search(self.filter_text, first_row))
+        if was_complete and self.fetched < self.total():
+            # The view already shows everything, so follow the tail directly
+            self.beginInsertRows(QModelIndex(), self.fetched, self.total() - 1)
+            self.fetched = self.total()
+            self.endInsertRows()
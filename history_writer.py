@@ -0,0 +1,133 @@
+import os
+import queue
+import threading
+import time
+
+FSYNC_NONE = "none"          # only hand the data to the OS
+FSYNC_INTERVAL = "interval"  # fsync once per flush interval
+FSYNC_ALWAYS = "always"      # fsync after every written batch
+
+_FLUSH = object()
+_STOP = object()
+
+
+class HistoryWriter:
+    """Appends lines to the scan history file from a dedicated thread.
+
+    The file stays open for the lifetime of the writer. write() only puts the line into
+    a bounded queue, so the caller (the UI thread) never touches the disk. When the queue
+    is full write() blocks until the writer catches up - scans are never dropped.
+    on_error is called from the writer thread once per run of failures, not per line.
+    """
+
+    def __init__(self, path, flush_interval=1.0, fsync_policy=FSYNC_INTERVAL, max_queue=10000,
+                 batch_size=500, on_error=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.fsync_policy = fsync_policy
+        self.batch_size = batch_size
+        self.on_error = on_error
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.failed = False
+        self.closed = False
+        self._file = None
+        self._dirty = False
+        self._thread = threading.Thread(target=self._run, name="HistoryWriter", daemon=True)
+        self._thread.start()
+
+    def write(self, line):
+        if self.closed:
+            raise RuntimeError("HistoryWriter is closed")
+        self.queue.put(line)
+
+    def flush(self, timeout=None):
+        # Blocks until everything queued before this call is on disk
+        done = threading.Event()
+        self.queue.put((_FLUSH, done))
+        return done.wait(timeout)
+
+    def close(self, timeout=None):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                entry = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if self._dirty:
+                    self._flush_file(fsync=self.fsync_policy != FSYNC_NONE)
+                last_flush = time.monotonic()
+                continue
+
+            # Drain whatever is already queued so a scanner burst becomes one write
+            batch = []
+            control = None
+            while True:
+                if entry is _STOP or isinstance(entry, tuple):
+                    control = entry
+                    break
+                batch.append(entry)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    entry = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._write(batch)
+            if control is not None or time.monotonic() - last_flush >= self.flush_interval:
+                self._flush_file(fsync=self.fsync_policy != FSYNC_NONE)
+                last_flush = time.monotonic()
+            if control is _STOP:
+                self._close_file()
+                return
+            if control is not None:
+                control[1].set()
+
+    def _write(self, lines):
+        try:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write("".join(lines))
+            self._dirty = True
+            if self.fsync_policy == FSYNC_ALWAYS:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._dirty = False
+            self.failed = False
+        except Exception as e:
+            self._report(e)
+
+    def _flush_file(self, fsync):
+        if self._file is None:
+            return
+        try:
+            self._file.flush()
+            if fsync:
+                os.fsync(self._file.fileno())
+            self._dirty = False
+        except Exception as e:
+            self._report(e)
+
+    def _report(self, error):
+        # Reopen on the next batch; only the first failure of a run is reported
+        self._close_file()
+        self._dirty = False
+        if not self.failed:
+            self.failed = True
+            if self.on_error is not None:
+                self.on_error(error)
+
+    def _close_file(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except Exception:
+                pass
+            self._file = None
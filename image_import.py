@@ -0,0 +1,155 @@
+import csv
+import importlib
+import os
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from csv_import import ImportCancelled
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff", ".webp")
+# Retail symbologies are tried as items first, everything else (Code 128, QR...) as a box label
+ITEM_SYMBOLOGIES = {"EAN13", "EAN8", "UPCA", "UPCE"}
+REPORT_HEADER = ["Файл", "Результат", "Короб", "Товаров", "Подробности"]
+
+STATUS_OK = "OK"
+STATUS_PARTIAL = "Частично"
+STATUS_EMPTY = "Штрихкоды не найдены"
+STATUS_FAILED = "Ошибка"
+
+
+class ImageResult:
+    """What one image contributed to the session, one row of the report."""
+
+    def __init__(self, path, error=""):
+        self.path = path
+        self.error = error
+        self.boxes = []
+        self.items = []
+        self.rejected = []  # (barcode, reason)
+        self.box = ""       # box the items went into
+
+    def status(self):
+        if self.error:
+            return STATUS_FAILED
+        if not (self.boxes or self.items or self.rejected):
+            return STATUS_EMPTY
+        return STATUS_PARTIAL if self.rejected else STATUS_OK
+
+    def report_row(self):
+        details = self.error or "; ".join(f"{barcode}: {reason}" for barcode, reason in self.rejected)
+        return [os.path.basename(self.path), self.status(), self.box, len(self.items), details]
+
+
+def image_files(directory):
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(os.path.join(directory, name))
+    )
+
+
+def decoder_error():
+    # Why images cannot be decoded (Pillow or pyzbar/zbar missing), None when they can.
+    # Both are optional, only this import needs them.
+    for module in ("PIL.Image", "pyzbar.pyzbar"):
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            return str(e)
+    return None
+
+
+def decode_image(path):
+    # Runs in a worker process. Every frame of multi-page files (TIFF scans) is decoded.
+    import pyzbar.pyzbar as pyzbar
+    from PIL import Image, ImageSequence
+    barcodes = []
+    with Image.open(path) as image:
+        for frame in ImageSequence.Iterator(image):
+            for symbol in pyzbar.decode(frame.convert("L")):
+                barcodes.append((symbol.data.decode("utf-8", "replace"), symbol.type))
+    return barcodes
+
+
+def decode_directory(directory, max_workers=None, progress=None, cancel=None):
+    """Yields (path, [(barcode, symbology)], error) for every image in directory, in file order.
+
+    Images are decoded on a process pool (max_workers defaults to the CPU count), results
+    are handed out as soon as the next file in order is done. progress(files_done, files_total)
+    follows every file; setting the cancel event drops the rest and raises ImportCancelled.
+    """
+    paths = image_files(directory)
+    if not paths:
+        return
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(decode_image, path) for path in paths]
+        try:
+            for done, (path, future) in enumerate(zip(paths, futures), 1):
+                while True:
+                    if cancel is not None and cancel.is_set():
+                        raise ImportCancelled()
+                    try:
+                        barcodes, error = future.result(timeout=0.2), ""
+                    except TimeoutError:
+                        continue
+                    except Exception as e:
+                        barcodes, error = [], str(e)
+                    break
+                yield path, barcodes, error
+                if progress is not None:
+                    progress(done, len(paths))
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def classify(barcode, symbology, validator):
+    # "box", "item" or None, using the same validation as manual scans
+    order = ("item", "box") if symbology in ITEM_SYMBOLOGIES else ("box", "item")
+    for barcode_type in order:
+        if validator.is_valid(barcode, barcode_type):
+            return barcode_type
+    return None
+
+
+def stage_image(path, barcodes, validator, error=""):
+    result = ImageResult(path, error)
+    for barcode, symbology in barcodes:
+        barcode = barcode.strip()
+        kind = classify(barcode, symbology, validator)
+        if kind == "box":
+            if barcode not in result.boxes:
+                result.boxes.append(barcode)
+        elif kind == "item":
+            result.items.append(barcode)
+        else:
+            result.rejected.append((barcode, f"Недопустимый штрихкод ({symbology})"))
+    return result
+
+
+def apply_image(session, result):
+    """Adds one staged image to the session like a scan would.
+
+    A box label on the image becomes the current box; items go into the current box,
+    so photos of the items that follow a label photo land in that box. An image with
+    several box labels changes nothing: there is no telling which box is meant, so its
+    labels and items are rejected and the current box stays as it was.
+    """
+    if len(result.boxes) == 1:
+        session.select_box(result.boxes[0])
+    elif len(result.boxes) > 1:
+        result.rejected.extend((barcode, "Несколько коробов на изображении") for barcode in result.boxes + result.items)
+        result.boxes = []
+        result.items = []
+    elif result.items and not session.current_box_barcode:
+        result.rejected.extend((item_barcode, "Нет текущего короба") for item_barcode in result.items)
+        result.items = []
+    for item_barcode in result.items:
+        session.add_item(item_barcode)
+    result.box = session.current_box_barcode
+    return result
+
+
+def write_image_report(path, results):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_HEADER)
+        writer.writerows(result.report_row() for result in results)
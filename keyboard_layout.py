@@ -0,0 +1,45 @@
+# Keys of the Russian ЙЦУКЕН layout and what the same key types on US QWERTY, lower and shifted
+RU_KEYS = "ёйцукенгшщзхъфывапролджэячсмитьбю" + "ЁЙЦУКЕНГШЩЗХЪФЫВАПРОЛДЖЭЯЧСМИТЬБЮ"
+EN_KEYS = "`qwertyuiop[]asdfghjkl;'zxcvbnm,." + '~QWERTYUIOP{}ASDFGHJKL:"ZXCVBNM<>'
+RU_TO_EN = str.maketrans(RU_KEYS, EN_KEYS)
+RU_LETTERS = frozenset(RU_KEYS)
+# Marketplace prefixes the scanners type in upper case, restored after a lower-case conversion
+CANONICAL_PREFIXES = ("WB_", "OZN")
+# Earlier versions read "ца" (not the key-for-key "wf") as "wb", kept for labels printed that way
+PREFIX_ALIASES = {"ца": "wb"}
+
+
+def is_russian_layout(text):
+    # A barcode never holds Cyrillic, any of it means the scanner typed on the Russian layout
+    return not text.isascii() and any(char in RU_LETTERS for char in text)
+
+
+def fix_prefix(original, converted):
+    alias = PREFIX_ALIASES.get(original[:2].lower())
+    if alias is not None:
+        converted = alias + converted[2:]
+    upper = converted[:3].upper()
+    if upper in CANONICAL_PREFIXES:
+        return upper + converted[3:]
+    return converted
+
+
+def normalize(text):
+    """The barcode as the scanner meant it: ЙЦУКЕН letters are mapped back to the QWERTY
+    keys in one translate() call. Text without Cyrillic is returned unchanged."""
+    if not is_russian_layout(text):
+        return text
+    return fix_prefix(text, text.translate(RU_TO_EN))
+
+
+def normalize_many(texts):
+    """normalize() for a whole column: one isascii() check and one translate() over the
+    joined strings instead of a call per value. Returns a list in input order."""
+    texts = list(texts)
+    joined = "\n".join(texts)
+    if joined.isascii():
+        return texts
+    converted = joined.translate(RU_TO_EN).split("\n")
+    if len(converted) != len(texts):  # a value with a line break of its own
+        return [normalize(text) for text in texts]
+    return [fix_prefix(old, new) if is_russian_layout(old) else old for old, new in zip(texts, converted)]
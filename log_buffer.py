@@ -0,0 +1,54 @@
+import logging
+import os
+from collections import deque
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
+
+
+class RingBufferHandler(logging.Handler):
+    """Keeps the last `capacity` log records in memory for the Debug Console.
+
+    emit() only stores the record, formatting happens in since(), i.e. on the UI thread
+    and only while somebody is looking at the console.
+    """
+
+    def __init__(self, capacity=5000):
+        super().__init__()
+        self.records = deque(maxlen=capacity)
+        self.seq = 0
+
+    def emit(self, record):
+        # Called with self.lock held by Handler.handle()
+        self.seq += 1
+        self.records.append((self.seq, record))
+
+    def since(self, seq, limit=None):
+        # (last seq, formatted lines of the records newer than seq), at most limit newest lines
+        self.acquire()
+        try:
+            last = self.seq
+            newer = []
+            for record_seq, record in reversed(self.records):
+                if record_seq <= seq or (limit is not None and len(newer) >= limit):
+                    break
+                newer.append(record)
+        finally:
+            self.release()
+        newer.reverse()
+        return last, [self.format(record) for record in newer]
+
+
+def setup_logging(level=None, capacity=5000):
+    # Root logger with stderr output and the ring buffer, level from SCANBOX_LOG_LEVEL (INFO)
+    level = level or os.environ.get("SCANBOX_LOG_LEVEL", "INFO")
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    formatter = logging.Formatter(LOG_FORMAT)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+    root.addHandler(stream_handler)
+    ring_handler = RingBufferHandler(capacity)
+    ring_handler.setFormatter(formatter)
+    root.addHandler(ring_handler)
+    return ring_handler
@@ -0,0 +1,129 @@
+import json
+import time
+from bisect import bisect_left
+from collections import deque
+
+# Bucket upper bounds in seconds: 50 us growing by sqrt(2) up to ~13 s, plus an overflow bucket
+BUCKET_BOUNDS = [0.00005 * 2 ** (i / 2) for i in range(37)]
+STAGES = ("queue", "validation", "mutation", "state_save", "tree_update", "history", "highlight", "total")
+THROUGHPUT_WINDOW = 60.0
+
+
+class RollingHistogram:
+    """Latency histogram over the last `window` samples.
+
+    Samples are kept only as bucket indexes, so adding one and dropping the oldest
+    are O(1); percentiles walk the ~40 buckets and return a bucket's upper bound.
+    """
+
+    def __init__(self, window=5000):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.samples = deque(maxlen=window)
+        self.total = 0
+        self.max = 0.0
+
+    def add(self, seconds):
+        if len(self.samples) == self.samples.maxlen:
+            self.counts[self.samples[0]] -= 1
+        bucket = bisect_left(BUCKET_BOUNDS, seconds)
+        self.samples.append(bucket)
+        self.counts[bucket] += 1
+        self.total += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        if not self.samples:
+            return 0.0
+        rank = fraction * len(self.samples)
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return BUCKET_BOUNDS[bucket] if bucket < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.total,
+            "window": len(self.samples),
+            "p50_ms": self.percentile(0.5) * 1000,
+            "p95_ms": self.percentile(0.95) * 1000,
+            "p99_ms": self.percentile(0.99) * 1000,
+            "max_ms": self.max * 1000,
+            "buckets_ms": [round(bound * 1000, 3) for bound in BUCKET_BOUNDS],
+            "counts": list(self.counts),
+        }
+
+
+class ScanTimer:
+    """Times the stages of one scan. lap() closes the stage that just ran; time spent in
+    nested stages (reported through nest()) is taken out of the enclosing lap."""
+
+    def __init__(self, metrics, started):
+        self.metrics = metrics
+        self.started = started
+        self.last = started
+        self.nested = 0.0
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.metrics.add(stage, now - self.last - self.nested)
+        self.last = now
+        self.nested = 0.0
+
+    def nest(self, stage, seconds):
+        self.metrics.add(stage, seconds)
+        self.nested += seconds
+
+    def finish(self, accepted=True):
+        # Returns the total time of the scan
+        total = time.perf_counter() - self.started
+        self.metrics.add("total", total)
+        if accepted:
+            self.metrics.scan_done()
+        return total
+
+
+class ScanMetrics:
+    """Per-stage rolling histograms plus accepted scans per minute, independent of any GUI."""
+
+    def __init__(self, window=5000):
+        self.histograms = {stage: RollingHistogram(window) for stage in STAGES}
+        self.done_times = deque()
+        self.accepted = 0
+        self.started_at = time.time()
+
+    def start(self, started=None):
+        return ScanTimer(self, started if started is not None else time.perf_counter())
+
+    def add(self, stage, seconds):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = RollingHistogram(self.histograms["total"].samples.maxlen)
+        histogram.add(seconds)
+
+    def scan_done(self):
+        self.accepted += 1
+        self.done_times.append(time.monotonic())
+
+    def scans_per_minute(self):
+        cutoff = time.monotonic() - THROUGHPUT_WINDOW
+        while self.done_times and self.done_times[0] < cutoff:
+            self.done_times.popleft()
+        return len(self.done_times) * 60.0 / THROUGHPUT_WINDOW
+
+    def p95_ms(self):
+        return self.histograms["total"].percentile(0.95) * 1000
+
+    def snapshot(self):
+        return {
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_at)),
+            "accepted_scans": self.accepted,
+            "scans_per_minute": self.scans_per_minute(),
+            "stages": {stage: histogram.summary() for stage, histogram in self.histograms.items()},
+        }
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
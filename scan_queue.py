@@ -0,0 +1,88 @@
+import time
+from collections import deque
+
+# A hand scanner types a whole barcode within a few ms per key, people are far slower
+BURST_MAX_GAP = 0.05
+BURST_MIN_LENGTH = 4
+# Scanner bounce: the same code read twice within a few hundred ms, 0 turns suppression off
+DOUBLE_SCAN_WINDOW_MS = 300
+
+
+class BurstDetector:
+    """Tells keyboard-wedge scanner bursts apart from typing, key by key.
+
+    feed() every printable character, end() on Enter: end() returns the scanned text
+    when the characters since the last pause arrived at scanner speed, else None.
+    """
+
+    def __init__(self, max_gap=BURST_MAX_GAP, min_length=BURST_MIN_LENGTH, clock=time.monotonic):
+        self.max_gap = max_gap
+        self.min_length = min_length
+        self.clock = clock
+        self.buffer = []
+        self.last_key = 0.0
+
+    def feed(self, char):
+        now = self.clock()
+        if now - self.last_key > self.max_gap:
+            self.buffer = []
+        self.buffer.append(char)
+        self.last_key = now
+
+    def end(self):
+        text = "".join(self.buffer)
+        fast = self.clock() - self.last_key <= self.max_gap
+        self.buffer = []
+        if fast and len(text) >= self.min_length:
+            return text
+        return None
+
+
+class DoubleScanFilter:
+    """Spots an item barcode read again within window_ms of the previous read.
+
+    Only the previous read is compared, so A, B, A is always kept. The time of a
+    suppressed read still counts, a bouncing trigger keeps being suppressed.
+    Box reads are never suppressed (opening the same box again is harmless and
+    deliberate) and start the comparison over. Times are the enqueue times, a
+    backlog in the queue does not hide bounce.
+    """
+
+    def __init__(self, window_ms=DOUBLE_SCAN_WINDOW_MS):
+        self.window_ms = window_ms
+        self.last_text = None
+        self.last_time = 0.0
+
+    def is_repeat(self, text, at, kind="item"):
+        if kind != "item":
+            self.last_text = None
+            return False
+        repeat = text == self.last_text and (at - self.last_time) * 1000 < self.window_ms
+        self.last_text = text
+        self.last_time = at
+        return repeat
+
+
+class ScanQueue:
+    """FIFO of raw scans waiting to be processed, with its deepest backlog.
+
+    Entries are (text, kind, enqueued_at); kind is "box", "item" or None when the
+    scan did not come through a scan entry and the current mode decides. Waiting and
+    processing times are measured by ScanMetrics from enqueued_at.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.pending = deque()
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def push(self, text, kind=None):
+        self.pending.append((text, kind, self.clock()))
+        if len(self.pending) > self.max_depth:
+            self.max_depth = len(self.pending)
+
+    def pop(self):
+        return self.pending.popleft()
@@ -0,0 +1,350 @@
+import time
+
+from compact_boxes import CompactBoxes
+from state_journal import StateJournal
+
+# Change events, listeners are called as listener(event, *args)
+RESET = "reset"                      # ()  - everything changed, rebuild the view
+BOX_ADDED = "box_added"              # (box,)
+BOX_REMOVED = "box_removed"          # (box, items) - items that were still in it
+BOX_RENAMED = "box_renamed"          # (old_box, new_box)
+ITEM_CHANGED = "item_changed"        # (box, item) - item added or its count changed
+ITEM_REMOVED = "item_removed"        # (box, item)
+ITEM_RENAMED = "item_renamed"        # (box, old_item, new_item)
+COMMENT_CHANGED = "comment_changed"  # (box, item) - item is "" for the box comment
+CURRENT_BOX_CHANGED = "current_box_changed"  # (box,) - "" when no box is selected
+PERSIST_ERROR = "persist_error"      # (message,)
+
+
+class SessionError(Exception):
+    pass
+
+
+class ScanSession:
+    """Boxes, items and comments of one packing session, independent of any GUI.
+
+    All mutations go through the methods below, which keep the journal up to date and
+    notify subscribers, so front-ends only translate events into widget updates.
+    Without a state_file the session lives only in memory (benchmarks, imports).
+    store replaces the default JSON StateJournal, e.g. with a SqliteStore. compact keeps
+    all_boxes as CompactBoxes (array-backed, interned barcodes) for long shifts.
+    """
+
+    def __init__(self, state_file=None, snapshot_every=1000, store=None, compact=False):
+        self.compact = compact
+        self.all_boxes = self.new_boxes()
+        self.comments = {}  # box -> {item: text}, item "" holds the box comment
+        self.current_box_barcode = ""
+        self.search_query = ""
+        self.settings = {}
+        if store is not None:
+            self.journal = store
+        else:
+            self.journal = StateJournal(state_file, snapshot_every) if state_file else None
+        # Set by bulk changes that bypass the journal and need a full snapshot
+        self._unjournaled = False
+        self._listeners = []
+        self.persist_time = 0.0  # seconds spent writing the journal, for scan latency metrics
+        # Running counters, kept up to date by every mutation instead of summing on refresh
+        self.total_units = 0
+        self.box_totals = {}
+        self.item_boxes = {}  # item -> {box: count}, the reverse index behind "where is this item?"
+
+    def new_boxes(self, all_boxes=None):
+        if self.compact:
+            return CompactBoxes(all_boxes)
+        return all_boxes if all_boxes is not None else {}
+
+    # --- events ---
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def emit(self, event, *args):
+        for listener in list(self._listeners):
+            listener(event, *args)
+
+    # --- persistence ---
+
+    def load(self):
+        if self.journal is None:
+            return
+        state = self.journal.load()
+        self.all_boxes = self.new_boxes(state["all_boxes"])
+        self.comments = state["comments"]
+        self.current_box_barcode = state["current_box_barcode"]
+        self.search_query = state["search_query"]
+        self.settings = state["settings"]
+        self.recount()
+        self.emit(RESET)
+
+    def save(self):
+        # Compacts the journal into a fresh snapshot. Incremental stores already hold
+        # every journaled change, they only need the small fields unless a bulk change happened.
+        if self.journal is None:
+            return
+        state = {
+            "all_boxes": self.all_boxes,
+            "current_box_barcode": self.current_box_barcode,
+            "search_query": self.search_query,
+            "comments": self.comments,
+            "settings": self.settings,
+        }
+        if self.journal.incremental and not self._unjournaled:
+            self.journal.write_meta(state)
+        else:
+            self.journal.write_snapshot(state)
+        self._unjournaled = False
+
+    def close(self):
+        if self.journal is not None:
+            self.save()
+            self.journal.close()
+
+    def record(self, op, **fields):
+        if self.journal is None:
+            return
+        started = time.perf_counter()
+        try:
+            self.journal.append(op, **fields)
+            if self.journal.needs_snapshot():
+                self.save()
+        except Exception as e:
+            self.emit(PERSIST_ERROR, str(e))
+        self.persist_time += time.perf_counter() - started
+
+    # --- queries ---
+
+    def has_box(self, box_barcode):
+        return box_barcode in self.all_boxes
+
+    def get_count(self, box_barcode, item_barcode):
+        return self.all_boxes.get(box_barcode, {}).get(item_barcode, 0)
+
+    def get_comment(self, box_barcode, item_barcode=""):
+        return self.comments.get(box_barcode, {}).get(item_barcode, "")
+
+    def pop_comment(self, box_barcode, item_barcode):
+        # Removes one comment and the box entry once it has none left, True if there was one
+        box_comments = self.comments.get(box_barcode)
+        if box_comments is None or item_barcode not in box_comments:
+            return False
+        del box_comments[item_barcode]
+        if not box_comments:
+            del self.comments[box_barcode]
+        return True
+
+    def summary(self):
+        # (boxes, units, distinct SKUs) in O(1)
+        return len(self.all_boxes), self.total_units, len(self.item_boxes)
+
+    def box_total(self, box_barcode):
+        return self.box_totals.get(box_barcode, 0)
+
+    def boxes_with_item(self, item_barcode):
+        # {box: count} in O(1), callers must not modify it
+        return self.item_boxes.get(item_barcode, {})
+
+    def duplicates(self):
+        # [(item, {box: count})] for items packed into more than one box, most spread first
+        spread = [(item_barcode, boxes) for item_barcode, boxes in self.item_boxes.items() if len(boxes) > 1]
+        spread.sort(key=lambda entry: len(entry[1]), reverse=True)
+        return spread
+
+    def recount(self):
+        # Full pass, only for load/replace
+        self.total_units = 0
+        self.box_totals = {}
+        self.item_boxes = {}
+        for box_barcode, items in self.all_boxes.items():
+            box_total = 0
+            for item_barcode, count in items.items():
+                box_total += count
+                boxes = self.item_boxes.get(item_barcode)
+                if boxes is None:
+                    self.item_boxes[item_barcode] = boxes = {}
+                boxes[box_barcode] = count
+            self.box_totals[box_barcode] = box_total
+            self.total_units += box_total
+
+    def count_changed(self, box_barcode, item_barcode, old_count, new_count):
+        self.total_units += new_count - old_count
+        self.box_totals[box_barcode] = self.box_totals.get(box_barcode, 0) + new_count - old_count
+        boxes = self.item_boxes.get(item_barcode)
+        if new_count > 0:
+            if boxes is None:
+                self.item_boxes[item_barcode] = boxes = {}
+            boxes[box_barcode] = new_count
+        elif boxes is not None:
+            boxes.pop(box_barcode, None)
+            if not boxes:
+                del self.item_boxes[item_barcode]
+
+    def box_removed(self, box_barcode):
+        self.box_totals.pop(box_barcode, None)
+
+    # --- mutations ---
+
+    def select_box(self, box_barcode):
+        created = box_barcode not in self.all_boxes
+        if created:
+            self.all_boxes[box_barcode] = {}
+            self.box_totals[box_barcode] = 0
+            self.record("box", box=box_barcode)
+            self.emit(BOX_ADDED, box_barcode)
+        self.set_current_box(box_barcode)
+        return created
+
+    def set_current_box(self, box_barcode):
+        self.current_box_barcode = box_barcode
+        self.record("current", box=box_barcode)
+        self.emit(CURRENT_BOX_CHANGED, box_barcode)
+
+    def add_item(self, item_barcode, box_barcode=None):
+        box_barcode = box_barcode if box_barcode is not None else self.current_box_barcode
+        if box_barcode not in self.all_boxes:
+            raise SessionError("Текущий короб не найден!")
+        items = self.all_boxes[box_barcode]
+        old_count = items.get(item_barcode, 0)
+        items[item_barcode] = old_count + 1
+        self.count_changed(box_barcode, item_barcode, old_count, old_count + 1)
+        self.record("inc", box=box_barcode, item=item_barcode)
+        self.emit(ITEM_CHANGED, box_barcode, item_barcode)
+        return items[item_barcode]
+
+    def set_item_count(self, box_barcode, item_barcode, count):
+        # A count of 0 removes the item, and the box once it is empty
+        if box_barcode not in self.all_boxes:
+            return
+        old_count = self.all_boxes[box_barcode].get(item_barcode, 0)
+        if count > 0:
+            self.all_boxes[box_barcode][item_barcode] = count
+            self.count_changed(box_barcode, item_barcode, old_count, count)
+            self.record("count", box=box_barcode, item=item_barcode, count=count)
+            self.emit(ITEM_CHANGED, box_barcode, item_barcode)
+        elif item_barcode in self.all_boxes[box_barcode]:
+            del self.all_boxes[box_barcode][item_barcode]
+            self.count_changed(box_barcode, item_barcode, old_count, 0)
+            self.record("count", box=box_barcode, item=item_barcode, count=0)
+            self.emit(ITEM_REMOVED, box_barcode, item_barcode)
+            if not self.all_boxes[box_barcode]:
+                del self.all_boxes[box_barcode]
+                self.box_removed(box_barcode)
+                self.emit(BOX_REMOVED, box_barcode, [])
+
+    def rename_box(self, old_barcode, new_barcode):
+        if new_barcode in self.all_boxes:
+            raise SessionError("Короб с таким штрихкодом уже существует!")
+        self.all_boxes[new_barcode] = self.all_boxes.pop(old_barcode)
+        self.box_totals[new_barcode] = self.box_totals.pop(old_barcode, 0)
+        for item_barcode, count in self.all_boxes[new_barcode].items():
+            boxes = self.item_boxes[item_barcode]
+            del boxes[old_barcode]
+            boxes[new_barcode] = count
+        if old_barcode in self.comments:
+            self.comments[new_barcode] = self.comments.pop(old_barcode)
+        self.record("rename_box", box=old_barcode, new=new_barcode)
+        self.emit(BOX_RENAMED, old_barcode, new_barcode)
+        if self.current_box_barcode == old_barcode:
+            self.set_current_box(new_barcode)
+
+    def rename_item(self, box_barcode, old_barcode, new_barcode):
+        if new_barcode in self.all_boxes[box_barcode]:
+            raise SessionError("Товар с таким штрихкодом уже есть в этом коробе!")
+        count = self.all_boxes[box_barcode].pop(old_barcode)
+        self.all_boxes[box_barcode][new_barcode] = count
+        self.count_changed(box_barcode, old_barcode, count, 0)
+        self.count_changed(box_barcode, new_barcode, 0, count)
+        box_comments = self.comments.get(box_barcode)
+        if box_comments is not None and old_barcode in box_comments:
+            box_comments[new_barcode] = box_comments.pop(old_barcode)
+        self.record("rename_item", box=box_barcode, item=old_barcode, new=new_barcode)
+        self.emit(ITEM_RENAMED, box_barcode, old_barcode, new_barcode)
+
+    def delete_box(self, box_barcode):
+        items = self.all_boxes.pop(box_barcode)
+        for item_barcode, count in items.items():
+            self.count_changed(box_barcode, item_barcode, count, 0)
+        self.box_removed(box_barcode)
+        self.comments.pop(box_barcode, None)
+        self.record("del_box", box=box_barcode)
+        self.emit(BOX_REMOVED, box_barcode, list(items))
+        if self.current_box_barcode == box_barcode:
+            self.set_current_box("")
+
+    def delete_item(self, box_barcode, item_barcode):
+        self.count_changed(box_barcode, item_barcode, self.all_boxes[box_barcode].pop(item_barcode), 0)
+        self.record("del_item", box=box_barcode, item=item_barcode)
+        self.emit(ITEM_REMOVED, box_barcode, item_barcode)
+        if self.pop_comment(box_barcode, item_barcode):
+            self.record("comment", box=box_barcode, item=item_barcode, text=None)
+        if not self.all_boxes[box_barcode]:
+            del self.all_boxes[box_barcode]
+            self.box_removed(box_barcode)
+            self.emit(BOX_REMOVED, box_barcode, [])
+        if self.pop_comment(box_barcode, ""):
+            self.record("comment", box=box_barcode, item="", text=None)
+            self.emit(COMMENT_CHANGED, box_barcode, "")
+        if self.current_box_barcode == box_barcode:
+            self.set_current_box("")
+
+    def set_comment(self, box_barcode, item_barcode, text):
+        self.comments.setdefault(box_barcode, {})[item_barcode] = text
+        self.record("comment", box=box_barcode, item=item_barcode, text=text)
+        self.emit(COMMENT_CHANGED, box_barcode, item_barcode)
+
+    def set_setting(self, name, value):
+        self.settings[name] = value
+        self.record("settings", settings={name: value})
+
+    def reset(self):
+        self.all_boxes = self.new_boxes()
+        self.comments = {}
+        self.current_box_barcode = ""
+        self.search_query = ""
+        self.recount()
+        self._unjournaled = True
+        self.emit(RESET)
+        self.save()
+
+    # --- import/export hooks ---
+
+    def replace(self, all_boxes, comments):
+        # Swaps in a whole new data set (CSV import), persisted as a fresh snapshot
+        self.all_boxes = self.new_boxes(all_boxes)
+        self.comments = comments
+        self.current_box_barcode = ""
+        self.recount()
+        self._unjournaled = True
+        self.emit(RESET)
+        self.save()
+
+    def merge(self, all_boxes, comments):
+        # Adds imported counts to the current data; imported comments win over existing ones
+        for box_barcode, items in all_boxes.items():
+            target = self.all_boxes.setdefault(box_barcode, {})
+            for item_barcode, count in items.items():
+                target[item_barcode] = target.get(item_barcode, 0) + count
+        for box_barcode, box_comments in comments.items():
+            self.comments.setdefault(box_barcode, {}).update(box_comments)
+        self.recount()
+        self._unjournaled = True
+        self.emit(RESET)
+        self.save()
+
+    def snapshot(self):
+        # Copies for background readers (exports), the live dicts keep changing while they run
+        return ({box_barcode: dict(items.items()) for box_barcode, items in self.all_boxes.items()},
+                {box_barcode: dict(box_comments) for box_barcode, box_comments in self.comments.items()})
+
+    def iter_rows(self):
+        # (box, box comment, item, count, item comment) - the CSV export layout
+        for box_barcode, items in self.all_boxes.items():
+            box_comments = self.comments.get(box_barcode, {})
+            box_comment = box_comments.get("", "")
+            for item_barcode, count in items.items():
+                yield box_barcode, box_comment, item_barcode, count, box_comments.get(item_barcode, "")
@@ -0,0 +1,72 @@
+class SubstringIndex:
+    """Trigram index for substring search over the rows of the item list.
+
+    Each key (box, item) is indexed by the lowercased text of both barcodes. Queries of
+    three or more characters only verify rows that contain every trigram of the query;
+    shorter ones scan the precomputed lowercase texts. When a query extends the previous
+    one, only the previous result set is re-checked.
+    """
+
+    SEPARATOR = "\x00"
+
+    def __init__(self, n=3):
+        self.n = n
+        self.texts = {}
+        self.postings = {}
+        self._last_query = None
+        self._last_result = None
+
+    def __len__(self):
+        return len(self.texts)
+
+    def ngrams(self, text):
+        n = self.n
+        return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+    def add(self, key, *parts):
+        if key in self.texts:
+            self.remove(key)
+        text = self.SEPARATOR.join(part.lower() for part in parts)
+        self.texts[key] = text
+        for gram in self.ngrams(text):
+            bucket = self.postings.get(gram)
+            if bucket is None:
+                self.postings[gram] = bucket = set()
+            bucket.add(key)
+        if self._last_result is not None and self._last_query in text:
+            self._last_result.add(key)
+
+    def remove(self, key):
+        text = self.texts.pop(key, None)
+        if text is None:
+            return
+        for gram in self.ngrams(text):
+            bucket = self.postings.get(gram)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self.postings[gram]
+        if self._last_result is not None:
+            self._last_result.discard(key)
+
+    def clear(self):
+        self.texts = {}
+        self.postings = {}
+        self._last_query = None
+        self._last_result = None
+
+    def search(self, query):
+        # Set of keys whose text contains query (case-insensitive); callers must not modify it
+        query = query.lower()
+        texts = self.texts
+        if self._last_result is not None and self._last_query in query:
+            candidates = self._last_result
+        elif len(query) >= self.n:
+            buckets = sorted((self.postings.get(gram, ()) for gram in self.ngrams(query)), key=len)
+            candidates = buckets[0] if buckets else ()
+        else:
+            candidates = texts
+        result = {key for key in candidates if query in texts[key]}
+        self._last_query = query
+        self._last_result = result
+        return result
@@ -0,0 +1,195 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+SESSION_SCHEMA = """
+CREATE TABLE items (box TEXT NOT NULL, item TEXT NOT NULL, count INTEGER NOT NULL);
+CREATE TABLE comments (box TEXT NOT NULL, item TEXT NOT NULL, text TEXT NOT NULL);
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+# Built after the bulk insert, cheaper than maintaining them row by row
+SESSION_INDEXES = """
+CREATE INDEX items_item ON items (item);
+CREATE INDEX items_box ON items (box);
+"""
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    file TEXT PRIMARY KEY,
+    sealed_at TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    boxes INTEGER NOT NULL,
+    units INTEGER NOT NULL,
+    skus INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_sealed_at ON sessions (sealed_at);
+"""
+
+
+@contextmanager
+def connect(path):
+    # Commits on success and always closes, unlike using the connection itself as context manager
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+class SessionArchive:
+    """Directory of sealed sessions, one read-only SQLite file per session.
+
+    catalog.sqlite lists the sealed files with their time and totals. Queries first pick
+    the sessions of the requested period from the catalog, then run an indexed query in
+    each of those files, so memory does not grow with the number of archived sessions.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.catalog_file = os.path.join(directory, "catalog.sqlite")
+        with connect(self.catalog_file) as conn:
+            conn.executescript(CATALOG_SCHEMA)
+
+    def seal(self, all_boxes, comments, reason="reset", sealed_at=None, meta=None):
+        # Writes the session to a new archive file and registers it, returns the file path.
+        # meta: extra JSON-serialisable entries for the meta table (scan statistics)
+        sealed_at = sealed_at or datetime.now()
+        name = f"session_{sealed_at.strftime('%Y%m%d_%H%M%S_%f')}.sqlite"
+        path = os.path.join(self.directory, name)
+        tmp_path = path + ".tmp"
+        units = 0
+        skus = set()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.executescript(SESSION_SCHEMA)
+            rows = [(box, item, count) for box, items in all_boxes.items() for item, count in items.items()]
+            for _, item, count in rows:
+                units += count
+                skus.add(item)
+            conn.executemany("INSERT INTO items VALUES (?, ?, ?)", rows)
+            conn.executemany("INSERT INTO comments VALUES (?, ?, ?)",
+                             ((box, item, text) for box, box_comments in comments.items()
+                              for item, text in box_comments.items() if text))
+            conn.executemany("INSERT INTO meta VALUES (?, ?)",
+                             (("sealed_at", sealed_at.strftime(TIME_FORMAT)), ("reason", reason)))
+            conn.executemany("INSERT INTO meta VALUES (?, ?)",
+                             ((key, json.dumps(value, ensure_ascii=False)) for key, value in (meta or {}).items()))
+            conn.executescript(SESSION_INDEXES)
+            conn.commit()
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+        os.replace(tmp_path, path)
+        with connect(self.catalog_file) as catalog:
+            catalog.execute("INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?)",
+                            (name, sealed_at.strftime(TIME_FORMAT), reason, len(all_boxes), units, len(skus)))
+        return path
+
+    def sessions(self, since=None, until=None):
+        # Catalog rows (file, sealed_at, reason, boxes, units, skus) sealed in [since, until)
+        query = "SELECT file, sealed_at, reason, boxes, units, skus FROM sessions WHERE sealed_at >= ? AND sealed_at < ? ORDER BY sealed_at"
+        with connect(self.catalog_file) as conn:
+            return conn.execute(query, (_bound(since, "0000"), _bound(until, "9999"))).fetchall()
+
+    def _query(self, since, until, sql, params):
+        # (file, sealed_at, row) for every row sql returns in each session of the period
+        for file, sealed_at, *_ in self.sessions(since, until):
+            path = os.path.join(self.directory, file)
+            if not os.path.exists(path):
+                continue
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                for row in conn.execute(sql, params):
+                    yield file, sealed_at, row
+            finally:
+                conn.close()
+
+    def boxes_with_item(self, item_barcode, since=None, until=None):
+        # (sealed_at, box, count) of every archived box that contained item_barcode
+        for _, sealed_at, (box, count) in self._query(since, until, "SELECT box, count FROM items WHERE item = ?", (item_barcode,)):
+            yield sealed_at, box, count
+
+    def units_of_item(self, item_barcode, since=None, until=None):
+        sql = "SELECT COALESCE(SUM(count), 0) FROM items WHERE item = ?"
+        return sum(row[0] for _, _, row in self._query(since, until, sql, (item_barcode,)))
+
+    def box_contents(self, box_barcode, since=None, until=None):
+        # (sealed_at, item, count) of a box in every archived session it appears in
+        for _, sealed_at, (item, count) in self._query(since, until, "SELECT item, count FROM items WHERE box = ?", (box_barcode,)):
+            yield sealed_at, item, count
+
+    def prune(self, keep_days):
+        # Rotation: drops sessions sealed more than keep_days ago, returns how many
+        cutoff = (datetime.now() - timedelta(days=keep_days)).strftime(TIME_FORMAT)
+        with connect(self.catalog_file) as conn:
+            old = [row[0] for row in conn.execute("SELECT file FROM sessions WHERE sealed_at < ?", (cutoff,))]
+            for file in old:
+                path = os.path.join(self.directory, file)
+                if os.path.exists(path):
+                    os.remove(path)
+                conn.execute("DELETE FROM sessions WHERE file = ?", (file,))
+        return len(old)
+
+
+def _bound(value, default):
+    if value is None:
+        return default
+    if isinstance(value, datetime):
+        return value.strftime(TIME_FORMAT)
+    return value
+
+
+def parse_period(args):
+    # --days N or --since/--until as YYYY-MM-DD (until is exclusive)
+    since = until = None
+    if args.days:
+        since = datetime.now() - timedelta(days=args.days)
+    if args.since:
+        since = datetime.strptime(args.since, "%Y-%m-%d")
+    if args.until:
+        until = datetime.strptime(args.until, "%Y-%m-%d")
+    return since, until
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Запросы к архиву сессий ScanBox")
+    parser.add_argument("--archive", default=os.path.join(os.path.expanduser("~"), ".ScanBox", "archive"))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("sessions", "список сессий"), ("boxes", "короба, в которых был товар"),
+                            ("units", "сколько единиц товара отгружено"), ("box", "содержимое короба")):
+        sub = subparsers.add_parser(name, help=help_text)
+        if name != "sessions":
+            sub.add_argument("barcode")
+        sub.add_argument("--days", type=int)
+        sub.add_argument("--since")
+        sub.add_argument("--until")
+    args = parser.parse_args(argv)
+
+    archive = SessionArchive(args.archive)
+    since, until = parse_period(args)
+    if args.command == "sessions":
+        for file, sealed_at, reason, boxes, units, skus in archive.sessions(since, until):
+            print(f"{sealed_at}\t{reason}\tкоробов: {boxes}\tединиц: {units}\tSKU: {skus}\t{file}")
+    elif args.command == "boxes":
+        for sealed_at, box, count in archive.boxes_with_item(args.barcode, since, until):
+            print(f"{sealed_at}\t{box}\t{count}")
+    elif args.command == "units":
+        print(archive.units_of_item(args.barcode, since, until))
+    elif args.command == "box":
+        for sealed_at, item, count in archive.box_contents(args.barcode, since, until):
+            print(f"{sealed_at}\t{item}\t{count}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
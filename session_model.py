@@ -0,0 +1,350 @@
+from PyQt5.QtCore import Qt, QAbstractItemModel, QModelIndex
+from PyQt5.QtGui import QBrush, QColor
+
+COLUMNS = ["Штрихкод короба", "Штрихкод товара", "Количество", "Комментарий"]
+
+
+class BoxNode:
+    __slots__ = ("barcode", "items", "rows", "fetched")
+
+    def __init__(self, barcode, items):
+        self.barcode = barcode
+        self.items = items  # item barcodes shown under the box, in session order
+        self.rows = {item: row for row, item in enumerate(items)}
+        self.fetched = 0    # how many of them the view has been told about
+
+
+class SessionItemModel(QAbstractItemModel):
+    """Two-level box/item model that reads straight from a ScanSession.
+
+    No per-row objects are created: data() looks values up in the session when the view
+    paints a row. Boxes are handed to the view in batches through canFetchMore/fetchMore,
+    the items of a box when it is first expanded. Changes are announced with
+    rowsInserted/rowsRemoved/dataChanged for the affected rows only.
+
+    Box indexes carry no internal pointer, item indexes point to their BoxNode.
+    """
+
+    FETCH_BATCH = 500
+
+    def __init__(self, session, box_bg_color, parent=None):
+        super().__init__(parent)
+        self.session = session
+        self.box_brush = QBrush(QColor(box_bg_color))
+        self.boxes = []
+        self.box_rows = {}
+        self.fetched = 0
+        self.row_filter = None
+        # Removed nodes stay referenced: stale indexes may still point at them until the view drops them
+        self._retired = []
+
+    # --- QAbstractItemModel ---
+
+    def index(self, row, column, parent=QModelIndex()):
+        if not parent.isValid():
+            if 0 <= row < self.fetched:
+                return self.createIndex(row, column)
+        elif parent.internalPointer() is None:
+            node = self.boxes[parent.row()]
+            if 0 <= row < node.fetched:
+                return self.createIndex(row, column, node)
+        return QModelIndex()
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        node = index.internalPointer()
+        if node is None:
+            return QModelIndex()
+        return self.createIndex(self.box_rows[node.barcode], 0)
+
+    def rowCount(self, parent=QModelIndex()):
+        if not parent.isValid():
+            return self.fetched
+        if parent.internalPointer() is None:
+            return self.boxes[parent.row()].fetched
+        return 0
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(COLUMNS)
+
+    def hasChildren(self, parent=QModelIndex()):
+        if not parent.isValid():
+            return bool(self.boxes)
+        if parent.internalPointer() is None:
+            return bool(self.boxes[parent.row()].items)
+        return False
+
+    def canFetchMore(self, parent):
+        if not parent.isValid():
+            return self.fetched < len(self.boxes)
+        if parent.internalPointer() is None:
+            node = self.boxes[parent.row()]
+            return node.fetched < len(node.items)
+        return False
+
+    def fetchMore(self, parent):
+        if not parent.isValid():
+            count = min(self.FETCH_BATCH, len(self.boxes) - self.fetched)
+            if count > 0:
+                self.beginInsertRows(parent, self.fetched, self.fetched + count - 1)
+                self.fetched += count
+                self.endInsertRows()
+        elif parent.internalPointer() is None:
+            # All items of a box at once, so an expanded box is never shown half-filled
+            node = self.boxes[parent.row()]
+            count = len(node.items) - node.fetched
+            if count > 0:
+                self.beginInsertRows(parent, node.fetched, len(node.items) - 1)
+                node.fetched = len(node.items)
+                self.endInsertRows()
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal:
+            if role == Qt.DisplayRole:
+                return COLUMNS[section]
+            if role == Qt.TextAlignmentRole:
+                return Qt.AlignCenter
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        column = index.column()
+        node = index.internalPointer()
+        if node is None:
+            box_barcode = self.boxes[index.row()].barcode
+            if role == Qt.DisplayRole:
+                if column == 0:
+                    return box_barcode
+                if column == 2:
+                    return str(self.session.box_total(box_barcode))
+                if column == 3:
+                    return self.session.get_comment(box_barcode)
+                return ""
+            if role == Qt.BackgroundRole:
+                return self.box_brush
+            if role == Qt.TextAlignmentRole and column == 2:
+                return Qt.AlignCenter
+            return None
+
+        item_barcode = node.items[index.row()]
+        if role == Qt.DisplayRole:
+            if column == 1:
+                return item_barcode
+            if column == 2:
+                return str(self.session.get_count(node.barcode, item_barcode))
+            if column == 3:
+                return self.session.get_comment(node.barcode, item_barcode)
+            return ""
+        if role == Qt.TextAlignmentRole and column > 0:
+            return Qt.AlignCenter
+        return None
+
+    # --- lookups ---
+
+    def key(self, index):
+        # (box, item) of an index, item is "" for box rows
+        node = index.internalPointer()
+        if node is None:
+            return self.boxes[index.row()].barcode, ""
+        return node.barcode, node.items[index.row()]
+
+    def index_for_key(self, box_barcode, item_barcode="", column=0):
+        row = self.box_rows.get(box_barcode)
+        if row is None or row >= self.fetched:
+            return QModelIndex()
+        if not item_barcode:
+            return self.createIndex(row, column)
+        node = self.boxes[row]
+        item_row = node.rows.get(item_barcode)
+        if item_row is None or item_row >= node.fetched:
+            return QModelIndex()
+        return self.createIndex(item_row, column, node)
+
+    def reveal(self, box_barcode, item_barcode=""):
+        # index_for_key after fetching the rows up to the key; the box's index when the item is filtered out
+        row = self.box_rows.get(box_barcode)
+        if row is None:
+            return QModelIndex()
+        while self.fetched <= row:
+            self.fetchMore(QModelIndex())
+        box_index = self.createIndex(row, 0)
+        node = self.boxes[row]
+        if item_barcode not in node.rows:
+            return box_index
+        self.fetchMore(box_index)
+        return self.createIndex(node.rows[item_barcode], 0, node)
+
+    def is_visible(self, box_barcode, item_barcode):
+        return self.row_filter is None or self.row_filter(box_barcode, item_barcode)
+
+    # --- updates from the session ---
+
+    def reset(self, matches=None):
+        # matches: set of visible (box, item) keys, None shows everything
+        self.beginResetModel()
+        self._retired = []
+        self.boxes = []
+        self.box_rows = {}
+        self.fetched = 0
+        for box_barcode, items in self.session.all_boxes.items():
+            if matches is None:
+                visible = list(items)
+            else:
+                visible = [item for item in items if (box_barcode, item) in matches]
+            self.box_rows[box_barcode] = len(self.boxes)
+            self.boxes.append(BoxNode(box_barcode, visible))
+        self.endResetModel()
+
+    def set_filter(self, row_filter, matches):
+        self.row_filter = row_filter
+        self.reset(matches)
+
+    def narrow(self, row_filter, matches):
+        # For a filter that can only hide rows (a longer query): the rows that no longer match
+        # are removed, fetched batches, expansion and selection of the rest stay as they are
+        self.row_filter = row_filter
+        for node in self.boxes:
+            keep = {item for item in node.items if (node.barcode, item) in matches}
+            if len(keep) != len(node.items):
+                self.retain_items(node, keep)
+
+    def retain_items(self, node, keep):
+        # Removes the item rows of node that are not in keep, bottom-up in contiguous runs
+        parent = self.index_for_key(node.barcode)
+        row = len(node.items) - 1
+        while row >= 0:
+            if node.items[row] in keep:
+                row -= 1
+                continue
+            last = row
+            while row >= 0 and node.items[row] not in keep:
+                row -= 1
+            first = row + 1
+            shown = parent.isValid() and first < node.fetched
+            if shown:
+                shown_last = min(last, node.fetched - 1)
+                self.beginRemoveRows(parent, first, shown_last)
+            del node.items[first:last + 1]
+            if shown:
+                node.fetched -= shown_last - first + 1
+                self.endRemoveRows()
+        node.rows = {item: i for i, item in enumerate(node.items)}
+        self.box_changed(node.barcode)
+
+    def refilter(self, box_barcode, item_barcodes):
+        # After a rename: shows or hides these rows of the box as the current filter says now
+        box_row = self.box_rows.get(box_barcode)
+        if box_row is None or self.row_filter is None:
+            return
+        node = self.boxes[box_row]
+        for item_barcode in item_barcodes:
+            visible = self.row_filter(box_barcode, item_barcode)
+            if item_barcode in node.rows and not visible:
+                self.remove_item(box_barcode, item_barcode)
+            elif item_barcode not in node.rows and visible:
+                self.item_changed(box_barcode, item_barcode)
+
+    def add_box(self, box_barcode):
+        if box_barcode in self.box_rows:
+            return
+        row = len(self.boxes)
+        if self.fetched == row:
+            self.beginInsertRows(QModelIndex(), row, row)
+            self.box_rows[box_barcode] = row
+            self.boxes.append(BoxNode(box_barcode, []))
+            self.fetched += 1
+            self.endInsertRows()
+        else:
+            self.box_rows[box_barcode] = row
+            self.boxes.append(BoxNode(box_barcode, []))
+
+    def remove_box(self, box_barcode):
+        row = self.box_rows.pop(box_barcode, None)
+        if row is None:
+            return
+        shown = row < self.fetched
+        if shown:
+            self.beginRemoveRows(QModelIndex(), row, row)
+        self._retired.append(self.boxes.pop(row))
+        for i in range(row, len(self.boxes)):
+            self.box_rows[self.boxes[i].barcode] = i
+        if shown:
+            self.fetched -= 1
+            self.endRemoveRows()
+
+    def rename_box(self, old_barcode, new_barcode):
+        row = self.box_rows.pop(old_barcode, None)
+        if row is None:
+            return
+        self.box_rows[new_barcode] = row
+        self.boxes[row].barcode = new_barcode
+        self.box_changed(new_barcode)
+
+    def box_changed(self, box_barcode):
+        index = self.index_for_key(box_barcode)
+        if index.isValid():
+            self.dataChanged.emit(index, self.createIndex(index.row(), len(COLUMNS) - 1))
+
+    def item_changed(self, box_barcode, item_barcode):
+        self.add_box(box_barcode)
+        node = self.boxes[self.box_rows[box_barcode]]
+        if item_barcode in node.rows:
+            index = self.index_for_key(box_barcode, item_barcode, 2)
+            if index.isValid():
+                self.dataChanged.emit(index, index)
+        elif self.is_visible(box_barcode, item_barcode):
+            row = len(node.items)
+            if node.fetched == row and self.box_rows[box_barcode] < self.fetched:
+                self.beginInsertRows(self.index_for_key(box_barcode), row, row)
+                node.rows[item_barcode] = row
+                node.items.append(item_barcode)
+                node.fetched += 1
+                self.endInsertRows()
+            else:
+                node.rows[item_barcode] = row
+                node.items.append(item_barcode)
+        self.box_changed(box_barcode)
+
+    def remove_item(self, box_barcode, item_barcode):
+        box_row = self.box_rows.get(box_barcode)
+        if box_row is None:
+            return
+        node = self.boxes[box_row]
+        row = node.rows.pop(item_barcode, None)
+        if row is not None:
+            shown = row < node.fetched
+            if shown:
+                self.beginRemoveRows(self.index_for_key(box_barcode), row, row)
+            del node.items[row]
+            for i in range(row, len(node.items)):
+                node.rows[node.items[i]] = i
+            if shown:
+                node.fetched -= 1
+                self.endRemoveRows()
+        self.box_changed(box_barcode)
+
+    def rename_item(self, box_barcode, old_barcode, new_barcode):
+        box_row = self.box_rows.get(box_barcode)
+        if box_row is None:
+            return
+        node = self.boxes[box_row]
+        row = node.rows.pop(old_barcode, None)
+        if row is None:
+            return
+        node.items[row] = new_barcode
+        node.rows[new_barcode] = row
+        index = self.index_for_key(box_barcode, new_barcode)
+        if index.isValid():
+            self.dataChanged.emit(index, self.createIndex(row, len(COLUMNS) - 1, node))
+
+    def comment_changed(self, box_barcode, item_barcode):
+        index = self.index_for_key(box_barcode, item_barcode, 3)
+        if index.isValid():
+            self.dataChanged.emit(index, index)
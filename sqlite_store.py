@@ -0,0 +1,209 @@
+import json
+import logging
+import os
+import sqlite3
+
+from state_journal import StateJournal
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS boxes (
+    id INTEGER PRIMARY KEY,
+    box TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS items (
+    box TEXT NOT NULL,
+    item TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    UNIQUE (box, item)
+);
+CREATE INDEX IF NOT EXISTS items_item ON items (item);
+CREATE TABLE IF NOT EXISTS comments (
+    box TEXT NOT NULL,
+    item TEXT NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (box, item)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class SqliteStore:
+    """Session storage in an SQLite database (WAL mode), a drop-in for StateJournal.
+
+    Every journal op becomes one small transaction that upserts the affected rows, so
+    nothing has to be rewritten as the session grows: write_snapshot() is only needed
+    after bulk changes (import, reset). Box order follows boxes.id and item order the
+    items rowid, matching the insertion order of the in-memory dicts.
+    If the database is new and legacy_state_file (the JSON snapshot + journal) exists,
+    it is migrated on the first load() and the JSON files are renamed to *.migrated.
+    """
+
+    incremental = True
+
+    def __init__(self, db_file, legacy_state_file=None):
+        self.db_file = db_file
+        self.legacy_state_file = legacy_state_file
+        self.records_since_snapshot = 0
+        self.conn = sqlite3.connect(db_file)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    # --- StateJournal interface ---
+
+    def load(self):
+        if self.get_meta("schema_version") is None:
+            self.migrate()
+        all_boxes = {}
+        for (box,) in self.conn.execute("SELECT box FROM boxes ORDER BY id"):
+            all_boxes[box] = {}
+        for box, item, count in self.conn.execute("SELECT box, item, count FROM items ORDER BY rowid"):
+            all_boxes.setdefault(box, {})[item] = count
+        comments = {}
+        for box, item, text in self.conn.execute("SELECT box, item, text FROM comments"):
+            comments.setdefault(box, {})[item] = text
+        return {
+            "all_boxes": all_boxes,
+            "comments": comments,
+            "current_box_barcode": self.get_meta("current_box_barcode", ""),
+            "search_query": self.get_meta("search_query", ""),
+            "settings": self.get_meta("settings", {}),
+        }
+
+    def append(self, op, **fields):
+        box = fields.get("box", "")
+        item = fields.get("item", "")
+        with self.conn:
+            execute = self.conn.execute
+            if op == "box":
+                execute("INSERT OR IGNORE INTO boxes (box) VALUES (?)", (box,))
+            elif op == "inc":
+                execute("INSERT OR IGNORE INTO boxes (box) VALUES (?)", (box,))
+                execute("INSERT INTO items (box, item, count) VALUES (?, ?, 1) "
+                        "ON CONFLICT (box, item) DO UPDATE SET count = count + 1", (box, item))
+            elif op == "count" and fields["count"] > 0:
+                execute("INSERT OR IGNORE INTO boxes (box) VALUES (?)", (box,))
+                execute("INSERT INTO items (box, item, count) VALUES (?, ?, ?) "
+                        "ON CONFLICT (box, item) DO UPDATE SET count = excluded.count", (box, item, fields["count"]))
+            elif op in ("count", "del_item"):
+                # Removing the last item of a box removes the box too
+                execute("DELETE FROM items WHERE box = ? AND item = ?", (box, item))
+                execute("DELETE FROM boxes WHERE box = ? AND NOT EXISTS (SELECT 1 FROM items WHERE box = ?)", (box, box))
+            elif op == "del_box":
+                execute("DELETE FROM boxes WHERE box = ?", (box,))
+                execute("DELETE FROM items WHERE box = ?", (box,))
+                execute("DELETE FROM comments WHERE box = ?", (box,))
+            elif op == "rename_box":
+                # Re-inserted so the box moves to the end, like the dict in the session
+                execute("DELETE FROM boxes WHERE box = ?", (box,))
+                execute("INSERT INTO boxes (box) VALUES (?)", (fields["new"],))
+                execute("UPDATE items SET box = ? WHERE box = ?", (fields["new"], box))
+                execute("UPDATE comments SET box = ? WHERE box = ?", (fields["new"], box))
+            elif op == "rename_item":
+                execute("INSERT INTO items (box, item, count) SELECT box, ?, count FROM items WHERE box = ? AND item = ?",
+                        (fields["new"], box, item))
+                execute("DELETE FROM items WHERE box = ? AND item = ?", (box, item))
+                execute("UPDATE comments SET item = ? WHERE box = ? AND item = ?", (fields["new"], box, item))
+            elif op == "comment":
+                if fields.get("text") is None:
+                    execute("DELETE FROM comments WHERE box = ? AND item = ?", (box, item))
+                else:
+                    execute("INSERT INTO comments (box, item, text) VALUES (?, ?, ?) "
+                            "ON CONFLICT (box, item) DO UPDATE SET text = excluded.text", (box, item, fields["text"]))
+            elif op == "current":
+                self.set_meta("current_box_barcode", box)
+            elif op == "settings":
+                settings = self.get_meta("settings", {})
+                settings.update(fields.get("settings", {}))
+                self.set_meta("settings", settings)
+            else:
+                logger.warning("SqliteStore.append - Warning: unknown op: %s", op)
+
+    def needs_snapshot(self):
+        return False
+
+    def write_snapshot(self, state):
+        # Full rewrite in one transaction, for bulk changes only
+        with self.conn:
+            self.conn.execute("DELETE FROM boxes")
+            self.conn.execute("DELETE FROM items")
+            self.conn.execute("DELETE FROM comments")
+            self.conn.executemany("INSERT INTO boxes (box) VALUES (?)", ((box,) for box in state["all_boxes"]))
+            self.conn.executemany(
+                "INSERT INTO items (box, item, count) VALUES (?, ?, ?)",
+                ((box, item, count) for box, items in state["all_boxes"].items() for item, count in items.items()),
+            )
+            self.conn.executemany("INSERT INTO comments (box, item, text) VALUES (?, ?, ?)",
+                                  ((box, item, text) for box, box_comments in state["comments"].items()
+                                   for item, text in box_comments.items()))
+            self.write_meta(state)
+
+    def write_meta(self, state):
+        self.set_meta("current_box_barcode", state.get("current_box_barcode", ""))
+        self.set_meta("search_query", state.get("search_query", ""))
+        self.set_meta("settings", state.get("settings", {}))
+        self.set_meta("schema_version", 1)
+        self.conn.commit()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    # --- meta ---
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    def set_meta(self, key, value):
+        self.conn.execute("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                          (key, json.dumps(value, ensure_ascii=False)))
+
+    # --- indexed queries ---
+
+    def boxes_with_item(self, item_barcode):
+        # [(box, count)] of every box holding item_barcode, via the items_item index
+        return self.conn.execute("SELECT box, count FROM items WHERE item = ? ORDER BY rowid", (item_barcode,)).fetchall()
+
+    def items_in_box(self, box_barcode):
+        return self.conn.execute("SELECT item, count FROM items WHERE box = ? ORDER BY rowid", (box_barcode,)).fetchall()
+
+    def search(self, text):
+        # (box, item) pairs whose barcodes contain text
+        pattern = "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        return self.conn.execute(
+            "SELECT box, item FROM items WHERE box LIKE ? ESCAPE '\\' OR item LIKE ? ESCAPE '\\' ORDER BY rowid",
+            (pattern, pattern),
+        ).fetchall()
+
+    def iter_rows(self):
+        # The CSV export layout straight from the database, in session order
+        return self.conn.execute(
+            "SELECT i.box, COALESCE(bc.text, ''), i.item, i.count, COALESCE(ic.text, '') "
+            "FROM items i JOIN boxes b ON b.box = i.box "
+            "LEFT JOIN comments bc ON bc.box = i.box AND bc.item = '' "
+            "LEFT JOIN comments ic ON ic.box = i.box AND ic.item = i.item "
+            "ORDER BY b.id, i.rowid"
+        )
+
+    # --- migration ---
+
+    def migrate(self):
+        if not self.legacy_state_file or not (
+                os.path.exists(self.legacy_state_file) or os.path.exists(self.legacy_state_file + ".journal")):
+            self.write_meta({})
+            return
+        journal = StateJournal(self.legacy_state_file)
+        state = journal.load()
+        journal.close()
+        self.write_snapshot(state)
+        for path in (self.legacy_state_file, self.legacy_state_file + ".journal"):
+            if os.path.exists(path):
+                os.replace(path, path + ".migrated")
+        logger.info("SqliteStore.migrate - Migrated %s boxes from %s", len(state["all_boxes"]), self.legacy_state_file)
@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+
+from compact_boxes import plain_boxes
+
+logger = logging.getLogger(__name__)
+
+
+def parse_comments(data):
+    # Snapshots nest comments per box ({box: {item: text}}). Older ones used flat
+    # "box,item" keys, which are split at the first comma as before.
+    comments = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            comments[key] = dict(value)
+            continue
+        box_barcode, item_barcode = key.split(",", 1) if "," in key else (key, "")
+        comments.setdefault(box_barcode, {})[item_barcode] = value
+    return comments
+
+
+def apply_record(state, record):
+    # Replays one journal record onto a state dict as returned by StateJournal.load()
+    all_boxes = state["all_boxes"]
+    comments = state["comments"]
+    op = record.get("op")
+    box = record.get("box", "")
+    item = record.get("item", "")
+
+    if op == "box":
+        all_boxes.setdefault(box, {})
+    elif op == "inc":
+        items = all_boxes.setdefault(box, {})
+        items[item] = items.get(item, 0) + 1
+    elif op == "count" and record["count"] > 0:
+        all_boxes.setdefault(box, {})[item] = record["count"]
+    elif op in ("count", "del_item"):
+        # Same as the app: removing the last item of a box removes the box too
+        if box in all_boxes:
+            all_boxes[box].pop(item, None)
+            if not all_boxes[box]:
+                del all_boxes[box]
+    elif op == "del_box":
+        all_boxes.pop(box, None)
+        comments.pop(box, None)
+    elif op == "rename_box":
+        new_box = record["new"]
+        if box in all_boxes:
+            all_boxes[new_box] = all_boxes.pop(box)
+        if box in comments:
+            comments[new_box] = comments.pop(box)
+    elif op == "rename_item":
+        new_item = record["new"]
+        if box in all_boxes and item in all_boxes[box]:
+            all_boxes[box][new_item] = all_boxes[box].pop(item)
+        if item in comments.get(box, {}):
+            comments[box][new_item] = comments[box].pop(item)
+    elif op == "comment":
+        if record.get("text") is None:
+            if item in comments.get(box, {}):
+                del comments[box][item]
+                if not comments[box]:
+                    del comments[box]
+        else:
+            comments.setdefault(box, {})[item] = record["text"]
+    elif op == "current":
+        state["current_box_barcode"] = box
+    elif op == "settings":
+        state["settings"].update(record.get("settings", {}))
+    else:
+        logger.warning("apply_record - Warning: unknown journal op: %s", op)
+
+
+class StateJournal:
+    """Snapshot file plus an append-only journal of mutations made since that snapshot.
+
+    Every record carries a sequence number and the snapshot stores the last sequence
+    it contains, so a crash between writing the snapshot and truncating the journal
+    never applies a record twice. A torn last line left by a crash is skipped on load.
+    """
+
+    incremental = False  # the snapshot is the full state, see SqliteStore
+
+    def __init__(self, state_file, snapshot_every=1000):
+        self.state_file = state_file
+        self.journal_file = state_file + ".journal"
+        self.snapshot_every = snapshot_every
+        self.seq = 0
+        self.records_since_snapshot = 0
+        self._journal = None
+
+    def load(self):
+        state = {
+            "all_boxes": {},
+            "comments": {},
+            "current_box_barcode": "",
+            "search_query": "",
+            "settings": {},
+        }
+        snapshot_seq = 0
+        if os.path.exists(self.state_file):
+            with open(self.state_file, "r") as f:
+                data = json.load(f)
+            if 'all_boxes' in data:
+                state["all_boxes"] = {str(k): v for k, v in data['all_boxes'].items()}
+            state["comments"] = parse_comments(data.get('comments', {}))
+            for key in ("current_box_barcode", "search_query"):
+                if key in data:
+                    state[key] = data[key]
+            state["settings"] = data.get("settings", {})
+            # Older state files kept the only setting at the top level
+            if "strict_validation_enabled" in data:
+                state["settings"].setdefault("strict_validation_enabled", data["strict_validation_enabled"])
+            snapshot_seq = data.get("journal_seq", 0)
+        self.seq = snapshot_seq
+
+        self.records_since_snapshot = 0
+        if os.path.exists(self.journal_file):
+            good_end = 0
+            with open(self.journal_file, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        logger.warning("StateJournal.load - Dropping torn journal tail: %r", line)
+                        break
+                    good_end += len(line)
+                    try:
+                        record = json.loads(line.decode("utf-8"))
+                    except ValueError:
+                        logger.warning("StateJournal.load - Skipping damaged journal line: %r", line)
+                        continue
+                    if record.get("seq", 0) <= snapshot_seq:
+                        continue
+                    apply_record(state, record)
+                    self.seq = record["seq"]
+                    self.records_since_snapshot += 1
+            # Cut off a half-written last record so new appends start on a clean line
+            if good_end != os.path.getsize(self.journal_file):
+                with open(self.journal_file, "r+b") as f:
+                    f.truncate(good_end)
+        return state
+
+    def append(self, op, **fields):
+        if self._journal is None:
+            self._journal = open(self.journal_file, "a", encoding="utf-8")
+        self.seq += 1
+        record = {"seq": self.seq, "op": op}
+        record.update(fields)
+        self._journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        self.records_since_snapshot += 1
+
+    def needs_snapshot(self):
+        return self.records_since_snapshot >= self.snapshot_every
+
+    def write_snapshot(self, state):
+        data = {
+            "all_boxes": plain_boxes(state["all_boxes"]),
+            "current_box_barcode": state.get("current_box_barcode", ""),
+            "search_query": state.get("search_query", ""),
+            "comments": state["comments"],
+            "settings": state.get("settings", {}),
+            "journal_seq": self.seq,
+        }
+
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.state_file)
+
+        # Everything up to self.seq is now in the snapshot
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.journal_file, "w", encoding="utf-8")
+        self.records_since_snapshot = 0
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
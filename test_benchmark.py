@@ -0,0 +1,63 @@
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+import benchmark
+from scan_queue import DoubleScanFilter
+from scan_session import ScanSession
+
+
+def feed(session, stream, scan_filter=None):
+    for box_barcode, item_barcodes in stream:
+        session.select_box(box_barcode)
+        for item_barcode in item_barcodes:
+            if scan_filter is None or not scan_filter.is_repeat(item_barcode, 0.0):
+                session.add_item(item_barcode)
+
+
+class UnitCheckTest(unittest.TestCase):
+    def setUp(self):
+        self.items = 10000
+        self.stream = benchmark.scan_stream(self.items, 10)
+
+    def test_stream_has_back_to_back_repeats(self):
+        # The case the Tk driver has to switch double-scan suppression off for
+        self.assertTrue(any(a == b for _, item_barcodes in self.stream
+                            for a, b in zip(item_barcodes, item_barcodes[1:])))
+
+    def test_all_scans_counted(self):
+        session = ScanSession()
+        feed(session, self.stream)
+        self.assertIsNone(benchmark.unit_error(session, self.items))
+
+    def test_dropped_scans_reported(self):
+        session = ScanSession()
+        feed(session, self.stream, DoubleScanFilter())
+        self.assertIn("expected 10000", benchmark.unit_error(session, self.items))
+
+    def test_disabled_filter_keeps_repeats(self):
+        session = ScanSession()
+        feed(session, self.stream, DoubleScanFilter(window_ms=0))
+        self.assertIsNone(benchmark.unit_error(session, self.items))
+
+
+@unittest.skipUnless(importlib.util.find_spec("PyQt5"), "PyQt5 is not installed")
+class QtCaseTest(unittest.TestCase):
+    def test_small_case_reports_metrics(self):
+        # The whole case in its own process, as run_all does it: app start, scans, I/O and shutdown
+        env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+        completed = subprocess.run([sys.executable, benchmark.__file__, "case", "qt", "200", "5"],
+                                   capture_output=True, text=True, env=env, timeout=300)
+        self.assertEqual(completed.returncode, 0, completed.stderr)
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        for key in ("skipped", "error", "teardown_error"):
+            self.assertNotIn(key, result)
+        for metric in ("scan_p50_ms", "refresh_treeview_ms", "save_state_ms", "log_scan_ms", "csv_import_s"):
+            self.assertIsNotNone(result[metric], metric)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+from keyboard_layout import RU_KEYS, is_russian_layout, normalize, normalize_many
+
+# (typed, meant)
+CASES = [
+    ("WB_00012345", "WB_00012345"),      # pure ASCII is left alone, case included
+    ("wb_00012345", "wb_00012345"),
+    ("4600000000008", "4600000000008"),
+    ("", ""),
+    ("ЦИ_00012345", "WB_00012345"),      # shifted letters
+    ("ци_00012345", "WB_00012345"),      # WB_ prefix restored to upper case
+    ("Ци_00012345", "WB_00012345"),
+    ("ца12345678", "wb12345678"),        # legacy alias, not the key-for-key "wf"
+    ("ЦА_12345678", "WB_12345678"),
+    ("щят12345", "OZN12345"),
+    ("ЩЯТ12345", "OZN12345"),
+    ("ктрщ123", "rnho123"),              # whole string, not only the prefix
+    ("ЁЙЦУКЕНГШЩЗХЪ", '~QWERTYUIOP{}'),
+    ("фывапролджэ", "asdfghjkl;'"),
+    ("ячсмитьбю", "zxcvbnm,."),
+    ("wb_é", "wb_é"),                    # non-ASCII without Cyrillic is not touched
+    ("ozn№1", "ozn№1"),
+    ("ци_1\nщят2", "WB_1\nozn2"),        # a value with its own line break
+]
+
+
+class NormalizeTest(unittest.TestCase):
+    def test_table(self):
+        for typed, meant in CASES:
+            with self.subTest(typed=typed):
+                self.assertEqual(normalize(typed), meant)
+
+    def test_many_matches_single(self):
+        typed = [case[0] for case in CASES]
+        self.assertEqual(normalize_many(typed), [normalize(text) for text in typed])
+
+    def test_many_without_line_breaks(self):
+        # The joined single-translate path, not the per-value fallback
+        typed = [case[0] for case in CASES if "\n" not in case[0]]
+        self.assertEqual(normalize_many(typed), [normalize(text) for text in typed])
+
+    def test_many_ascii_only(self):
+        typed = ["WB_1", "4600000000008", "ozn1"]
+        self.assertEqual(normalize_many(typed), typed)
+        self.assertEqual(normalize_many(iter(typed)), typed)
+
+    def test_many_empty(self):
+        self.assertEqual(normalize_many([]), [])
+
+    def test_every_russian_key_maps_to_ascii(self):
+        self.assertTrue(normalize(RU_KEYS).isascii())
+        self.assertEqual(len(normalize(RU_KEYS)), len(RU_KEYS))
+
+    def test_detection(self):
+        self.assertTrue(is_russian_layout("ци_1"))
+        self.assertFalse(is_russian_layout("WB_1"))
+        self.assertFalse(is_russian_layout("wb_é"))
+
+
+if __name__ == "__main__":
+    unittest.main()
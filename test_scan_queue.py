@@ -0,0 +1,54 @@
+import unittest
+
+from keyboard_layout import normalize
+from scan_queue import DoubleScanFilter
+
+ITEM = "4600000000008"
+OTHER = "4600000000015"
+
+
+class DoubleScanFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.filter = DoubleScanFilter(window_ms=300)
+
+    def test_repeat_inside_window(self):
+        self.assertFalse(self.filter.is_repeat(ITEM, 10.0))
+        self.assertTrue(self.filter.is_repeat(ITEM, 10.299))
+
+    def test_window_boundary(self):
+        self.assertFalse(self.filter.is_repeat(ITEM, 10.0))
+        self.assertFalse(self.filter.is_repeat(ITEM, 10.3))
+
+    def test_suppressed_read_extends_window(self):
+        self.filter.is_repeat(ITEM, 10.0)
+        self.assertTrue(self.filter.is_repeat(ITEM, 10.2))
+        self.assertTrue(self.filter.is_repeat(ITEM, 10.4))
+        self.assertFalse(self.filter.is_repeat(ITEM, 10.8))
+
+    def test_different_code_resets_window(self):
+        self.filter.is_repeat(ITEM, 10.0)
+        self.assertFalse(self.filter.is_repeat(OTHER, 10.05))
+        self.assertFalse(self.filter.is_repeat(ITEM, 10.1))
+
+    def test_zero_window_keeps_everything(self):
+        self.filter.window_ms = 0
+        self.filter.is_repeat(ITEM, 10.0)
+        self.assertFalse(self.filter.is_repeat(ITEM, 10.0))
+
+    def test_box_reads_never_suppressed(self):
+        self.assertFalse(self.filter.is_repeat("WB_00000001", 10.0, "box"))
+        self.assertFalse(self.filter.is_repeat("WB_00000001", 10.05, "box"))
+
+    def test_box_read_between_items_resets_window(self):
+        self.filter.is_repeat(ITEM, 10.0)
+        self.filter.is_repeat("WB_00000001", 10.05, "box")
+        self.assertFalse(self.filter.is_repeat(ITEM, 10.1))
+
+    def test_bounce_across_layouts(self):
+        # The Qt pipeline compares normalized barcodes
+        self.filter.is_repeat(normalize("OZN123456"), 10.0)
+        self.assertTrue(self.filter.is_repeat(normalize("щят123456"), 10.1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from scan_session import ScanSession
+from sqlite_store import SqliteStore
+from test_state_journal import contents, mutate
+
+
+class SqliteStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.dir, "state.db")
+        self.state_file = os.path.join(self.dir, "state.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def reopen(self, compact=False):
+        session = ScanSession(store=SqliteStore(self.db_file, legacy_state_file=self.state_file), compact=compact)
+        session.load()
+        return session
+
+    def test_round_trip(self):
+        session = self.reopen()
+        mutate(session)
+        session.close()
+        reopened = self.reopen()
+        self.assertEqual(contents(reopened), contents(session))
+        reopened.close()
+
+    def test_round_trip_without_close(self):
+        # Every op is its own transaction, nothing waits for a snapshot
+        session = self.reopen(compact=True)
+        mutate(session)
+        session.journal.close()
+        reopened = self.reopen(compact=True)
+        self.assertEqual(contents(reopened), contents(session))
+        reopened.close()
+
+    def test_bulk_replace(self):
+        session = self.reopen()
+        mutate(session)
+        session.replace({"WB_9": {"4600000000008": 3}}, {"WB_9": {"": "импорт"}})
+        session.add_item("4600000000015", "WB_9")
+        session.close()
+        reopened = self.reopen()
+        self.assertEqual(contents(reopened), contents(session))
+        reopened.close()
+
+    def test_migration_from_json(self):
+        legacy = ScanSession(self.state_file, snapshot_every=7)
+        mutate(legacy)
+        legacy.journal.close()  # snapshot plus journal tail, both must be migrated
+
+        session = self.reopen()
+        self.assertEqual(contents(session), contents(legacy))
+        for path in (self.state_file, self.state_file + ".journal"):
+            self.assertFalse(os.path.exists(path))
+            self.assertTrue(os.path.exists(path + ".migrated"))
+        session.add_item("4600000000053")
+        session.close()
+
+        # Migrated once: the database is the state from now on
+        reopened = self.reopen()
+        self.assertEqual(contents(reopened), contents(session))
+        reopened.close()
+
+    def test_new_database_without_legacy_files(self):
+        session = self.reopen()
+        self.assertEqual(contents(session), ([], {}, "", {}))
+        session.close()
+        self.assertFalse([name for name in os.listdir(self.dir) if name.startswith("state.json")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from scan_session import ScanSession
+from state_journal import StateJournal, parse_comments
+
+
+def mutate(session):
+    # Every journal op, including barcodes with commas that flat comment keys could not hold
+    session.select_box("WB_00000001")
+    for item_barcode in ("4600000000008", "4600000000015", "4600000000008", "OZN12345"):
+        session.add_item(item_barcode)
+    session.select_box("WB_00000002")
+    session.add_item("4600000000022")
+    session.add_item("4600000000022")
+    session.set_comment("WB_00000002", "", "хрупкое")
+    session.set_comment("WB_00000002", "4600000000022", "с браком")
+    session.select_box("BOX,1")
+    session.add_item("ITEM,2")
+    session.set_comment("BOX,1", "ITEM,2", "запятые")
+    session.set_item_count("WB_00000001", "4600000000015", 7)
+    session.rename_box("WB_00000002", "WB_00000003")
+    session.rename_item("WB_00000001", "OZN12345", "OZN54321")
+    session.select_box("WB_00000004")
+    session.add_item("4600000000039")
+    session.delete_item("WB_00000004", "4600000000039")
+    session.select_box("WB_00000005")
+    session.add_item("4600000000046")
+    session.set_item_count("WB_00000001", "4600000000008", 0)
+    session.set_setting("barcode_profile", "ozon")
+    session.select_box("WB_00000003")
+
+
+def contents(session):
+    # Order matters: it is the order of the tree, the CSV and the Excel sheets
+    return ([(box_barcode, list(items.items())) for box_barcode, items in session.all_boxes.items()],
+            session.comments, session.current_box_barcode, session.settings)
+
+
+class StateJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.dir, "state.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def reopen(self):
+        session = ScanSession(self.state_file)
+        session.load()
+        session.journal.close()
+        return session
+
+    def test_journal_only_replay(self):
+        # A crash before any snapshot: everything comes from the journal
+        session = ScanSession(self.state_file)
+        mutate(session)
+        session.journal.close()
+        self.assertFalse(os.path.exists(self.state_file))
+        self.assertEqual(contents(self.reopen()), contents(session))
+
+    def test_snapshot_on_close(self):
+        session = ScanSession(self.state_file)
+        mutate(session)
+        session.close()
+        self.assertEqual(os.path.getsize(self.state_file + ".journal"), 0)
+        self.assertEqual(contents(self.reopen()), contents(session))
+
+    def test_snapshot_plus_tail(self):
+        session = ScanSession(self.state_file, snapshot_every=7)
+        mutate(session)
+        session.journal.close()
+        with open(self.state_file) as f:
+            self.assertGreater(json.load(f)["journal_seq"], 0)
+        self.assertGreater(os.path.getsize(self.state_file + ".journal"), 0)
+        self.assertEqual(contents(self.reopen()), contents(session))
+
+    def test_records_already_in_snapshot_are_skipped(self):
+        # Crash after the snapshot was renamed into place, before the journal was truncated
+        session = ScanSession(self.state_file)
+        mutate(session)
+        with open(self.state_file + ".journal", "rb") as f:
+            old_journal = f.read()
+        session.close()
+        with open(self.state_file + ".journal", "wb") as f:
+            f.write(old_journal)
+        self.assertEqual(contents(self.reopen()), contents(session))
+
+    def test_torn_last_line(self):
+        session = ScanSession(self.state_file)
+        mutate(session)
+        session.journal.close()
+        journal_file = self.state_file + ".journal"
+        size = os.path.getsize(journal_file)
+        with open(journal_file, "a", encoding="utf-8") as f:
+            f.write('{"seq": 999, "op": "inc", "box": "WB_0000')
+
+        reopened = self.reopen()
+        self.assertEqual(contents(reopened), contents(session))
+        self.assertEqual(os.path.getsize(journal_file), size)
+
+        # Appends after the cut start on a clean line and survive the next reopen
+        reopened.add_item("4600000000053")
+        reopened.journal.close()
+        self.assertEqual(contents(self.reopen()), contents(reopened))
+
+    def test_legacy_flat_comment_keys(self):
+        legacy = {
+            "all_boxes": {"WB_1": {"4600000000008": 2}, "BOX": {"ITEM,2": 1}},
+            "comments": {"WB_1": "короб", "WB_1,4600000000008": "товар", "BOX,ITEM,2": "первая запятая"},
+            "current_box_barcode": "WB_1",
+            "strict_validation_enabled": False,
+        }
+        with open(self.state_file, "w") as f:
+            json.dump(legacy, f)
+        state = StateJournal(self.state_file).load()
+        self.assertEqual(state["comments"], {
+            "WB_1": {"": "короб", "4600000000008": "товар"},
+            "BOX": {"ITEM,2": "первая запятая"},
+        })
+        self.assertEqual(state["settings"], {"strict_validation_enabled": False})
+
+        # Written back nested, so commas in barcodes are no longer ambiguous
+        session = self.reopen()
+        session.save()
+        with open(self.state_file) as f:
+            self.assertEqual(json.load(f)["comments"], state["comments"])
+
+    def test_parse_comments_nested(self):
+        nested = {"BOX,1": {"": "a", "ITEM,2": "b"}}
+        self.assertEqual(parse_comments(nested), nested)
+
+
+if __name__ == "__main__":
+    unittest.main()